@@ -8,6 +8,10 @@
      - Provides callbacks for playing
          play_noise
          play_model
+     - Runs the trigger stream : an output stream opened at boot and never
+       stopped, starting a primed (pre-rendered) sound at a sample-accurate
+       position after each timestamped gate, and measuring the
+       gate-to-first-sample latency
 
  Author               :  Ninon Devis, Philippe Esling, Martin Vert
                         <{devis, esling}@ircam.fr>
@@ -16,17 +20,40 @@
 
 """
 import time
+import threading
 
 import numpy as np
 import sounddevice as sd
-import librosa
+from lazy import lazy_import
+from buffers import RingBuffer
 from parallel import ProcessInput
-# from models.ddsp import DDSP
-# from models.nsf_impacts import NSF
-from models.rave import RAVE
+from shared_state import read_cvs
+from modulation import ModulationMatrix, publish_latents
+from boot import BootPhase, record_ready, format_report
+from models.registry import ModelRegistry
 from multiprocessing import Event, Process
 from config import config
 
+# Only loaded by load_sample
+librosa = lazy_import('librosa')
+
+
+def latency_percentiles(hist: np.ndarray, quantiles: list = [50, 90, 99]):
+    '''
+        Percentiles of the gate-to-sound latency from its histogram.
+        Parameters:
+            hist:       [np.ndarray]
+                        Counts of the 1 ms latency bins
+            quantiles:  [list], optional
+                        Percentiles to compute
+        Returns:
+            List of latencies (in ms), None if no trigger was measured
+    '''
+    total = np.sum(hist)
+    if total == 0:
+        return None
+    cumul = np.cumsum(hist)
+    return [int(np.searchsorted(cumul, total * q / 100.0)) for q in quantiles]
 
 
 class Audio(ProcessInput):
@@ -59,16 +86,56 @@ class Audio(ProcessInput):
         # Set devices default
         self.set_defaults()
         self._model_name = model
+        self._model = None
+        # Block-wise rendering functions of each model
+        self._renderers = {'rave': self.render_rave_block, 'nsf': self.render_nsf_block}
+        self._model_block = 0
         # Current block stream
         self._cur_stream = None
-        # Set model
+        # Set model registry (models are loaded in the audio process)
         self.load_model()
         # frame length
-        self.frame_len = 8192
+        self.frame_len = config.audio.frame_len
+        # Lookahead rendering (producer thread feeding the stream callback)
+        self._n_lookahead = config.audio.n_lookahead
+        self._ring = RingBuffer(self.frame_len * self._n_lookahead)
+        self._ring_space = threading.Event()
+        self._render_thread = None
+        # Parking of the render thread (model used by another task)
+        self._render_hold = threading.Event()
+        self._render_parked = threading.Event()
+        self._render_resume = threading.Event()
+        # Underruns counted by each thread (never written by the other one) :
+        # stream callback, and rings replaced by the render thread
+        self._callback_underruns = 0
+        self._ring_underruns = 0
+        # Trigger stream : every trigger starts a new generation, played
+        # from the primed blocks then from the ring of that generation
+        self._trigger_gate = config.audio.trigger_gate
+        self._trigger_latency = config.audio.trigger_latency
+        self._gen = 0
+        self._ring_gen = (0, self._ring)
+        self._primed = np.zeros(0, dtype=np.float32)
+        self._prime_pos = (0, 0)
+        self._need_prime = True
+        self._next_trigger = None
+        self._playing = False
+        self._play_primed = self._primed
+        self._play_pos = 0
         # For the sinewave & sample play
         self.start_idx = 0
         self.tmp_flag = 0
-        
+        self.sample = None
+        # CV to latent modulation (routing edited through the shared state)
+        self._modulation = None
+        self._n_latents = 0
+
+    def load_sample(self):
+        '''
+            Load the looping sample played through the model. Called in the
+            audio process (librosa is never imported by the parent process),
+            concurrently with the model loading.
+        '''
         self.sample, sr = librosa.load("data/Alborosie.wav", sr=self._sr, duration=10.0)
         print("loaded sample, normalized from", np.amax(self.sample))
         self.sample = self.sample / np.amax(self.sample)
@@ -77,20 +144,79 @@ class Audio(ProcessInput):
         print(self.max_idx, "max idx")
 
     def load_model(self):
-        # if self._model_name == 'ddsp':
-        #     self._model = DDSP()
-        # elif self._model_name == 'nsf':
-        #     self._model = NSF()
-        if self._model_name == 'rave':
-            self._model = RAVE()
-        else:
+        '''
+            Create the model registry. Models are only loaded when first
+            activated (in the audio process), then kept warm in memory.
+        '''
+        if self._model_name not in self._renderers:
             raise NotImplementedError
+        self._registry = ModelRegistry(device=config.audio.device, n_warm=config.audio.n_warm)
+
+    def select_model(self, state, name: str):
+        '''
+            Request a switch of the active model. The model is loaded in the
+            background and swapped between two blocks (see swap_model).
+            Parameters:
+                name:       [str]
+                            Name of the model to activate
+        '''
+        if name not in self._renderers:
+            print('Model ' + name + ' cannot be rendered block-wise')
+            return
+        if self._render_thread is None:
+            # No stream to keep alive : switch immediately
+            state["audio"]["mode"].value = config.audio.mode_busy
+            self._registry.request(name)
+            self._registry.wait()
+            self.swap_model(state)
+            state["audio"]["mode"].value = config.audio.mode_idle
+            return
+        self._registry.request(name)
+
+    def swap_model(self, state):
+        '''
+            Install the pending model (if any) at a block boundary, without
+            stopping the stream. Called by the render thread only.
+        '''
+        if not self._registry.swap():
+            return
+        model = self._registry.active
+        if getattr(model, 'sr', self._sr) != self._sr:
+            print('Model ' + self._registry.active_name + ' runs at ' + str(model.sr) + ' Hz, stream is ' + str(self._sr) + ' Hz')
+        self._model = model
+        self._model_name = self._registry.active_name
+        self._model_block = 0
+        self._n_latents = publish_latents(state, getattr(model, 'n_latents', None) or 0)
+        # The primed blocks belong to the previous model
+        self._need_prime = True
+        state["audio"]["model"].value = self._model_name.encode("utf-8")
 
     def callback(self, state, queue):
         # First perform a model burn-in
         # print('Performing model burn-in')
         state["audio"]["mode"].value = config.audio.mode_burnin
-        self._model.preload()
+        # The sample is decoded while the device and model are initialized
+        def sample_phase():
+            with BootPhase(state, 'sample'):
+                self.load_sample()
+        sample_thread = threading.Thread(target=sample_phase)
+        sample_thread.start()
+        with BootPhase(state, 'device'):
+            import torch
+            if config.audio.device.startswith('cuda') and torch.cuda.is_available():
+                torch.cuda.init()
+        with BootPhase(state, 'model'):
+            self._model = self._registry.activate(self._model_name)
+        state["audio"]["model"].value = self._model_name.encode("utf-8")
+        self._n_latents = publish_latents(state, getattr(self._model, 'n_latents', None) or 0)
+        sample_thread.join()
+        # Render the primed blocks (whole rendering path warm)
+        with BootPhase(state, 'first_render'):
+            self.prime(state)
+        # The trigger stream runs from now on, waiting for gates
+        self.start_stream(state)
+        record_ready(state)
+        print('\n'.join(['[Boot] ' + l for l in format_report(state)]))
         # Then switch to wait (idle) mode
         print('Audio ready')
         state["audio"]["mode"].value = config.audio.mode_idle
@@ -103,9 +229,54 @@ class Audio(ProcessInput):
                 self.handle_signal_event(state)
 
     def handle_signal_event(self, state):
-        cur_event = state["audio"]["event"]
+        cur_event = state["audio"]["event"].value
         if cur_event in [config.events.gate0]:
             self.play_model_block(state)
+        elif cur_event == config.events.model_select:
+            self.select_model(state, state["audio"]["model"].value.decode("utf-8"))
+        elif cur_event == config.events.model_reload:
+            self._registry.reload(self._model_name)
+        elif cur_event == config.events.model_benchmark:
+            self.run_benchmark(state)
+
+    def run_benchmark(self, state):
+        '''
+            Benchmark the currently loaded model and save the results
+            in the benchmarks folder.
+        '''
+        from benchmark import Benchmark
+        state["audio"]["mode"].value = config.audio.mode_busy
+        bench = Benchmark(device=self._registry.device, n_runs=10)
+        # The render thread shares the model : it is parked for the whole
+        # sweep (the sound is cut), see benchmark.py for offline runs
+        paused = self.pause_render()
+        try:
+            results = bench.run([self._model_name], {self._model_name: self._model})
+        finally:
+            if paused:
+                self.resume_render()
+        results['context'] = 'audio process'
+        results['render_paused'] = paused
+        Benchmark.save(results, 'benchmarks/' + self._model_name + time.strftime('_%Y%m%d_%H%M%S') + '.json')
+        state["audio"]["mode"].value = config.audio.mode_idle
+
+    def pause_render(self):
+        '''
+            Park the render thread between two blocks, so that the model can
+            be used by another task. Returns True if a thread was parked.
+        '''
+        if self._render_thread is None:
+            return False
+        self._render_parked.clear()
+        self._render_hold.set()
+        self._ring_space.set()
+        self._render_parked.wait()
+        return True
+
+    def resume_render(self):
+        ''' Restart a render thread parked by pause_render '''
+        self._render_hold.clear()
+        self._render_resume.set()
 
     def set_defaults(self):
         '''
@@ -131,57 +302,218 @@ class Audio(ProcessInput):
         tmp = np.expand_dims(tmp, 0)
         return tmp
 
-    def play_model_block(self, state, wait: bool = True):
-        def callback_block(outdata, frames, time_c, status):
-            start_time = time.time()
-            # # sin = self.get_sin(frames) 
-
-            ####################
-            # Sample generation
-            sample = self.sample[self.start_idx:self.start_idx + frames]  # 154336,
-            self.start_idx += frames
-            if self.start_idx >= self.max_idx:
-                self.start_idx = 0
-                print("sample looped")
-            sample = np.expand_dims(sample, 0)
-            sample = np.expand_dims(sample, 0)
-            lats = self._model.encode(sample)
-            print(lats.shape)
-            # if state['cv_active'][2]:
-                # print("*", state['cv'][2], "for lat 0")
-                # lats[0][0] *= state['cv'][2] 
-            if state['cv_active'][3]:
-                print("*", state['cv'][3], "for lat 1")
-                lats[0][1] *= state['cv'][3] 
-            if state['cv_active'][4]:
-                lats[0][2] *= state['cv'][4] 
-            if state['cv_active'][5]:
-                lats[0][3] *= state['cv'][5] 
-            cur_data = self._model.decode(lats)[0]
-
-            # # print("input shape", sample.shape)  # Must be [1, 1, frames]
-            # # cur_data = self.sample[self.start_idx:self.start_idx + frames]
-            # print("output shape", cur_data.shape)  # Must be [frames]
-            
-            # cur_data = self._model.generate_random(2)
-            
-            # outdata[:] = np.random.rand(frames, 1)
-            # print("noise")
-
-            if cur_data is None:
-                raise sd.CallbackStop()
-            outdata[:] = cur_data[:, np.newaxis]
-            print("time:", time.time() - start_time)
-
-        if self._cur_stream == None:
-            self._cur_stream = sd.OutputStream(blocksize=self.frame_len, callback=callback_block, channels=1, samplerate=self._sr)
-            self._cur_stream.start()
-            print('Stream launched')
-        elif not self._cur_stream.active:
+    def render_model_block(self, state):
+        '''
+            Render the next block of audio with the active model (swapped
+            beforehand if a new one is ready). This is called by the render
+            thread only.
+        '''
+        self.swap_model(state)
+        return self._renderers[self._model_name](state)
+
+    def render_nsf_block(self, state):
+        '''
+            Render the next block of audio by concatenating the blocks
+            generated by the NSF thread (looping over the sound).
+        '''
+        audio = np.zeros(self.frame_len, dtype=np.float32)
+        pos = 0
+        while pos < self.frame_len:
+            block = self._model.request_block_threaded(self._model_block)
+            if block is None:
+                # End of the sound (or not generated yet) : restart
+                self._model_block = 0
+                break
+            n = min(len(block), self.frame_len - pos)
+            audio[pos:pos + n] = block[:n]
+            pos += n
+            self._model_block += 1
+        return audio
+
+    def render_rave_block(self, state):
+        '''
+            Render the next block of audio by decoding the latents of the
+            looping sample (encoded once), modulated by the CVs.
+        '''
+        # The loop is encoded once (per model and sample), then only decoded
+        if not self._model.has_track(self.sample):
+            self._model.encode_track(self.sample, self.frame_len)
+        lats = self._model.latent_block(self.start_idx // self.frame_len)
+        self.start_idx += self.frame_len
+        if self.start_idx >= self.max_idx:
+            self.start_idx = 0
+        # Smoothed latent gains from a CV snapshot (one vectorized evaluation)
+        if self._modulation is None or self._modulation.n_latents != self._n_latents:
+            self._modulation = ModulationMatrix(state, self.frame_len / self._sr, config.audio.mod_smoothing,
+                                                self._n_latents)
+        cv, cv_active = read_cvs(state)
+        gains = self._modulation.process(cv, cv_active, lats.shape[-1])
+        lats = self._model.modulate(lats, gains)
+        return self._model.decode(lats)[0].numpy()
+
+    def prime(self, state):
+        '''
+            Render the first n_lookahead blocks of the sound, played as soon
+            as a trigger arrives while the render thread refills the ring.
+            The render position after these blocks is kept, so that every
+            generation continues right after the primed blocks.
+        '''
+        self._need_prime = False
+        self.start_idx, self._model_block = 0, 0
+        blocks = [np.ravel(self.render_model_block(state)) for _ in range(self._n_lookahead)]
+        self._prime_pos = (self.start_idx, self._model_block)
+        self._primed = np.concatenate(blocks).astype(np.float32)
+
+    def render_loop(self, state):
+        '''
+            Producer thread : renders blocks ahead of the playback position
+            and writes them into the ring buffer, up to n_lookahead blocks.
+            A new trigger restarts the rendering right after the primed
+            blocks, in a fresh ring buffer. The thread parks between two
+            blocks on request (see pause_render).
+        '''
+        block_time = self.frame_len / self._sr
+        report_time = time.monotonic()
+        while True:
+            if self._render_hold.is_set():
+                self._render_parked.set()
+                self._render_resume.wait()
+                self._render_resume.clear()
+                continue
+            self._ring_space.clear()
+            if self._need_prime:
+                self.prime(state)
+            gen, ring = self._ring_gen
+            if gen != self._gen:
+                self._ring_underruns += ring.underruns
+                self.start_idx, self._model_block = self._prime_pos
+                ring = RingBuffer(self.frame_len * self._n_lookahead)
+                self._ring_gen = (self._gen, ring)
+            state['audio']['underruns'].value = self._callback_underruns + self._ring_underruns + ring.underruns
+            state['audio']['overruns'].value = ring.overruns
+            if time.monotonic() - report_time > config.audio.latency_report:
+                report_time = time.monotonic()
+                self.report_latency(state)
+            if ring.free() < self.frame_len:
+                self._ring_space.wait(block_time)
+                continue
+            ring.write(np.ravel(self.render_model_block(state)))
+
+    def report_latency(self, state):
+        ''' Print the gate-to-sound latency percentiles (if any trigger) '''
+        hist = state['audio']['latency_hist']
+        percentiles = latency_percentiles(hist)
+        if percentiles is None:
+            return
+        print('[Audio] Gate-to-sound latency p50 %d ms / p90 %d ms / p99 %d ms (%d triggers, %d late, %d dropped)'
+              % tuple(percentiles + [np.sum(hist), state['audio']['latency_late'].value, state['triggers'].dropped]))
+
+    def dac_time(self, time_c):
+        '''
+            Time (time.monotonic) at which the first sample of the current
+            callback block reaches the converter.
+        '''
+        now = time.monotonic()
+        if time_c.outputBufferDacTime > 0 and time_c.currentTime > 0:
+            return now + max(time_c.outputBufferDacTime - time_c.currentTime, 0)
+        return now + self._cur_stream.latency
+
+    def poll_trigger(self, state, dac_time: float, frames: int):
+        '''
+            Pop the pending triggers of the trigger gate, and return the
+            sample offset in the current block at which the sound starts,
+            None if no sound starts in this block.
+        '''
+        triggers = state['triggers']
+        while triggers.pending() > 0:
+            t_gate, gate = triggers.pop()
+            if gate == self._trigger_gate:
+                self._next_trigger = t_gate
+        if self._next_trigger is None:
+            return None
+        # Sound scheduled at a fixed latency after the gate
+        offset = int(round((self._next_trigger + self._trigger_latency - dac_time) * self._sr))
+        if offset >= frames:
+            return None
+        if offset < 0:
+            if self._trigger_latency > 0:
+                state['audio']['latency_late'].value += 1
+            offset = 0
+        # Gate-to-first-sample latency (1 ms bins, last bin for the rest)
+        latency = dac_time + offset / self._sr - self._next_trigger
+        hist = state['audio']['latency_hist']
+        hist[min(max(int(latency * 1000), 0), hist.shape[0] - 1)] += 1
+        self._next_trigger = None
+        return offset
+
+    def fill_block(self, out: np.ndarray):
+        '''
+            Copy the current sound into an output block : primed blocks
+            first, then the ring of the current generation (silence when
+            no sound is playing or the ring is not ready yet).
+        '''
+        if not self._playing:
+            out[:] = 0
+            return
+        n = 0
+        if self._play_pos < self._play_primed.shape[0]:
+            n = min(out.shape[0], self._play_primed.shape[0] - self._play_pos)
+            out[:n] = self._play_primed[self._play_pos:self._play_pos + n]
+            self._play_pos += n
+        if n < out.shape[0]:
+            gen, ring = self._ring_gen
+            if gen == self._gen:
+                ring.read_into(out[n:])
+            else:
+                out[n:] = 0
+                self._callback_underruns += 1
+
+    def callback_block(self, outdata, frames, time_c, status):
+        '''
+            Stream callback : starts the sound at the sample position of the
+            triggers, and only copies pre-rendered audio.
+        '''
+        if status.output_underflow:
+            self._callback_underruns += 1
+        out = outdata[:, 0]
+        offset = self.poll_trigger(self._state, self.dac_time(time_c), frames)
+        if offset is None:
+            self.fill_block(out)
+        else:
+            self.fill_block(out[:offset])
+            # Restart on the primed blocks, the render thread follows
+            self._gen += 1
+            self._play_primed, self._play_pos = self._primed, 0
+            self._playing = True
+            self.fill_block(out[offset:])
+        self._ring_space.set()
+
+    def start_stream(self, state):
+        '''
+            Start the render thread and open the trigger stream. The stream
+            keeps running (silent between sounds) so that a trigger never
+            waits for a device to open.
+        '''
+        self._state = state
+        if self._render_thread is None:
+            self._render_thread = threading.Thread(target=self.render_loop, args=(state,), daemon=True)
+            self._render_thread.start()
+        if self._cur_stream is not None and self._cur_stream.active:
+            return
+        if self._cur_stream is not None:
             print('Restart stream')
             self._cur_stream.close()
-            self._cur_stream = sd.OutputStream(blocksize=self.frame_len, callback=callback_block, channels=1, samplerate=self._sr)
-            self._cur_stream.start()
+        self._cur_stream = sd.OutputStream(blocksize=config.audio.trigger_block, callback=self.callback_block,
+                                           channels=1, samplerate=self._sr, latency='low')
+        self._cur_stream.start()
+        print('Stream launched (latency %.1f ms)' % (self._cur_stream.latency * 1000))
+
+    def play_model_block(self, state, wait: bool = True):
+        '''
+            Gate event : the sound itself is started by the stream callback
+            from the trigger queue, this only makes sure the stream runs.
+        '''
+        self.start_stream(state)
     
     ###########################################
     
@@ -0,0 +1,197 @@
+"""
+
+ ~ Neurorack project ~
+ Benchmark : Latency and throughput measurements of the deep models
+
+ This file allows to time every model wrapper (RAVE, NSF, DDSP) on
+ synthetic inputs, by sweeping over block sizes, batch sizes and
+ latent lengths. Results are stored as JSON so that different model
+ checkpoints can be compared against each other.
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import os
+import json
+import time
+import platform
+
+import numpy as np
+
+from models.features import file_hash
+from models.registry import create_model
+
+
+def checkpoint_hash(path: str):
+    ''' SHA-1 of a checkpoint file, as in the cache keys (None if it does not exist) '''
+    if not os.path.exists(path):
+        return None
+    return file_hash(path)
+
+
+class Benchmark():
+    '''
+        The Benchmark class times the generation functions of the model
+        wrappers and reports latency percentiles and real-time factors.
+    '''
+
+    def __init__(self,
+                 device: str = 'cpu',
+                 block_sizes: list = [2048, 4096, 8192],
+                 batch_sizes: list = [1, 2, 4],
+                 lengths: list = [4, 12, 24, 48],
+                 n_runs: int = 20,
+                 n_warmup: int = 2):
+        '''
+            Constructor - Creates a new instance of the Benchmark class.
+            Parameters:
+                device:         [str], optional
+                                Device on which models are created [default: cpu]
+                block_sizes:    [list], optional
+                                Audio block sizes (in samples) for block-wise generation
+                batch_sizes:    [list], optional
+                                Batch sizes for every case
+                lengths:        [list], optional
+                                Latent (or feature frames) lengths for random generation
+                n_runs:         [int], optional
+                                Number of timed runs per case
+                n_warmup:       [int], optional
+                                Number of untimed runs per case
+        '''
+        self._device = device
+        self._block_sizes = block_sizes
+        self._batch_sizes = batch_sizes
+        self._lengths = lengths
+        self._n_runs = n_runs
+        self._n_warmup = n_warmup
+
+    def cases_rave(self, model):
+        for block in self._block_sizes:
+            for batch in self._batch_sizes:
+                x = np.random.randn(batch, 1, block).astype(np.float32)
+                yield 'block', block, batch, lambda x=x: model.decode(model.encode(x))
+        for length in self._lengths:
+            for batch in self._batch_sizes:
+                yield 'random', length, batch, lambda l=length, b=batch: model.generate_random(l, b)
+                yield 'prior', length, batch, lambda l=length, b=batch: model.generate_prior(l, b)
+
+    def cases_nsf(self, model):
+        import torch
+        upsamp_rate = model._model.upsamp_rate
+        for block in self._block_sizes:
+            for batch in self._batch_sizes:
+                # Voiced synthetic features (last dimension is the f0)
+                x = torch.rand(batch, block // upsamp_rate, model._model.input_dim, device=self._device)
+                x[:, :, -1] = 220.0
+                yield 'block', block, batch, lambda x=x: model.generate(x)
+        for length in self._lengths:
+            for batch in self._batch_sizes:
+                yield 'random', length, batch, lambda l=length, b=batch: model.generate_random(l, b)
+
+    def cases_ddsp(self, model):
+        for length in self._lengths:
+            for batch in self._batch_sizes:
+                yield 'random', length, batch, lambda l=length, b=batch: model.generate_random(l, b)
+
+    def time_case(self, func):
+        '''
+            Time a generation function.
+            Returns:
+                List of latencies (in seconds) and output length (in samples)
+        '''
+        for _ in range(self._n_warmup):
+            out = func()
+        times = []
+        for _ in range(self._n_runs):
+            cur_time = time.perf_counter()
+            out = func()
+            times.append(time.perf_counter() - cur_time)
+        return times, int(np.asarray(out).shape[-1])
+
+    def run_model(self, name: str, model=None):
+        '''
+            Benchmark a single model.
+            Parameters:
+                name:       [str]
+                            Name of the model (rave, nsf, ddsp)
+                model:      [object], optional
+                            Already loaded wrapper (otherwise created on device)
+            Returns:
+                Dictionary of results for this model
+        '''
+        results = {'model': name, 'device': self._device, 'cases': []}
+        try:
+            if model is None:
+                model = create_model(name, self._device)
+                model.load_model()
+            results['checkpoint'] = model.m_path
+            results['checkpoint_sha1'] = checkpoint_hash(model.m_path)
+            for case, size, batch, func in getattr(self, 'cases_' + name)(model):
+                times, n_samples = self.time_case(func)
+                duration = n_samples / model.sr
+                p50, p95, p99 = np.percentile(times, [50, 95, 99])
+                results['cases'].append({
+                    'case': case,
+                    'size': size,
+                    'batch': batch,
+                    'n_samples': n_samples,
+                    'mean': float(np.mean(times)),
+                    'p50': float(p50),
+                    'p95': float(p95),
+                    'p99': float(p99),
+                    # Real-time factor (< 1 means faster than real-time)
+                    'rtf': float(p50 / duration),
+                    # Generated seconds of audio per second of compute
+                    'throughput': float(batch * duration / p50)})
+                print('[Benchmark] %s - %s %d x %d : p50 %.2f ms / p99 %.2f ms / rtf %.3f' % (
+                    name, case, size, batch, p50 * 1e3, p99 * 1e3, p50 / duration))
+        except Exception as e:
+            print('[Benchmark] %s failed : %s' % (name, str(e)))
+            results['error'] = str(e)
+        return results
+
+    def run(self, names: list, models: dict = None):
+        '''
+            Benchmark a list of models.
+            Parameters:
+                names:      [list]
+                            Names of the models to benchmark
+                models:     [dict], optional
+                            Already loaded wrappers (indexed by name)
+        '''
+        import torch
+        models = models or {}
+        return {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'host': platform.node(),
+            'torch': torch.__version__,
+            'runs': self._n_runs,
+            'models': [self.run_model(n, models.get(n)) for n in names]}
+
+    @staticmethod
+    def save(results: dict, path: str):
+        ''' Write results to a JSON file '''
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('[Benchmark] Results saved to ' + path)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Neurorack models benchmark')
+    parser.add_argument('--models',         type=str, nargs='+', default=['rave', 'nsf', 'ddsp'], help='models to benchmark')
+    parser.add_argument('--device',         type=str, default='cpu',        help='device cuda or cpu')
+    parser.add_argument('--blocks',         type=int, nargs='+', default=[2048, 4096, 8192], help='block sizes')
+    parser.add_argument('--batches',        type=int, nargs='+', default=[1, 2, 4], help='batch sizes')
+    parser.add_argument('--lengths',        type=int, nargs='+', default=[4, 12, 24, 48], help='latent lengths')
+    parser.add_argument('--runs',           type=int, default=20,           help='number of timed runs')
+    parser.add_argument('--output',         type=str, default='benchmarks/benchmark.json', help='output JSON file')
+    args = parser.parse_args()
+    bench = Benchmark(args.device, args.blocks, args.batches, args.lengths, args.runs)
+    Benchmark.save(bench.run(args.models), args.output)
@@ -0,0 +1,191 @@
+"""
+
+ ~ Neurorack project ~
+ Boot : Startup orchestration and profiling
+
+ This file defines the boot sequence of the rack as a set of phases with
+ dependencies. Independent phases run concurrently in threads, every
+ phase is timed, and the durations are published in the shared state
+ (config.boot.phases) so that the phases running in the child processes
+ (device init, sample and model load, first render) end up in the same startup
+ report, printed to the log and summarized on the screen (total and
+ slowest phases).
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import config
+
+
+def record_phase(state, name: str, duration: float, verbose: bool = True):
+    '''
+        Publish the duration of a boot phase in the shared state.
+        Parameters:
+            state:      [dict]
+                        Shared state of the rack
+            name:       [str]
+                        Name of the phase (in config.boot.phases)
+            duration:   [float]
+                        Duration of the phase (in seconds)
+            verbose:    [bool], optional
+                        Print the duration in the log [default: True]
+    '''
+    if verbose:
+        print('[Boot] %-12s %7.3f s' % (name, duration))
+    if state is not None and name in config.boot.phases:
+        state['boot'][config.boot.phases.index(name)] = duration
+
+
+def record_ready(state):
+    ''' Publish the time from the start of the boot to the ready state '''
+    record_phase(state, 'ready', time.time() - state['boot_start'].value)
+
+
+class BootPhase():
+    '''
+        Context manager timing a phase and publishing it in the shared state
+    '''
+
+    def __init__(self, state, name: str):
+        self._state = state
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record_phase(self._state, self._name, time.perf_counter() - self._start)
+
+
+def format_report(state):
+    '''
+        Startup report from the shared state (phases not yet run are skipped).
+        Returns:
+            List of text lines
+    '''
+    lines = []
+    for name, duration in zip(config.boot.phases, state['boot']):
+        if duration >= 0:
+            lines.append('%-12s %6.2f s' % (name, duration))
+    return lines
+
+
+def format_summary(state, n_lines: int):
+    '''
+        Compact startup report for the screen : total boot time, then the
+        slowest phases (as many as fit in n_lines).
+        Returns:
+            List of at most n_lines text lines
+    '''
+    durations = [(d, name) for name, d in zip(config.boot.phases, state['boot']) if d >= 0 and name != 'ready']
+    ready = state['boot'][config.boot.phases.index('ready')]
+    lines = ['boot %.1f s' % ready if ready >= 0 else 'booting']
+    for duration, name in sorted(durations, reverse=True)[:max(n_lines - 1, 0)]:
+        lines.append('%s %.2f s' % (name, duration))
+    return lines[:n_lines]
+
+
+class Boot():
+    '''
+        The Boot class runs named phases with dependencies, concurrently
+        whenever their dependencies are satisfied, and times each of them.
+    '''
+
+    def __init__(self,
+                 n_workers: int = 4,
+                 t0: float = None):
+        '''
+            Constructor - Creates a new instance of the Boot class.
+            Parameters:
+                n_workers:  [int], optional
+                            Maximum number of concurrent phases [default: 4]
+                t0:         [float], optional
+                            Start of the boot (perf_counter) [default: now]
+        '''
+        self._n_workers = n_workers
+        self._phases = OrderedDict()
+        # (start, end) of every phase, relative to the start of the boot
+        self._t0 = time.perf_counter() if t0 is None else t0
+        self.times = OrderedDict()
+
+    def phase(self, name: str, func: callable, after: list = []):
+        '''
+            Add a phase to the boot sequence.
+            Parameters:
+                name:       [str]
+                            Name of the phase
+                func:       [callable]
+                            Function performing the phase
+                after:      [list], optional
+                            Names of the phases that must be finished before
+        '''
+        self._phases[name] = (func, list(after))
+
+    def record(self, name: str, start: float, end: float):
+        ''' Record a phase timed outside of the boot (perf_counter times) '''
+        self.times[name] = (start - self._t0, end - self._t0)
+
+    def _run_phase(self, name: str):
+        start = time.perf_counter()
+        self._phases[name][0]()
+        self.record(name, start, time.perf_counter())
+
+    def run(self):
+        '''
+            Run all phases, each one as soon as its dependencies are done.
+            Exceptions of the phases are raised once running phases end.
+        '''
+        done, running = set(), {}
+        with ThreadPoolExecutor(max_workers=self._n_workers) as executor:
+            while len(done) < len(self._phases):
+                for name, (func, after) in self._phases.items():
+                    if name in done or name in running.values():
+                        continue
+                    if all([a in done for a in after]):
+                        running[executor.submit(self._run_phase, name)] = name
+                if len(running) == 0:
+                    raise RuntimeError('Boot phases have circular dependencies')
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done.add(running.pop(future))
+
+    def publish(self, state):
+        ''' Publish the duration of every phase in the shared state '''
+        for name, (start, end) in self.times.items():
+            record_phase(state, name, end - start, verbose=False)
+
+    def report(self):
+        '''
+            Timeline of the boot phases.
+            Returns:
+                List of text lines (start and duration of every phase)
+        '''
+        lines = ['%-12s %7s %7s' % ('phase', 'start', 'time')]
+        for name, (start, end) in sorted(self.times.items(), key=lambda t: t[1][0]):
+            lines.append('%-12s %6.2fs %6.2fs' % (name, start, end - start))
+        return lines
+
+
+if __name__ == '__main__':
+    # Dry run of a boot sequence with the dependencies of the rack
+    boot = Boot()
+    boot.phase('audio', lambda: time.sleep(0.5))
+    boot.phase('rotary', lambda: time.sleep(0.1))
+    boot.phase('cvs', lambda: time.sleep(0.1), after=['rotary'])
+    boot.phase('gpio', lambda: time.sleep(0.05), after=['cvs'])
+    boot.phase('screen', lambda: time.sleep(0.2), after=['gpio'])
+    boot.phase('button', lambda: time.sleep(0.05), after=['screen'])
+    start = time.perf_counter()
+    boot.run()
+    print('\n'.join(boot.report()))
+    print('Total %.2f s (sequential %.2f s)' % (time.perf_counter() - start, 1.0))
@@ -0,0 +1,286 @@
+"""
+
+ ~ Neurorack project ~
+ Buffers : Lock-free buffers shared between threads
+
+ This file defines the ring buffers used to decouple the (slow) model
+ rendering from the (real-time) audio callback, and the queue carrying
+ timestamped gate triggers from the CV process to the audio callback.
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+from ctypes import c_double, c_int, c_ulong
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+import numpy as np
+
+
+class RingBuffer():
+    '''
+        The RingBuffer class implements a single-producer / single-consumer
+        circular buffer over a preallocated array.
+        The producer only moves the write index and the consumer only moves
+        the read index, so that no lock is needed between both threads.
+    '''
+
+    def __init__(self,
+                 capacity: int,
+                 dtype: type = np.float32):
+        '''
+            Constructor - Creates a new instance of the RingBuffer class.
+            Parameters:
+                capacity:   [int]
+                            Maximum number of samples held by the buffer
+                dtype:      [type], optional
+                            Type of the samples [default: float32]
+        '''
+        self._capacity = capacity
+        self._data = np.zeros(capacity, dtype=dtype)
+        # Monotonic indices (position is index % capacity)
+        self._write_idx = 0
+        self._read_idx = 0
+        # Counters of failed operations
+        self.underruns = 0
+        self.overruns = 0
+
+    def available(self):
+        ''' Number of samples that can be read '''
+        return self._write_idx - self._read_idx
+
+    def free(self):
+        ''' Number of samples that can be written '''
+        return self._capacity - (self._write_idx - self._read_idx)
+
+    def write(self, data: np.ndarray):
+        '''
+            Copy a block of samples at the write position (producer side).
+            The block is dropped (and counted as overrun) if it does not fit.
+            Parameters:
+                data:       [np.ndarray]
+                            One-dimensional block of samples
+            Returns:
+                True if the block has been written
+        '''
+        n = data.shape[0]
+        if n > self.free():
+            self.overruns += 1
+            return False
+        start = self._write_idx % self._capacity
+        end = min(start + n, self._capacity)
+        self._data[start:end] = data[:end - start]
+        self._data[:n - (end - start)] = data[end - start:]
+        # Publish only once the data has been copied
+        self._write_idx += n
+        return True
+
+    def read_into(self, out: np.ndarray):
+        '''
+            Copy samples from the read position into an output array
+            (consumer side). Missing samples are zero-filled and counted
+            as an underrun.
+            Parameters:
+                out:        [np.ndarray]
+                            One-dimensional output array to fill
+            Returns:
+                Number of samples actually read
+        '''
+        n = min(out.shape[0], self.available())
+        start = self._read_idx % self._capacity
+        end = min(start + n, self._capacity)
+        out[:end - start] = self._data[start:end]
+        out[end - start:n] = self._data[:n - (end - start)]
+        if n < out.shape[0]:
+            out[n:] = 0
+            self.underruns += 1
+        self._read_idx += n
+        return n
+
+
+class TriggerQueue():
+    '''
+        The TriggerQueue class carries timestamped triggers from a single
+        producer process to a single consumer process, in shared memory.
+        The producer publishes the trigger count after writing the entry,
+        and the consumer keeps its own read index (a plain attribute, so it
+        is local to the consumer process). A consumer falling behind by
+        more than the capacity loses the oldest triggers.
+    '''
+
+    def __init__(self,
+                 capacity: int = 64):
+        '''
+            Constructor - Creates a new instance of the TriggerQueue class.
+            Must be created before the processes are forked.
+            Parameters:
+                capacity:   [int], optional
+                            Maximum number of pending triggers [default: 64]
+        '''
+        self._capacity = capacity
+        self._times = RawArray(c_double, capacity)
+        self._ids = RawArray(c_int, capacity)
+        self._count = RawValue(c_ulong, 0)
+        self._read_idx = 0
+        # Triggers lost by the consumer
+        self.dropped = 0
+
+    def push(self, timestamp: float, trigger_id: int = 0):
+        '''
+            Add a trigger (producer side).
+            Parameters:
+                timestamp:  [float]
+                            Time of the trigger (time.monotonic)
+                trigger_id: [int], optional
+                            Source of the trigger (e.g. gate index)
+        '''
+        idx = self._count.value % self._capacity
+        self._times[idx] = timestamp
+        self._ids[idx] = trigger_id
+        # Publish only once the entry has been written
+        self._count.value += 1
+
+    def pending(self):
+        ''' Number of triggers not yet popped (consumer side) '''
+        return self._count.value - self._read_idx
+
+    def pop(self):
+        '''
+            Get the oldest pending trigger (consumer side).
+            Returns:
+                Tuple (timestamp, trigger_id), or None if no trigger is pending
+        '''
+        count = self._count.value
+        if count - self._read_idx > self._capacity:
+            self.dropped += count - self._read_idx - self._capacity
+            self._read_idx = count - self._capacity
+        if self._read_idx == count:
+            return None
+        idx = self._read_idx % self._capacity
+        trigger = (self._times[idx], self._ids[idx])
+        self._read_idx += 1
+        return trigger
+
+    def clear(self):
+        ''' Drop all pending triggers (consumer side) '''
+        self._read_idx = self._count.value
+
+
+class BlockStore():
+    '''
+        The BlockStore class holds the fixed-size blocks of a whole sound in
+        a preallocated contiguous array, written by a generation thread
+        (producer) and read block by block by the audio thread (consumer).
+        Contract between both sides:
+            - the producer copies blocks, then publishes the write index
+              (number of blocks generated from the start of the sound)
+            - the consumer gets zero-copy views of the blocks below the
+              write index, a silent block (counted as underrun) when it
+              overtakes the producer, and None past the end of the sound
+            - blocks can be regenerated in place : each block is copied in a
+              single assignment (under the GIL a view is never half-copied
+              by Python threads), and the edges of the regenerated window
+              are crossfaded with the previous content so that the consumer
+              never hears a discontinuity, wherever it stands.
+    '''
+
+    def __init__(self,
+                 n_blocks: int,
+                 block_size: int = 512,
+                 fade_len: int = 64,
+                 dtype: type = np.float32):
+        '''
+            Constructor - Creates a new instance of the BlockStore class.
+            Parameters:
+                n_blocks:   [int]
+                            Number of blocks of the sound
+                block_size: [int], optional
+                            Number of samples per block [default: 512]
+                fade_len:   [int], optional
+                            Length of the crossfades (samples) [default: 64]
+                dtype:      [type], optional
+                            Type of the samples [default: float32]
+        '''
+        self.n_blocks = n_blocks
+        self.block_size = block_size
+        self._data = np.zeros(n_blocks * block_size, dtype=dtype)
+        self._silence = np.zeros(block_size, dtype=dtype)
+        # Fade windows are computed once (linear crossfade, as both sides
+        # are renderings of closely related features)
+        self._fade_in = ((np.arange(fade_len) + 0.5) / fade_len).astype(dtype)
+        self._fade_out = (1 - self._fade_in).astype(dtype)
+        self._tmp = np.zeros(fade_len, dtype=dtype)
+        # Producer (write) index and consumer (last read) index, in blocks
+        self._write_idx = 0
+        self.read_idx = -1
+        self.underruns = 0
+
+    @property
+    def written(self):
+        ''' Number of blocks generated from the start of the sound '''
+        return self._write_idx
+
+    def write(self, block_idx: int, audio: np.ndarray):
+        '''
+            Copy generated audio starting at a block (producer side).
+            Blocks past the end of the sound are dropped, and already
+            generated blocks are crossfaded at the edges of the window.
+            Parameters:
+                block_idx:  [int]
+                            Index of the first block
+                audio:      [np.ndarray]
+                            One-dimensional audio (multiple of block_size)
+            Returns:
+                Number of blocks written
+        '''
+        n = min(audio.shape[0] // self.block_size, self.n_blocks - block_idx)
+        if n <= 0:
+            return 0
+        n_fade = self._fade_in.shape[0]
+        start, end = block_idx * self.block_size, (block_idx + n) * self.block_size
+        for b in range(n):
+            new = audio[b * self.block_size:(b + 1) * self.block_size]
+            cur = self._data[start + b * self.block_size:start + (b + 1) * self.block_size]
+            regen = block_idx + b < self._write_idx
+            if not regen or (0 < b < n - 1) or n_fade == 0:
+                cur[:] = new
+                continue
+            # Build the crossfaded block aside, then copy it in one assignment
+            block = new.copy()
+            if b == 0 and block_idx > 0:
+                np.multiply(cur[:n_fade], self._fade_out, out=self._tmp)
+                block[:n_fade] = block[:n_fade] * self._fade_in + self._tmp
+            if b == n - 1 and end < self._write_idx * self.block_size:
+                np.multiply(cur[-n_fade:], self._fade_in, out=self._tmp)
+                block[-n_fade:] = block[-n_fade:] * self._fade_out + self._tmp
+            cur[:] = block
+        # Publish only once the data has been copied
+        if block_idx + n > self._write_idx and block_idx <= self._write_idx:
+            self._write_idx = block_idx + n
+        return n
+
+    def read(self, block_idx: int):
+        '''
+            Get a block (consumer side).
+            Parameters:
+                block_idx:  [int]
+                            Index of the block
+            Returns:
+                View of the block, silent block if not generated yet,
+                None past the end of the sound
+        '''
+        if block_idx >= self.n_blocks:
+            return None
+        self.read_idx = block_idx
+        if block_idx >= self._write_idx:
+            self.underruns += 1
+            return self._silence
+        return self._data[block_idx * self.block_size:(block_idx + 1) * self.block_size]
+
+    def reset(self):
+        ''' Forget all generated blocks (e.g. before a new sound) '''
+        self._write_idx = 0
+        self.read_idx = -1
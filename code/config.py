@@ -33,7 +33,38 @@ class config:
         # General screen properties
         volume      = 1.0
         stereo      = 0.0
+        # Block-based rendering properties
+        frame_len   = 2048
+        n_lookahead = 4
+        # Trigger stream (gate to sound) : stream block size, gate index,
+        # scheduled gate-to-sound latency in seconds (0 : as soon as possible)
+        trigger_block   = 256
+        trigger_gate    = 0
+        trigger_latency = 0.02
+        # Latency histogram (1 ms bins) and reporting period (seconds)
+        latency_bins    = 100
+        latency_report  = 10.0
+        # Number of models kept loaded in memory (least-recently used are evicted)
+        n_warm      = 2
+        # Device of the deep models
+        device      = 'cuda'
+        # CV to latent modulation : capacity of the shared routing (the
+        # number of latents is read from the loaded model), default routes
+        # (cv, latent), ranges of the route editor and time constant of
+        # the gain smoothing (seconds)
+        max_latents     = 16
+        mod_routes      = [(3, 1), (4, 2), (5, 3)]
+        mod_scale_range = [0.0, 4.0]
+        mod_curve_range = [0.25, 4.0]
+        mod_smoothing   = 0.05
     
+    class boot:
+        # Timed phases of the startup report (in order of display)
+        phases      = ['imports', 'state', 'audio', 'rotary', 'cvs', 'gpio', 'screen', 'button',
+                       'processes', 'device', 'sample', 'model', 'first_render', 'ready']
+        # Lines of the screen summary (total and slowest phases)
+        report_lines = 5
+
     class events:
         none        = -1
         button      = 0
@@ -44,6 +75,10 @@ class config:
         cv3         = 5
         cv4         = 6
         cv5         = 7
+        model_play  = 8
+        model_reload = 9
+        model_benchmark = 10
+        model_select = 11
 
     # Add the graphics classes
     colors = graph_cfg.colors
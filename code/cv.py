@@ -17,8 +17,11 @@ from parallel import ProcessInput
 from multiprocessing import Event
 import concurrent.futures
 import Jetson.GPIO as GPIO
-import matplotlib.pyplot as plt
 import numpy as np
+from lazy import lazy_import
+
+# Only used for debug plots
+plt = lazy_import('matplotlib.pyplot')
 
 
 class CVChannels(ProcessInput):
@@ -69,6 +72,13 @@ class CVChannels(ProcessInput):
         self._samples = 301
         self._plot = 1000
         self._n_active = 10
+        # History of the CV channels (circular, one row per CV)
+        n_cvs = len(self._cv_type)
+        self._ring = np.zeros((n_cvs, self._buffer))
+        self._ring_idx = np.zeros(n_cvs, dtype=int)
+        # Timing statistics (number of ticks kept and reporting period in seconds)
+        self._stats_size = 4096
+        self._report = 10.0
 
     # def irq_detect(self, channel):  # TODO: does not work.
     #     print('aaaaahaaahahahahahahah')
@@ -78,20 +88,33 @@ class CVChannels(ProcessInput):
         cur_time = time.monotonic()
         if cur_state == 0:
             if value > self._ref + self._eps:
-                state['cv'][cv_id] = cur_time
+                # Timestamped trigger, read directly by the audio callback
+                state['triggers'].push(cur_time, cv_id)
+                self.write_cv(state, cv_id, cur_time)
                 self._callback("gate", cv_id, value)
         else:
             elapsed_time = cur_time - state['cv'][cv_id]
             if (value < self._ref + self._eps) and (elapsed_time > self._gate_time):
-                state['cv'][cv_id] = 0
-
-    def handle_cv(self, cv_id, value, buffer, state):
-        # buffer.append(value)
-        if len(buffer) == self._buffer:
-            state['buffer'][cv_id] = buffer.copy()
-        # if len(plot[cv_id % 3]) == self._plot:
-        #    np.save("plot_" + str(cv_id) + ".npy", plot[cv_id % 3])
-        #    print('plot on ' + str(cv_id))
+                self.write_cv(state, cv_id, 0)
+
+    def write_cv(self, state, cv_id, value, active=None):
+        '''
+            Write a CV value (and optionally its activity) in the shared state.
+            Writes are wrapped in the CV seqlock so that readers get consistent snapshots.
+        '''
+        state['cv_seq'].write_begin()
+        state['cv'][cv_id] = value
+        if active is not None:
+            state['cv_active'][cv_id] = active
+        state['cv_seq'].write_end()
+
+    def handle_cv(self, cv_id, value, state):
+        # Publish the full history in chronological order (once filled)
+        if self._ring_idx[cv_id] < self._buffer:
+            return
+        idx = self._ring_idx[cv_id] % self._buffer
+        state['buffer'][cv_id, :self._buffer - idx] = self._ring[cv_id, idx:]
+        state['buffer'][cv_id, self._buffer - idx:] = self._ring[cv_id, :idx]
         # if (abs(state['cv'][cv_id] - value) > 0.1):
         #    self._callback("cv", cv_id, value)
 
@@ -100,47 +123,87 @@ class CVChannels(ProcessInput):
         hl.set_ydata(np.append(hl.get_ydata(), new_data))
         plt.draw()
 
+    def report(self, cv_full_id, times, n_ticks, n_skips, state):
+        '''
+            Compute and publish the achieved sample rate and jitter of an ADC.
+            Parameters:
+                times:      [np.ndarray]
+                            Circular buffer of the tick times
+                n_ticks:    [int]
+                            Total number of ticks
+                n_skips:    [int]
+                            Number of skipped ticks (deadline missed by more than one period)
+        '''
+        n = min(n_ticks, len(times))
+        if n < 2:
+            return
+        idx = n_ticks % len(times)
+        recent = np.concatenate((times[idx:n], times[:idx])) if n == len(times) else times[:n]
+        intervals = np.diff(recent)
+        rate = (n - 1) / (recent[-1] - recent[0])
+        jitter = np.std(intervals)
+        lateness = np.max(np.abs(intervals - 1.0 / self._rate))
+        n_chan = len(self._channels)
+        state['cv_rate'][cv_full_id * n_chan:(cv_full_id + 1) * n_chan] = rate
+        state['cv_jitter'][cv_full_id * n_chan:(cv_full_id + 1) * n_chan] = jitter
+        print('[CV] ADC {:#x} : {:8.2f} sps (target {:d}), jitter {:7.1f} us (max {:7.1f} us), {:d} skipped'.format(
+            self._i2c_addresses[cv_full_id], rate, self._rate, jitter * 1e6, lateness * 1e6, n_skips))
+
     def thread_read(self, cv, cv_full_id, state):
-        buffer = []
-        n_inactive = []
-        for i in range(3):
-            buffer.append([])
-            n_inactive.append(0)
-        # plot_points = []
-        # for i in range(3):
-        #     plot_points.append([])
-        sample_interval = 1.0 / self._rate
-        start = time.monotonic()
-        # time_next_sample = start + sample_interval
+        '''
+            Acquisition loop of one ADC, at a fixed rate.
+            Every tick reads all the channels of the ADC. Ticks follow an
+            absolute schedule (no drift), and the thread sleeps until the
+            next deadline. Deadlines missed by more than one period are
+            skipped (and counted) instead of being caught up.
+        '''
+        n_chan = len(self._channels)
+        ids = [(cv_full_id * n_chan) + c for c in range(n_chan)]
+        # Local copy of the last published values (avoids shared memory reads)
+        last = [state['cv'][cv_id] for cv_id in ids]
+        n_inactive = [0] * n_chan
+        # Timing
+        interval = 1.0 / self._rate
+        times = np.zeros(self._stats_size)
+        n_ticks, n_skips = 0, 0
+        next_time = time.monotonic()
+        last_report = next_time
         while True:
-            c = 0
-            for chan in self._channels:
-                cv_id = (cv_full_id * 3) + c
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            cur_time = time.monotonic()
+            times[n_ticks % self._stats_size] = cur_time
+            n_ticks += 1
+            for c, chan in enumerate(self._channels):
+                cv_id = ids[c]
+                value = cv.get_compensated_voltage(channel=chan, reference_voltage=self._ref)
                 if self._cv_type[cv_id] == "gate":
-                    value = cv.get_compensated_voltage(channel=chan, reference_voltage=self._ref)
                     self.handle_gate(cv_id, value, state)
-                if self._cv_type[cv_id] == "cv":
-                    # while time.monotonic() < time_next_sample:
-                    #    pass
-                    # time_next_sample = time.monotonic() + sample_interval
-                    value = cv.get_compensated_voltage(channel=chan, reference_voltage=self._ref)
-                    # Right now just append value to buffer
-                    buffer[cv_id % 3].append(value)
-                    if len(buffer[cv_id % 3]) > self._buffer:
-                        buffer[cv_id % 3].pop(0)
-                    if np.abs(value - state['cv'][cv_id]) < 0.05:
-                        n_inactive[cv_id % 3] += 1
-                        if n_inactive[cv_id % 3] > self._n_active and state['cv_active'][cv_id]:
-                            state['cv_active'][cv_id] = 0
+                elif self._cv_type[cv_id] == "cv":
+                    self._ring[cv_id, self._ring_idx[cv_id] % self._buffer] = value
+                    self._ring_idx[cv_id] += 1
+                    if abs(value - last[c]) < 0.05:
+                        n_inactive[c] += 1
+                        if n_inactive[c] == self._n_active + 1:
+                            self.write_cv(state, cv_id, last[c], 0)
                             # print('CV ' + str(cv_id) + ' going inactive')
                     else:
-                        if not state['cv_active'][cv_id]:
-                            # print('CV ' + str(cv_id) + ' going active')
-                            state['cv_active'][cv_id] = 1
-                        n_inactive[cv_id % 3] = 0
-                        self.handle_cv(cv_id, value, buffer[cv_id % 3], state)
-                        state['cv'][cv_id] = value
-                c += 1
+                        # print('CV ' + str(cv_id) + ' going active')
+                        n_inactive[c] = 0
+                        last[c] = value
+                        self.handle_cv(cv_id, value, state)
+                        self.write_cv(state, cv_id, value, 1)
+            # Schedule next tick (skip missed deadlines)
+            next_time += interval
+            late = time.monotonic() - next_time
+            if late > interval:
+                n_missed = int(late // interval)
+                n_skips += n_missed
+                next_time += n_missed * interval
+            if cur_time - last_report > self._report:
+                self.report(cv_full_id, times, n_ticks, n_skips, state)
+                last_report = cur_time
 
     def read_loop(self, state):
         with concurrent.futures.ThreadPoolExecutor(max_workers=(len(self._cvs) * len(self._channels))) as executor:
@@ -239,6 +302,14 @@ class CVChannels(ProcessInput):
 
 
 if __name__ == "__main__":
+    import argparse
+    from shared_state import create_state
+    parser = argparse.ArgumentParser(description='CV acquisition')
+    parser.add_argument('--rate',           type=int, default=3300,         help='acquisition rate (per ADC, all channels)')
+    parser.add_argument('--report',         type=float, default=2.0,        help='statistics reporting period (s)')
+    args = parser.parse_args()
     cv = CVChannels(None)
-    cv.callback({'cv': [0, 0, 0, 0, 0, 0]}, None)
+    cv._rate = args.rate
+    cv._report = args.report
+    cv.callback(create_state(), None)
     # cv.read()
@@ -209,7 +209,10 @@ class DynamicTextGraphic(TextGraphic):
         self._text = text.value
     
     def render(self, ctx=None):
-        self._text = str(self._dynamic_text.value)
+        value = self._dynamic_text.value
+        if type(value) == bytes:
+            value = value.decode('utf-8')
+        self._text = str(value)
         return super().render(ctx)
     
 class ButtonGraphic(TextGraphic):
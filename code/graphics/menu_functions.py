@@ -1,31 +1,59 @@
 # -*- coding: utf-8 -*-
+from config import config
+
 
 def model_play(state, signals, params):
     print('[Function] - Play model')
-    state["audio"]["event"].value = 'model_play'
+    state["audio"]["event"].value = config.events.model_play
     signals["audio"].set()
 
 
 def model_select(state, signals, params):
     print('[Function] - Select model')
-    state["audio"]["event"].value = 'model_play'
-    state["audio"]["model"].value = params["model"]
+    state["audio"]["event"].value = config.events.model_select
+    state["audio"]["model"].value = params["model"].encode("utf-8")
     signals["audio"].set()
-    pass
 
 
 def model_reload(state, signals, params):
     print('[Function] - Reload model')
-    state["audio"]["event"].value = 'model_reload'
+    state["audio"]["event"].value = config.events.model_reload
     signals["audio"].set()
 
 
-def model_benchmark(state, signal, params):
-    pass
+def model_benchmark(state, signals, params):
+    print('[Function] - Benchmark model')
+    state["audio"]["event"].value = config.events.model_benchmark
+    signals["audio"].set()
 
 
 def assign_cv(state, signal, params):
-    pass
+    '''
+        Edit the CV to latent modulation matrix from the route editor
+        (route_* sliders of the shared state). params['action'] is either
+        'assign' (route the chosen cv to the chosen latent, with the chosen
+        scale and curve) or 'clear' (remove all the routes of the chosen
+        cv). Without params, the default routing is restored.
+    '''
+    from modulation import assign_route, clear_route, format_routing
+    print('[Function] - Assign CV')
+    audio = state['audio']
+    n_cvs, capacity = state['modulation']['routed'].shape
+    cv = min(max(int(round(audio['route_cv'].value)), 0), n_cvs - 1)
+    latent = max(int(round(audio['route_latent'].value)), 0)
+    n_latents = audio['n_latents'].value or capacity
+    if params is None:
+        for c in range(n_cvs):
+            clear_route(state, c)
+        for c, l in config.audio.mod_routes:
+            assign_route(state, c, l)
+    elif params['action'] == 'clear':
+        clear_route(state, cv)
+    elif latent >= n_latents:
+        print('[Function] - Latent %d is beyond the %d latents of the model' % (latent, n_latents))
+    else:
+        assign_route(state, cv, latent, audio['route_scale'].value, 0.0, audio['route_curve'].value)
+    print('\n'.join(format_routing(state)))
 
 
 def assign_button(state, signal, params):
@@ -44,7 +44,8 @@ class MenuItem(Graphic):
                  signals: dict,
                  type: int,
                  command: str,
-                 confirm: bool = False):
+                 confirm: bool = False,
+                 params: dict = None):
         """
             Initializes a new instance of the Command class
             Parameters:
@@ -54,6 +55,8 @@ class MenuItem(Graphic):
                             The actual command to execute.
                 confirm:    bool
                             True to require confirmation before the command is executed, false otherwise. 
+                params:     dict
+                            Optional. Parameters passed to a function command (e.g. the chosen route). 
         """
         self._title = title
         self._type: int = type
@@ -61,6 +64,7 @@ class MenuItem(Graphic):
         self._command: str = command
         self._output: str = ''
         self._confirm: bool = confirm
+        self._params: dict = params
         self._running: bool = False
         self._active: bool = False
         self._graphic: Graphic = None
@@ -101,7 +105,8 @@ class MenuItem(Graphic):
             signals,
             type=data["type"],
             command=data["command"],
-            confirm=data["confirm"] if "confirm" in data.keys() else False
+            confirm=data["confirm"] if "confirm" in data.keys() else False,
+            params=data["params"] if "params" in data.keys() else None
         )
         return command
 
@@ -114,6 +119,8 @@ class MenuItem(Graphic):
                 confirmed:  int
                             Optional. Pass CONFIRM_OK to indicate the command has been confirmed. 
         """
+        if params is None:
+            params = self._params
         print('[Pushed command ' + self._title)
         if self._confirm and confirmed == config.menu.confirm_cancel:
             dial = ConfirmDialog()
@@ -0,0 +1,128 @@
+"""
+
+ ~ Neurorack project ~
+ Import budget : Import-time regression check of the entry point
+
+ This file imports a module (main by default) in a fresh interpreter
+ with -X importtime, and fails (exit code 1) if its total import time
+ goes over a budget, or if it imports one of the heavy modules that must
+ only be loaded lazily (after the processes fork). The slowest imports
+ are listed to find the culprits. For the main module, the pre-fork boot
+ phases are also run (constructor of the rack, processes not started),
+ to check that they do not load the heavy modules either.
+
+ Usage:
+     python import_budget.py --module main --budget 2.0
+     python import_budget.py --module main --no_boot
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import os
+import sys
+import subprocess
+
+
+def import_times(module: str, python: str = sys.executable):
+    '''
+        Import a module in a fresh interpreter with -X importtime.
+        Modules imported by the interpreter startup itself are skipped.
+        Returns:
+            List of (name, self, cumulative, depth) with times in seconds,
+            depth 0 being the modules imported directly by the statement
+    '''
+    startup = set([t[0] for t in _import_times('pass', python)])
+    return [t for t in _import_times('import ' + module, python) if t[0] not in startup]
+
+
+def _import_times(statement: str, python: str):
+    out = subprocess.run([python, '-X', 'importtime', '-c', statement],
+                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                         stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                         universal_newlines=True)
+    if out.returncode != 0:
+        raise ImportError(out.stderr.strip().split('\n')[-1])
+    times = []
+    for line in out.stderr.split('\n'):
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        t_self, t_cum, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        times.append((name.strip(), int(t_self) * 1e-6, int(t_cum) * 1e-6, depth))
+    return times
+
+
+def loaded_after(module: str, statement: str, python: str = sys.executable):
+    '''
+        Top-level packages loaded after importing a module and running a
+        statement (e.g. the pre-fork boot) in a fresh interpreter.
+    '''
+    code = 'import sys, %s; %s; print(" ".join(set(m.split(".")[0] for m in sys.modules)))'
+    out = subprocess.run([python, '-c', code % (module, statement)],
+                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                         stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+                         universal_newlines=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().split('\n')[-1])
+    return set(out.stdout.strip().split('\n')[-1].split(' '))
+
+
+def check(module: str, budget: float, forbidden: list, n_top: int = 10, boot: str = None):
+    '''
+        Check the import time of a module against a budget.
+        Parameters:
+            module:     [str]
+                        Module to import
+            budget:     [float]
+                        Maximum total import time (in seconds)
+            forbidden:  [list]
+                        Top-level packages that must not be imported
+            n_top:      [int], optional
+                        Number of slowest imports to list
+            boot:       [str], optional
+                        Statement running the pre-fork boot, after which
+                        the forbidden packages must still not be loaded
+        Returns:
+            True if the import is within budget
+    '''
+    times = import_times(module)
+    total = sum([t[2] for t in times if t[3] == 0])
+    print('Import of %s : %.3f s (budget %.3f s)' % (module, total, budget))
+    for name, t_self, t_cum, depth in sorted(times, key=lambda t: -t[1])[:n_top]:
+        print('    %-50s self %7.3f s / cumulative %7.3f s' % (name, t_self, t_cum))
+    imported = set([t[0].split('.')[0] for t in times])
+    heavy = [f for f in forbidden if f in imported]
+    if len(heavy) > 0:
+        print('Heavy modules imported eagerly : ' + ', '.join(heavy))
+    if boot is not None:
+        loaded = loaded_after(module, boot)
+        heavy_boot = [f for f in forbidden if f in loaded and f not in heavy]
+        if len(heavy_boot) > 0:
+            print('Heavy modules loaded by the boot (before fork) : ' + ', '.join(heavy_boot))
+        heavy += heavy_boot
+    return total <= budget and len(heavy) == 0
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Import-time budget of the entry point')
+    parser.add_argument('--module',     type=str,   default='main',     help='module to import')
+    parser.add_argument('--budget',     type=float, default=2.0,        help='maximum import time (s)')
+    parser.add_argument('--forbid',     type=str,   nargs='*',
+                        default=['matplotlib', 'sklearn', 'librosa', 'torch', 'tqdm'],
+                        help='packages that must be imported lazily')
+    parser.add_argument('--top',        type=int,   default=10,         help='number of slowest imports listed')
+    parser.add_argument('--boot',       type=str,   default=None,
+                        help='statement running the pre-fork boot [default for main: rack constructor]')
+    parser.add_argument('--no_boot',    action='store_true',               help='only check the import')
+    args = parser.parse_args()
+    if args.boot is None and args.module == 'main' and not args.no_boot:
+        args.boot = "main.Neurorack('rave')"
+    if not check(args.module, args.budget, args.forbid, args.top, args.boot):
+        print('FAILED')
+        sys.exit(1)
+    print('OK')
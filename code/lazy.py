@@ -0,0 +1,72 @@
+"""
+
+ ~ Neurorack project ~
+ Lazy : Deferred imports of heavy dependencies
+
+ This file defines module proxies that only import the actual module on
+ first attribute access. Heavy dependencies (librosa, matplotlib, sklearn)
+ declared this way at module level are not loaded by the main process
+ before it forks, and only the processes that really use them pay for
+ their import time and resident memory.
+
+ Usage:
+     librosa = lazy_import('librosa')
+     plt = lazy_import('matplotlib.pyplot')
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import sys
+import types
+import importlib
+import threading
+
+_import_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    '''
+        The LazyModule class is a placeholder for a module that is imported
+        (once, thread-safely) on the first access to one of its attributes.
+    '''
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with _import_lock:
+                module = self.__dict__['_lazy_module']
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return '<lazy module ' + self.__name__ + ' (' + state + ')>'
+
+
+def lazy_import(name: str):
+    '''
+        Module proxy importing name on first use (the module itself if it
+        is already imported).
+        Parameters:
+            name:       [str]
+                        Full name of the module (e.g. matplotlib.pyplot)
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
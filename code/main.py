@@ -12,15 +12,22 @@
  
 """
 
+import time
+# Start of the boot (wall clock, shared with child processes) and of the imports
+boot_start = time.time()
+imports_start = time.perf_counter()
+
 import Jetson.GPIO as GPIO
 from config import config
 from rotary import Rotary
 from cv import CVChannels
 from audio import Audio
 from button import Button
-import multiprocessing as mp
-from multiprocessing import Process, Manager, Queue, Value
-from ctypes import c_char_p
+from boot import Boot
+from multiprocessing import Process, Queue
+from shared_state import create_state
+
+imports_end = time.perf_counter()
 
 class Neurorack():
     '''
@@ -37,27 +44,28 @@ class Neurorack():
         '''
         # Main properties
         self._N_CVs = 6
+        self._model_name = model_name
+        # Boot sequence (timed phases, independent ones run concurrently)
+        self._boot = Boot(t0=imports_start)
+        self._boot.record('imports', imports_start, imports_end)
         # Init states of information
+        cur_time = time.perf_counter()
         self.init_state()
-        # Create audio engine
-        self._audio = Audio(self.callback_audio, model_name)
-        # Create rotary
-        self._rotary = Rotary(self.callback_rotary)
-        # Create CV channels
-        self._cvs = CVChannels(self.callback_cv)
-        # Perform GPIO cleanup
-        GPIO.cleanup()
-        # Need to import Screen after cleanup
-        from screen import Screen
-        self._screen = Screen(self.callback_screen)
-        # Create push button
-        self._button = Button(self.callback_button)
+        self._boot.record('state', cur_time, time.perf_counter())
+        self._state['boot_start'].value = boot_start
+        # Audio engine runs alongside the hardware chain (its sample and
+        # model are loaded in the audio process, after the fork)
+        self._boot.phase('audio', self.init_audio)
+        # Hardware keeps its original order : rotary, CVs, GPIO cleanup,
+        # screen (needs to be imported after cleanup) then push button
+        self._boot.phase('rotary', self.init_rotary)
+        self._boot.phase('cvs', self.init_cvs, after=['rotary'])
+        self._boot.phase('gpio', GPIO.cleanup, after=['cvs'])
+        self._boot.phase('screen', self.init_screen, after=['gpio'])
+        self._boot.phase('button', self.init_button, after=['screen'])
+        self._boot.run()
         # List of objects to create processes
         self._objects = [self._audio, self._screen, self._rotary, self._cvs, self._button]
-        # Find number of CPUs
-        self._nb_cpus = 4#mp.cpu_count()
-        # Create a pool of jobs
-        self._pool = mp.Pool(self._nb_cpus)
         # Handle signal informations
         self.set_signals()
         # Create a queue for sharing information
@@ -66,42 +74,34 @@ class Neurorack():
         for o in self._objects:
             self._processes.append(Process(target=o.callback, args=(self._state, self._queue)))
 
+    def init_audio(self):
+        ''' Create audio engine '''
+        self._audio = Audio(self.callback_audio, self._model_name)
+
+    def init_rotary(self):
+        ''' Create rotary '''
+        self._rotary = Rotary(self.callback_rotary)
+
+    def init_cvs(self):
+        ''' Create CV channels '''
+        self._cvs = CVChannels(self.callback_cv)
+
+    def init_screen(self):
+        ''' Create screen (needs to be imported after GPIO cleanup) '''
+        from screen import Screen
+        self._screen = Screen(self.callback_screen)
+
+    def init_button(self):
+        ''' Create push button '''
+        self._button = Button(self.callback_button)
+
     def init_state(self):
         '''
             Initialize the shared memory state for the full rack.
-            The global properties are shared by a multiprocessing manager.
-        '''
-        # Use a multi-processing Manager
-        self._manager = Manager()
-        self._state = self._manager.dict()
-        self._state['global'] = self._manager.dict()
-        self._state['cv'] = self._manager.list([0.0] * self._N_CVs)
-        self._state['cv_active'] = self._manager.list([0] * self._N_CVs)
-        self._state['buffer'] = self._manager.list([self._manager.list([1.0] * 301) for _ in range(self._N_CVs)])
-        self._state['rotary'] = self._manager.Value(int, 0)
-        self._state['rotary_delta'] = self._manager.Value(int, 0)
-        self._state['button'] = self._manager.Value(int, 0)
-        # Screen-related parameters (dict)
-        self._state['screen'] = self._manager.dict()
-        self._state['screen']['mode'] = self._manager.Value(int, 0)
-        self._state['screen']['event'] = self._manager.Value(int, 0)
-        # Audio-related parameters (dict)
-        self._state['audio'] = self._manager.dict()
-        self._state['audio']['mode'] = self._manager.Value(int, 0)
-        self._state['audio']['event'] = self._manager.Value(str, '')
-        self._state['audio']['volume'] = self._manager.Value(float, 1.0)
-        self._state['audio']['volume_range'] = [0.0, 1.0]
-        self._state['audio']['stereo'] = self._manager.Value(int, 0)
-        self._state['audio']['stereo_range'] = [-1.0, 1.0]
-        self._state['audio']['range'] = self._manager.Value(int, 0)
-        self._state['audio']['range_range'] = [0.0, 1.0]
-        # Stats (cpu, memory) computing
-        self._state['stats'] = self._manager.dict()
-        self._state['stats']['ip'] = self._manager.Value(c_char_p, "ip".encode('utf-8'))
-        self._state['stats']['cpu'] = self._manager.Value(c_char_p, "cpu".encode('utf-8'))
-        self._state['stats']['memory'] = self._manager.Value(c_char_p, "memory".encode('utf-8'))
-        self._state['stats']['disk'] = self._manager.Value(c_char_p, "disk".encode('utf-8'))
-        self._state['stats']['temperature'] = self._manager.Value(c_char_p, "temperature".encode('utf-8'))
+            The global properties are typed values in shared memory,
+            inherited by all processes.
+        '''
+        self._state = create_state(self._N_CVs)
         
     def set_signals(self):
         '''
@@ -148,24 +148,24 @@ class Neurorack():
         # print('CV callback')
         if type_cv == "gate":
             if cv_id == 0:
-                self._state['audio']['event'] = config.events.gate0
+                self._state['audio']['event'].value = config.events.gate0
                 self._signal_audio.set()
             else:
-                self._state['audio']['event'] = config.events.gate1
+                self._state['audio']['event'].value = config.events.gate1
                 self._signal_audio.set()
 
         elif type_cv == "cv":
             if cv_id == 2:
-                self._state['audio']['event'] = config.events.cv2
+                self._state['audio']['event'].value = config.events.cv2
                 self._signal_audio.set()
             elif cv_id == 3:
-                self._state['audio']['event'] = config.events.cv3
+                self._state['audio']['event'].value = config.events.cv3
                 self._signal_audio.set()
             elif cv_id == 4:
-                self._state['audio']['event'] = config.events.cv4
+                self._state['audio']['event'].value = config.events.cv4
                 self._signal_audio.set()
             else:
-                self._state['audio']['event'] = config.events.cv5
+                self._state['audio']['event'].value = config.events.cv5
                 self._signal_audio.set()
 
     def callback_rotary(self, channel, value):
@@ -186,8 +186,14 @@ class Neurorack():
         '''
             Start all parallel processses
         '''
+        cur_time = time.perf_counter()
         for p in self._processes:
             p.start()
+        self._boot.record('processes', cur_time, time.perf_counter())
+        # Startup report of the main process (child phases are added by the
+        # processes themselves in the shared state)
+        self._boot.publish(self._state)
+        print('\n'.join(['[Boot] ' + l for l in self._boot.report()]))
 
     def run(self):
         '''
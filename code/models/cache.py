@@ -0,0 +1,228 @@
+"""
+
+ ~ Neurorack project ~
+ Cache : Persistent cache of the compiled models
+
+ This file stores optimized TorchScript artifacts of the models (frozen,
+ and optimized for inference on CPU) keyed on the checkpoint content, the
+ torch version, the device and the version of the inference code path
+ (optimization options and exported methods), so that they are compiled
+ once and loaded directly on the next boots. The measured loading and
+ warm-up costs of every artifact are recorded next to them for reporting.
+ The profiling passes of the TorchScript executor are not part of the
+ artifact, so they are run again on every boot.
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import os
+import json
+import time
+import hashlib
+import inspect
+import threading
+
+from models.features import file_hash
+
+# Version of the inference code path, to bump when the way artifacts are
+# built changes outside of ModelCache.optimize (hashed with its source)
+CACHE_VERSION = 2
+
+
+class ModelCache():
+    '''
+        The ModelCache class compiles, stores and loads TorchScript modules,
+        and records their compilation, loading and warm-up costs.
+    '''
+
+    def __init__(self,
+                 cache_dir: str = 'models/cache',
+                 optimize: bool = True):
+        '''
+            Constructor - Creates a new instance of the ModelCache class.
+            Parameters:
+                cache_dir:  [str], optional
+                            Folder for the compiled artifacts
+                optimize:   [bool], optional
+                            Freeze and optimize the modules [default: True]
+        '''
+        self._cache_dir = cache_dir
+        self._optimize = optimize
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+
+    def key(self, checkpoint: str, device: str, tag: str = '', methods: list = []):
+        '''
+            Cache key of a checkpoint, from its content, the torch version,
+            the device type and the version of the inference code path (the
+            content hash is memoized, compute the key once and pass it
+            along anyway).
+            Parameters:
+                checkpoint: [str]
+                            Path of the checkpoint
+                device:     [str]
+                            Device of the model (cuda, cpu)
+                tag:        [str], optional
+                            Sub-module or variant of the checkpoint
+                methods:    [list], optional
+                            Exported methods kept besides forward
+        '''
+        import torch
+        name = os.path.splitext(os.path.basename(checkpoint))[0]
+        key = '%s-%s-torch%s-%s-%s' % (name, file_hash(checkpoint)[:16],
+                                       torch.__version__.replace('+', '_'),
+                                       torch.device(device).type,
+                                       self.code_hash(methods))
+        return key + ('-' + tag if tag else '')
+
+    def code_hash(self, methods: list = []):
+        ''' Short hash of the inference code path (options, methods, optimize) '''
+        code = hashlib.sha256()
+        code.update(('%d-%d-%s' % (CACHE_VERSION, self._optimize, ','.join(sorted(methods)))).encode())
+        try:
+            code.update(inspect.getsource(ModelCache.optimize).encode())
+        except (OSError, TypeError):
+            pass
+        return code.hexdigest()[:8]
+
+    def path(self, key: str):
+        ''' Path of a compiled artifact '''
+        return os.path.join(self._cache_dir, key + '.ts')
+
+    def record(self, key: str, **costs):
+        ''' Record costs (in seconds) of an artifact in the index '''
+        with self._lock:
+            self._index.setdefault(key, {}).update(costs)
+            os.makedirs(self._cache_dir, exist_ok=True)
+            tmp_path = self._index_path + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._index, f, indent=2)
+            os.replace(tmp_path, self._index_path)
+
+    def costs(self, key: str):
+        ''' Recorded costs of an artifact (empty if never recorded) '''
+        return self._index.get(key, {})
+
+    def optimize(self, module, device: str, methods: list = []):
+        '''
+            Freeze a scripted module (weights become constants) and optimize
+            it for inference on CPU. Falls back to the module as is if it
+            cannot be frozen.
+            Parameters:
+                module:     [torch.jit.ScriptModule]
+                            Scripted module
+                device:     [str]
+                            Device of the module
+                methods:    [list], optional
+                            Exported methods to keep besides forward
+        '''
+        import torch
+        methods = [m for m in methods if hasattr(module, m)]
+        try:
+            module = torch.jit.freeze(module.eval(), preserved_attrs=methods)
+            if torch.device(device).type == 'cpu':
+                module = torch.jit.optimize_for_inference(module, other_methods=methods)
+        except Exception as e:
+            print('[ModelCache] Cannot optimize module : ' + str(e))
+        return module
+
+    def load(self, key: str, build: callable, device: str, methods: list = []):
+        '''
+            Load a compiled artifact, or build, optimize and store it.
+            Parameters:
+                key:        [str]
+                            Cache key (see key)
+                build:      [callable]
+                            Function returning the scripted module
+                device:     [str]
+                            Device of the module
+                methods:    [list], optional
+                            Exported methods to keep besides forward
+        '''
+        import torch
+        path = self.path(key)
+        cur_time = time.monotonic()
+        if os.path.exists(path):
+            try:
+                module = torch.jit.load(path, map_location=device)
+                self.record(key, load=time.monotonic() - cur_time)
+                return module
+            except Exception as e:
+                print('[ModelCache] Invalid artifact ' + path + ' : ' + str(e))
+        module = build()
+        if self._optimize:
+            module = self.optimize(module, device, methods)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        torch.jit.save(module, tmp_path)
+        os.replace(tmp_path, path)
+        self.record(key, compile=time.monotonic() - cur_time)
+        return module
+
+    def load_script(self, checkpoint: str, device: str, methods: list = [], key: str = None):
+        '''
+            Load the optimized artifact of a TorchScript checkpoint.
+            Parameters:
+                checkpoint: [str]
+                            Path of the TorchScript checkpoint
+                device:     [str]
+                            Device of the model
+                methods:    [list], optional
+                            Exported methods to keep besides forward
+                key:        [str], optional
+                            Cache key of the checkpoint (see key)
+        '''
+        import torch
+        return self.load(key or self.key(checkpoint, device, methods=methods),
+                         lambda: torch.jit.load(checkpoint, map_location=device),
+                         device, methods)
+
+    def warm_up(self, key: str, func: callable, n_pass: int = 3):
+        '''
+            Run the warm-up passes of a model and record their durations
+            (for reporting only). The profiling and re-optimization of the
+            TorchScript executor happen in every process and are not stored
+            in the artifact, so all the passes are run on every boot (at
+            least two for the profiling executor).
+            Parameters:
+                key:        [str]
+                            Cache key of the model
+                func:       [callable]
+                            Function performing a single pass
+                n_pass:     [int], optional
+                            Number of passes [default: 3]
+            Returns:
+                List of the pass durations (in seconds)
+        '''
+        n_pass = max(2, n_pass)
+        times = []
+        for _ in range(n_pass):
+            cur_time = time.monotonic()
+            func()
+            times.append(time.monotonic() - cur_time)
+        self.record(key, warmup=times)
+        return times
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Compiled models cache')
+    parser.add_argument('--cache',      type=str, default='models/cache',  help='cache folder')
+    parser.add_argument('--clear',      action='store_true',               help='remove all artifacts')
+    args = parser.parse_args()
+    cache = ModelCache(args.cache)
+    if args.clear and os.path.exists(args.cache):
+        for f in os.listdir(args.cache):
+            os.remove(os.path.join(args.cache, f))
+        print('Cache cleared')
+    else:
+        for key, costs in sorted(cache._index.items()):
+            print('%-80s %s' % (key, ' / '.join(['%s %s' % (k, v) for k, v in costs.items()])))
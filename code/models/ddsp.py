@@ -1,36 +1,46 @@
 import time
 import torch
+from models.cache import ModelCache
 
 
 class DDSP():
     m_path = "/home/martin/Desktop/ddsp_pytorch/models/ddsp_demo_pretrained.ts"
     f_pass = 3
+    sr = 16000
 
-    def __init__(self):
+    def __init__(self, device="cuda"):
         # Testing DDSP
         print('Creating empty DDSP')
         self.model = None
+        self.device = device
+        self.cache = ModelCache()
+        self.key = None
+
+    def load_model(self):
+        # Frozen and optimized artifact from the compiled models cache
+        self.key = self.cache.key(self.m_path, self.device)
+        self.model = self.cache.load_script(self.m_path, self.device, key=self.key)
 
     def preload(self):
-        self.model = torch.jit.load(self.m_path)
-        self.model = self.model.cuda()
-        pitch = torch.randn(1, 200, 1).cuda()
-        loudness = torch.randn(1, 200, 1).cuda()
-        for p in range(self.f_pass):
+        self.load_model()
+        pitch = torch.randn(1, 200, 1, device=self.device)
+        loudness = torch.randn(1, 200, 1, device=self.device)
+        def warm_up_pass():
             with torch.no_grad():
                 audio = self.model(pitch, loudness)
+        # Profiling passes of the executor (run on every boot)
+        self.cache.warm_up(self.key, warm_up_pass, self.f_pass)
                 
-    def generate_random(self, length=200):
-        print('Generating random length ' + str(length))
-        pitch = torch.randn(1, length, 1).cuda()
-        loudness = torch.randn(1, length, 1).cuda()
+    def generate_random(self, length=200, batch=1):
+        pitch = torch.randn(batch, length, 1, device=self.device)
+        loudness = torch.randn(batch, length, 1, device=self.device)
         with torch.no_grad():
             audio = self.model(pitch, loudness)
         return audio.squeeze(0).squeeze(-1).cpu()
 
     def generate(self, pitch, loudness):
-        pitch = pitch.cuda()
-        loudness = loudness.cuda()
+        pitch = pitch.to(self.device)
+        loudness = loudness.to(self.device)
         with torch.no_grad():
             audio = self.model(pitch, loudness)
         return audio
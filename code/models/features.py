@@ -0,0 +1,289 @@
+"""
+
+ ~ Neurorack project ~
+ Features : Spectral features extraction and on-disk cache
+
+ This file contains the descriptors used to condition the NSF models
+ (rms, zero crossing rate, rolloff, flatness, bandwidth, centroid, f0)
+ and a cache of these features keyed on the content of the audio file,
+ the sampling rate and the extraction parameters.
+ Cached features are stored as float32 .npy files, loaded memory-mapped.
+ Descriptors are computed in pure NumPy (one shared STFT magnitude for
+ the spectral ones and a vectorized YIN), following the frame alignment
+ of librosa, which is only imported to decode audio files.
+
+ Usage (precompute the whole data folder):
+     python -m models.features data/ --workers 4
+ Usage (compare against the librosa descriptors):
+     python -m models.features data/ --compare
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Version of the extractor (change when descriptors are modified)
+features_version = 2
+
+
+def frame(y, frame_length, hop_length, pad_mode='constant'):
+    '''
+        Centered frames of a signal (as librosa with center=True).
+        Returns:
+            Strided view of shape (n_frames, frame_length)
+    '''
+    y = np.pad(y, frame_length // 2, mode=pad_mode)
+    return np.lib.stride_tricks.sliding_window_view(y, frame_length)[::hop_length]
+
+
+def yin(frames, sr, fmin, fmax, trough_threshold=0.1, spectrum=None):
+    '''
+        Vectorized YIN fundamental frequency estimator over all frames.
+        Parameters:
+            frames:     [np.ndarray]
+                        Frames of shape (n_frames, frame_length)
+            sr:         [int]
+                        Sampling rate
+            fmin, fmax: [float]
+                        Range of the fundamental frequency
+            spectrum:   [np.ndarray], optional
+                        Real FFT of the frames zero-padded to 2 * frame_length
+        Returns:
+            Fundamental frequency of each frame (n_frames,)
+    '''
+    frame_length = frames.shape[1]
+    min_period = int(np.floor(sr / fmax))
+    max_period = min(int(np.ceil(sr / fmin)), frame_length - 1)
+    # Autocorrelation of all frames through a zero-padded FFT
+    if spectrum is None:
+        spectrum = np.fft.rfft(frames, n=2 * frame_length, axis=1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    acf = np.fft.irfft(power, n=2 * frame_length, axis=1)[:, :max_period + 1]
+    # Difference function d(k) = 2 * (ACF(0) - ACF(k)) - sum_{m<k} y(m)^2
+    energy = np.cumsum(frames[:, :max_period] ** 2, axis=1)
+    diff = 2 * (acf[:, :1] - acf[:, 1:]) - energy
+    # Cumulative mean normalized difference
+    cmnd = np.cumsum(diff, axis=1) / np.arange(1, max_period + 1)
+    yin_frames = diff[:, min_period - 1:] / (cmnd[:, min_period - 1:] + np.finfo(cmnd.dtype).tiny)
+    # First local minimum below the threshold (global minimum otherwise)
+    trough = np.empty(yin_frames.shape, dtype=bool)
+    trough[:, 1:-1] = (yin_frames[:, 1:-1] < yin_frames[:, :-2]) & (yin_frames[:, 1:-1] <= yin_frames[:, 2:])
+    trough[:, 0] = yin_frames[:, 0] < yin_frames[:, 1]
+    trough[:, -1] = yin_frames[:, -1] < yin_frames[:, -2]
+    trough &= yin_frames < trough_threshold
+    period = np.where(trough.any(axis=1), np.argmax(trough, axis=1), np.argmin(yin_frames, axis=1))
+    # Parabolic refinement around the selected period (not at the edges)
+    idx = np.arange(len(period))
+    inner = np.clip(period, 1, yin_frames.shape[1] - 2)
+    prev, cur, nxt = yin_frames[idx, inner - 1], yin_frames[idx, inner], yin_frames[idx, inner + 1]
+    a = nxt + prev - 2 * cur
+    b = (nxt - prev) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(np.abs(b) >= np.abs(a), 0, -b / a)
+    shift[(period == 0) | (period == yin_frames.shape[1] - 1)] = 0
+    return sr / (min_period + period + shift)
+
+
+def spectral_features(y, sr, n_fft=2048, hop_length=512, fmin=50, fmax=5000, pad_mode='constant'):
+    '''
+        Compute the 7 descriptors of a signal
+        Parameters:
+            y:          [np.ndarray]
+                        Audio signal
+            sr:         [int]
+                        Sampling rate
+            pad_mode:   [str], optional
+                        Padding of the centered frames [default: constant, as librosa >= 0.10]
+        Returns:
+            Features array of shape (n_frames, 7)
+    '''
+    y = np.asarray(y, dtype=np.float64)
+    frames = frame(y, n_fft, hop_length, pad_mode)
+    features = np.empty((frames.shape[0], 7))
+    # Root mean square (unwindowed frames)
+    features[:, 0] = np.sqrt(np.mean(frames ** 2, axis=1))
+    # Zero crossing rate (edge-padded frames, tiny values count as positive)
+    negative = frame(y, n_fft, hop_length, 'edge') < -1e-10
+    features[:, 1] = np.count_nonzero(negative[:, 1:] != negative[:, :-1], axis=1) / n_fft
+    # Single FFT of the frames, zero-padded for the autocorrelation of YIN
+    spectrum = np.fft.rfft(frames, n=2 * n_fft, axis=1)
+    # Even bins are the n_fft points spectrum, on which the periodic Hann
+    # window is the circular convolution [-1/4, 1/2, -1/4]
+    X = spectrum[:, :n_fft + 2:2]
+    X = np.concatenate([np.conj(X[:, 1:2]), X, np.conj(X[:, -2:-1])], axis=1)
+    S = np.abs(0.5 * X[:, 1:-1] - 0.25 * (X[:, :-2] + X[:, 2:]))
+    freqs = np.linspace(0, sr / 2, S.shape[1])
+    # Rolloff (85% of the energy)
+    total = np.cumsum(S, axis=1)
+    features[:, 2] = freqs[np.argmax(total >= 0.85 * total[:, -1:], axis=1)]
+    # Flatness (on the power spectrum)
+    power = np.maximum(1e-10, S ** 2)
+    features[:, 3] = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    # Centroid and bandwidth (on the normalized magnitude)
+    norm = total[:, -1:]
+    S_norm = S / np.where(norm < np.finfo(S.dtype).tiny, 1, norm)
+    centroid = S_norm @ freqs
+    features[:, 5] = centroid
+    features[:, 4] = np.sqrt(np.sum(S_norm * (freqs - centroid[:, np.newaxis]) ** 2, axis=1))
+    # Fundamental frequency
+    features[:, 6] = yin(frames, sr, fmin, fmax, spectrum=spectrum)
+    features[np.isnan(features)] = 1
+    features = features[:-1, :]
+    return features
+
+
+def spectral_features_librosa(y, sr, n_fft=2048, hop_length=512, fmin=50, fmax=5000, pad_mode='constant'):
+    ''' Reference implementation of spectral_features with librosa '''
+    import librosa
+    features = [None] * 7
+    features[0] = librosa.feature.rms(y=y, frame_length=n_fft, hop_length=hop_length, pad_mode=pad_mode)
+    features[1] = librosa.feature.zero_crossing_rate(y, frame_length=n_fft, hop_length=hop_length)
+    S, phase = librosa.magphase(librosa.stft(y=y, n_fft=n_fft, hop_length=hop_length, pad_mode=pad_mode))
+    features[2] = librosa.feature.spectral_rolloff(S=S, sr=sr)
+    features[3] = librosa.feature.spectral_flatness(S=S)
+    features[4] = librosa.feature.spectral_bandwidth(S=S, sr=sr)
+    features[5] = librosa.feature.spectral_centroid(S=S, sr=sr)
+    features[6] = librosa.yin(y, fmin=fmin, fmax=fmax, sr=sr, frame_length=n_fft,
+                              hop_length=hop_length, pad_mode=pad_mode)[np.newaxis, :]
+    features = np.concatenate(features).transpose()
+    features[np.isnan(features)] = 1
+    features = features[:-1, :]
+    return features
+
+
+# Hashes already computed, keyed on (path, modification time, size)
+_file_hashes = {}
+
+
+def file_hash(path: str):
+    '''
+        SHA-1 of the content of a file. Memoized on the path, modification
+        time and size, so that a file is read once per process.
+    '''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        _file_hashes[key] = h.hexdigest()
+    return _file_hashes[key]
+
+
+class FeatureCache():
+    '''
+        The FeatureCache class computes spectral features of audio files and
+        stores them on disk, keyed on the file content, sampling rate and
+        extraction parameters (so that the cache never needs invalidation).
+    '''
+
+    def __init__(self,
+                 cache_dir: str = 'models/features',
+                 sr: int = 22050,
+                 **params):
+        '''
+            Constructor - Creates a new instance of the FeatureCache class.
+            Parameters:
+                cache_dir:  [str], optional
+                            Folder for the cached features
+                sr:         [int], optional
+                            Sampling rate to load audio files [default: 22050]
+                params:     [dict], optional
+                            Extra parameters for spectral_features
+        '''
+        self._cache_dir = cache_dir
+        self._sr = sr
+        self._params = params
+        desc = json.dumps({'sr': sr, 'version': features_version, 'params': params}, sort_keys=True)
+        self._params_hash = hashlib.sha1(desc.encode('utf-8')).hexdigest()[:12]
+
+    def path(self, wav: str):
+        ''' Path of the cached features for an audio file '''
+        return os.path.join(self._cache_dir, file_hash(wav) + '_' + self._params_hash + '.npy')
+
+    def compute(self, wav: str):
+        ''' Compute the features of an audio file (bypassing the cache) '''
+        import librosa
+        y, sr = librosa.load(wav, sr=self._sr)
+        return spectral_features(y, sr, **self._params).astype(np.float32)
+
+    def load(self, wav: str):
+        '''
+            Load the features of an audio file, computing them if needed.
+            Returns:
+                Read-only memory-mapped float32 array of shape (n_frames, 7)
+        '''
+        path = self.path(wav)
+        if not os.path.exists(path):
+            features = self.compute(wav)
+            os.makedirs(self._cache_dir, exist_ok=True)
+            # Write to a temporary file so that concurrent readers never see partial files
+            tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, features)
+            os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+
+    def precompute(self, wavs: list, n_workers: int = None):
+        '''
+            Fill the cache for a list of audio files with a process pool.
+            Returns:
+                List of cache paths
+        '''
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(self._precompute_one, wavs))
+
+    def _precompute_one(self, wav: str):
+        self.load(wav)
+        return self.path(wav)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Precompute spectral features')
+    parser.add_argument('data',             type=str, nargs='?', default='data/', help='folder of audio files')
+    parser.add_argument('--cache',          type=str, default='models/features', help='cache folder')
+    parser.add_argument('--sr',             type=int, default=22050,        help='sampling rate')
+    parser.add_argument('--workers',        type=int, default=None,         help='number of processes')
+    parser.add_argument('--compare',        action='store_true',            help='compare with the librosa descriptors')
+    args = parser.parse_args()
+    wavs = sorted([os.path.join(args.data, f) for f in os.listdir(args.data)
+                   if f.endswith('.wav') or f.endswith('.mp3')])
+    if args.compare:
+        import time
+        import librosa
+        names = ['rms', 'zcr', 'rolloff', 'flatness', 'bandwidth', 'centroid', 'f0']
+        t_numpy, t_librosa = 0, 0
+        errors = []
+        for wav in wavs:
+            y, sr = librosa.load(wav, sr=args.sr)
+            cur_time = time.perf_counter()
+            ref = spectral_features_librosa(y, sr)
+            t_librosa += time.perf_counter() - cur_time
+            cur_time = time.perf_counter()
+            feats = spectral_features(y, sr)
+            t_numpy += time.perf_counter() - cur_time
+            assert feats.shape == ref.shape, wav
+            # Relative error per descriptor (frames with a different f0 decision are counted apart)
+            rel = np.abs(feats - ref) / (np.abs(ref) + 1e-6)
+            errors.append(rel)
+            print('%s : max rel. error %s' % (os.path.basename(wav), ' '.join(['%.1e' % e for e in rel.max(axis=0)])))
+        errors = np.concatenate(errors)
+        for d, name in enumerate(names):
+            print('%-10s median %.1e / 99%% %.1e / frames within 1%% : %.2f%%' % (
+                name, np.median(errors[:, d]), np.percentile(errors[:, d], 99), 100 * np.mean(errors[:, d] < 1e-2)))
+        print('Extraction time : numpy %.3f s / librosa %.3f s' % (t_numpy, t_librosa))
+        assert np.all(np.mean(errors < 1e-2, axis=0) > 0.99)
+    else:
+        cache = FeatureCache(args.cache, args.sr)
+        for wav, path in zip(wavs, cache.precompute(wavs, args.workers)):
+            print(wav + ' -> ' + path)
@@ -0,0 +1,140 @@
+"""
+
+ ~ Neurorack project ~
+ Interpolation : Mixing of reference descriptor sets
+
+ This file defines the interpolation engine of the NSF features. The
+ descriptors of the reference sounds are stacked once on the device, and
+ any mixture is defined by a (n_sounds, n_features) weight matrix filled
+ on the host. A mixture is then a single batched product
+ (einsum 'std,sd->td') written into preallocated output buffers, so that
+ a CV update creates no tensor, whatever the number of reference sounds.
+ Output buffers form a ring of three : a mixture never overwrites the
+ last published one, nor one marked in use by a reader (see acquire).
+ On CUDA the weights are uploaded asynchronously from pinned memory, and
+ the host weights are only handed out again once the upload is done.
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import torch
+
+
+class FeatureInterpolator():
+    '''
+        The FeatureInterpolator class computes weighted mixtures of the
+        descriptors of several reference sounds.
+    '''
+
+    def __init__(self, features: list):
+        '''
+            Constructor - Creates a new instance of the FeatureInterpolator class.
+            Parameters:
+                features:   [list]
+                            Descriptors of the reference sounds, as tensors
+                            (1, length, n_features) on the target device
+                            (cropped to the shortest sound)
+        '''
+        length = min([f.shape[1] for f in features])
+        stack = torch.cat([f[:, :length, :] for f in features])
+        self.n_sounds, self.length, self.n_features = stack.shape
+        self.device = stack.device
+        # Basis (n_features, length, n_sounds) : one matrix product per feature
+        self._basis = stack.permute(2, 1, 0).contiguous()
+        # Host weights (filled by the CV mappings) stored in the layout of
+        # the device copy, so that the upload is a single contiguous copy
+        self._weights_host = torch.zeros(self.n_features, self.n_sounds, 1, dtype=stack.dtype)
+        self._copy_event = None
+        if self.device.type == 'cuda':
+            self._weights_host = self._weights_host.pin_memory()
+            self._copy_event = torch.cuda.Event()
+        self._weights_np = self._weights_host.numpy()[:, :, 0].T
+        self._weights = torch.zeros(self.n_features, self.n_sounds, 1, dtype=stack.dtype, device=self.device)
+        # Ring of output buffers : the last mixture (current) and a buffer
+        # held by a reader are never overwritten, a third one is always free
+        self._out = [torch.zeros(self.n_features, self.length, 1, dtype=stack.dtype, device=self.device)
+                     for _ in range(3)]
+        self._in_use = [0] * len(self._out)
+        self._cur = -1
+
+    @property
+    def weights(self):
+        '''
+            Host weights (weights[s, d] : weight of sound s for the feature
+            d), writable once the upload of the previous mixture is done.
+            Fetch them again after every mix.
+        '''
+        if self._copy_event is not None:
+            self._copy_event.synchronize()
+        return self._weights_np
+
+    def reference(self, idx: int):
+        ''' Descriptors of a reference sound (1, length, n_features) '''
+        return self._basis[:, :, idx].t().unsqueeze(0)
+
+    def acquire(self, features):
+        '''
+            Mark the output buffer of a mixture as in use (until release).
+            The caller must serialize acquire and mix (e.g. with a lock).
+            Returns:
+                Index of the buffer, None if features is not a mixture
+        '''
+        for idx, out in enumerate(self._out):
+            if features.data_ptr() == out.data_ptr():
+                self._in_use[idx] += 1
+                return idx
+        return None
+
+    def release(self, idx):
+        ''' Release a buffer marked by acquire '''
+        if idx is not None:
+            self._in_use[idx] -= 1
+
+    def mix(self):
+        '''
+            Mixture of the reference sounds with the current weights
+            (weights[s, d] : weight of sound s for the feature d).
+            Returns:
+                Features (1, length, n_features), view of an output buffer
+                that is kept until two more mixtures (longer if acquired)
+        '''
+        self._weights.copy_(self._weights_host, non_blocking=self._copy_event is not None)
+        if self._copy_event is not None:
+            # The host weights are not rewritten before the end of the upload
+            self._copy_event.record()
+        self._cur = [idx for idx in range(len(self._out))
+                     if idx != self._cur and self._in_use[idx] == 0][0]
+        out = self._out[self._cur]
+        torch.bmm(self._basis, self._weights, out=out)
+        return out.squeeze(-1).t().unsqueeze(0)
+
+
+if __name__ == '__main__':
+    import time
+    # Check against a loop over the sounds and time a CV update
+    feats = [torch.randn(1, 400 + 10 * s, 7) for s in range(4)]
+    interp = FeatureInterpolator(feats)
+    interp.weights[:] = torch.rand(4, 7).numpy()
+    ref = sum([feats[s][:, :400, :] * torch.from_numpy(interp.weights[s]) for s in range(4)])
+    out = interp.mix()
+    print('Max error : %.2e' % (out - ref).abs().max().item())
+    assert torch.allclose(out, ref, atol=1e-5)
+    cur_time = time.perf_counter()
+    for _ in range(1000):
+        interp.weights[:] = 0.25
+        interp.mix()
+    print('Mixture : %.1f us' % ((time.perf_counter() - cur_time) * 1e3))
+    # A buffer held by a reader survives any number of mixtures
+    interp.weights[:] = 1
+    held = interp.mix()
+    idx = interp.acquire(held)
+    expected = held.clone()
+    for w in range(5):
+        interp.weights[:] = w
+        interp.mix()
+    assert torch.equal(held, expected)
+    interp.release(idx)
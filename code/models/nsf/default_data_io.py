@@ -45,12 +45,18 @@ def _data_reader(file_path, dim, flag_lang):
         data = nii_io_tk.f_read_raw_mat(file_path, dim)
     return data
 
-def _data_writer(data, file_path, sr = 16000):
+def _data_writer(data, file_path, sr = 16000, writer = None):
     """ A wrapper to write raw binary data or waveform
+    writer: optional asynchronous wav writer (writers.WavWriter), 
+            waveforms are then converted to PCM16 and written in the 
+            background
     """
     file_name, file_ext = os.path.splitext(file_path)
     if file_ext == '.wav':
-        nii_wav_tk.waveFloatToPCMFile(data, file_path, sr = sr)
+        if writer is None:
+            nii_wav_tk.waveFloatToPCMFile(data, file_path, sr = sr)
+        else:
+            writer.write(file_path, data, sr, pcm16 = True)
     elif file_ext == '.txt':
         nii_warn.f_die("Cannot write to %s" % (file_path))
     else:
@@ -132,6 +138,8 @@ class NIIDataSet(torch.utils.data.Dataset):
         # initialization
         self.m_set_name = dataset_name
         self.m_file_list = file_list
+        # asynchronous writer of the generated waveforms (None: synchronous)
+        self.m_writer = None
         self.m_input_dirs = input_dirs
         self.m_input_exts = input_exts
         self.m_input_dims = input_dims
@@ -246,7 +254,8 @@ class NIIDataSet(torch.utils.data.Dataset):
         if data_format == nii_dconf.h_dtype_str:
             self.f_load_data = lambda x, y: _data_reader(x, y, self.m_flag_lang)
             self.f_length_data = _data_len_reader
-            self.f_write_data = lambda x, y: _data_writer(x, y, self.m_wav_sr)
+            self.f_write_data = lambda x, y: _data_writer(
+                x, y, self.m_wav_sr, self.m_writer)
         else:
             nii_warn.f_print("Unsupported dtype %s" % (data_format))
             nii_warn.f_die("Only supports %s " % (nii_dconf.h_dtype_str))
@@ -963,6 +972,14 @@ class NIIDataSet(torch.utils.data.Dataset):
         # done
         return
         
+    def f_set_writer(self, writer):
+        """ f_set_writer(writer)
+        Write the waveforms of f_putitem through an asynchronous writer
+        (writers.WavWriter), or synchronously if writer is None
+        """
+        self.m_writer = writer
+        return
+
     def f_putitem(self, output_data, save_dir, data_infor_str):
         """ 
         """
@@ -1211,6 +1228,11 @@ class NIIDataSetLoader:
         """
         self.m_dataset.f_putitem(output_data, save_dir, data_infor_str)
 
+    def set_writer(self, writer):
+        """ Write the output waveforms through an asynchronous writer
+        """
+        self.m_dataset.f_set_writer(writer)
+
     def get_in_dim(self):
         """ Return the dimension of input features
         """ 
@@ -471,9 +471,13 @@ def f_train_wrapper(args, pt_model, loss_wrapper, device, \
 
 
 def f_inference_wrapper(args, pt_model, device, \
-                        test_dataset_wrapper, checkpoint):
+                        test_dataset_wrapper, checkpoint, writer=None):
     """ Wrapper for inference
+    writer: optional asynchronous wav writer (writers.WavWriter), so that
+            the generation loop does not wait for the output files
     """
+    if writer is not None:
+        test_dataset_wrapper.set_writer(writer)
 
     # prepare dataloader
     test_data_loader = test_dataset_wrapper.get_loader()
@@ -562,6 +566,11 @@ def f_inference_wrapper(args, pt_model, device, \
         # done for
     # done with
 
+    # wait for the pending output files
+    if writer is not None:
+        writer.flush()
+        test_dataset_wrapper.set_writer(None)
+
     # 
     nii_display.f_print("Generated data to %s" % (args.output_dir))
     
@@ -100,6 +100,19 @@ class Conv1dKeepLength(torch_nn.Conv1d):
         output = self.l_ac(super(Conv1dKeepLength, self).forward(x))
         return output.permute(0, 2, 1)
 
+    def forward_chunk(self, data, cache):
+        """ output, cache = forward_chunk(data, cache)
+        Streaming version of forward (causal convolution only)
+        data:  (batchsize=1, length, dim_in)
+        cache: (batchsize=1, self.pad_le, dim_in), last input samples
+               of the previous chunk (zeros for the first chunk)
+        """
+        # the cache replaces the left padding
+        x = torch.cat((cache, data), dim=1)
+        output = self.l_ac(super(Conv1dKeepLength, self).forward(
+            x.permute(0, 2, 1)))
+        return output.permute(0, 2, 1), x[:, x.shape[1] - self.pad_le:, :]
+
 # 
 # Moving average
 class MovingAverage(Conv1dKeepLength):
@@ -120,6 +133,48 @@ class MovingAverage(Conv1dKeepLength):
             p.requires_grad = False
             
     def forward(self, data):
+        """ output = forward(data)
+        data: (batchsize=1, length, dim)
+        output: (batchsize=1, length, dim)
+        Same output as the convolution in forward_reference
+        """
+        return self.forward_cf(data.transpose(1, 2)).transpose(1, 2)
+
+    def forward_cf(self, data):
+        """ output = forward_cf(data)
+        data: (batchsize=1, dim, length)
+        output: (batchsize=1, dim, length)
+
+        Moving average computed with prefix sums, so that the cost does
+        not depend on the window length. The prefix sums are computed 
+        inside blocks of window_len samples: the sum over the window 
+        starting at sample i of block b is 
+          total(b) - prefix(b, i) + prefix(b + 1, i)
+        which keeps the float32 sums as small as a single window
+        """
+        batch, dim, length = data.shape
+        window_len = self.kernel_size[0] * self.dilation[0]
+        n_blocks = (length - 1) // window_len + 2
+        # leading zero, padding (no permute), trailing zeros up to the 
+        # last block
+        if self.pad_mode == 'replicate':
+            pad_le = data[:, :, :1].expand(-1, -1, self.pad_le)
+            pad_ri = data[:, :, -1:].expand(-1, -1, self.pad_ri)
+        else:
+            pad_le = data.new_zeros(batch, dim, self.pad_le)
+            pad_ri = data.new_zeros(batch, dim, self.pad_ri)
+        tail = n_blocks * window_len - length - self.pad_le - self.pad_ri
+        padded = torch.cat((data.new_zeros(batch, dim, 1), pad_le, data, 
+                            pad_ri, data.new_zeros(batch, dim, tail - 1)), 
+                           dim=2)
+        prefix = torch.cumsum(padded.view(batch, dim, n_blocks, window_len),
+                              dim=3)
+        output = prefix[:, :, 1:] - prefix[:, :, :-1]
+        output += prefix[:, :, :-1, -1:]
+        output = output.reshape(batch, dim, -1)[:, :, :length]
+        return output / window_len
+
+    def forward_reference(self, data):
         return super(MovingAverage, self).forward(data)
 
 # 
@@ -182,14 +237,49 @@ class TimeVarFIRFilter(torch_nn.Module):
     def forward(self, signal, f_coef):
         """ 
         Filter coefs: (batchsize=1, signal_length, filter_order = K)
-        Signal:       (batchsize=1, signal_length, 1)
+        Signal:       (batchsize=1, signal_length, dim)
         
-        Output:       (batchsize=1, signal_length, 1)
+        Output:       (batchsize=1, signal_length, dim)
         
         For n in [1, sequence_length):
           output(0, n, 1)= \sum_{k=1}^{K} signal(0, n-k, 1)*coef(0, n, k)
           
-        This method may be not efficient:
+        Vectorized version: the signal is left-padded with K-1 zeros and
+        unfolded into (strided, no-copy) windows of K samples
+        
+        window(0, n, :) = [x_{n-K+1}, ..., x_{n-1}, x_n]
+        
+        so that output(0, n) is the dot product between window(0, n, :)
+        and the reversed filter coef(0, n, K-1::-1)
+        """
+        order_k = f_coef.shape[-1]
+
+        # pad to (batchsize=1, filter_order-1 + signal_length, dim)
+        padded_signal = torch_nn_func.pad(signal, (0, 0, order_k - 1, 0))
+        return self._filter(padded_signal, f_coef)
+
+    def forward_chunk(self, signal, f_coef, tail):
+        """ output, tail = forward_chunk(signal, f_coef, tail)
+        Streaming version of forward
+        tail: (batchsize=1, filter_order-1, dim), last samples of the
+              previous chunk (zeros for the first chunk)
+        """
+        padded_signal = torch.cat((tail, signal), dim=1)
+        tail = padded_signal[:, padded_signal.shape[1] - tail.shape[1]:, :]
+        return self._filter(padded_signal, f_coef), tail
+
+    def _filter(self, padded_signal, f_coef):
+        """ filtering of a signal left-padded with filter_order-1 samples
+        """
+        order_k = f_coef.shape[-1]
+        # (batchsize=1, signal_length, dim, filter_order)
+        windows = padded_signal.unfold(1, order_k, 1)
+        # weighted sum over the window
+        return torch.einsum('bldk,blk->bld', windows, f_coef.flip(-1))
+
+    def forward_roll(self, signal, f_coef):
+        """ 
+        Reference (per-tap roll) version of forward
         
         Suppose signal [x_1, ..., x_N], filter [a_1, ..., a_K]
         output         [y_1, y_2, y_3, ..., y_N, *, * ... *]
@@ -245,6 +335,10 @@ class SincFilter(torch_nn.Module):
         # 
         self.half_k = (filter_order - 1) // 2
         self.order = self.half_k * 2 +1
+        # quantized cut-off LUT (None: exact coefficients)
+        self.lut_size = None
+        # tables precomputed for each device
+        self.m_tables = {}
         
     def hamming_w(self, n_index):
         """ prepare hamming window for each time step
@@ -277,10 +371,94 @@ class SincFilter(torch_nn.Module):
         y[:,:,self.half_k] = 1
         return y
         
+    def set_lut(self, lut_size=1024):
+        """ set_lut(lut_size)
+        Generate the coefficients from a table of lut_size bins of cut_f
+        in [0, 1] (linearly interpolated), or exactly if lut_size is None
+        """
+        self.lut_size = lut_size
+        self.m_tables = {}
+
+    def tables(self, device):
+        """ tables = tables(device)
+        Filter order index, hamming window, sinc of the index, [-1^n]
+        (and LUT if enabled), computed once per device
+        Attributes are created here as the module may come from a pickle
+        """
+        if getattr(self, 'm_tables', None) is None:
+            self.m_tables = {}
+        if device not in self.m_tables:
+            with torch.no_grad():
+                n_index = torch.arange(-self.half_k, self.half_k + 1,
+                                       device=device)
+                tables = {'n_index': n_index.float(),
+                          'window': self.hamming_w(n_index),
+                          'sinc': self.sinc(n_index.float().view(1, 1, -1))[0, 0],
+                          'sign': torch.pow(-1, n_index).float()}
+                self.m_tables[device] = tables
+                lut_size = getattr(self, 'lut_size', None)
+                if lut_size is not None:
+                    grid = torch.linspace(0, 1, lut_size + 1, device=device)
+                    lp_lut, hp_lut = self.exact(grid.view(1, -1, 1))
+                    tables['lp_lut'] = lp_lut[0]
+                    tables['hp_lut'] = hp_lut[0]
+        return self.m_tables[device]
+
+    def exact(self, cut_f):
+        """ lp_coef, hp_coef = exact(cut_f)
+        Closed-form coefficients, broadcasting cut_f (batchsize, length, 1)
+        against the precomputed (filter_order) tables
+        """
+        tables = self.tables(cut_f.device)
+        n_index = tables['n_index']
+        # sinc(cut_f * n), with sinc(0) = 1
+        x = np.pi * cut_f * n_index
+        x = torch.where(n_index == 0, torch.ones_like(x), x)
+        sinc_f = torch.where(n_index == 0, torch.ones_like(x), torch.sin(x) / x)
+        
+        # unnormalized filter coefs with hamming window
+        lp_coef = cut_f * sinc_f * tables['window']
+        hp_coef = (tables['sinc'] - cut_f * sinc_f) * tables['window']
+
+        # normalize the coef to make gain at 0/pi is 0 dB
+        lp_coef = lp_coef / torch.sum(lp_coef, axis=2, keepdim=True)
+        hp_coef = hp_coef / torch.sum(hp_coef * tables['sign'], axis=2,
+                                      keepdim=True)
+        return lp_coef, hp_coef
+
+    def lookup(self, cut_f):
+        """ lp_coef, hp_coef = lookup(cut_f)
+        Coefficients gathered from the LUT and linearly interpolated
+        (interpolated filters keep the 0 dB gain at 0/pi)
+        """
+        tables = self.tables(cut_f.device)
+        pos = cut_f.clamp(0, 1) * self.lut_size
+        idx = pos.floor().long().clamp(max=self.lut_size - 1)
+        frac = pos - idx
+        idx = idx.squeeze(-1)
+        lp_coef = torch.lerp(tables['lp_lut'][idx], 
+                             tables['lp_lut'][idx + 1], frac)
+        hp_coef = torch.lerp(tables['hp_lut'][idx], 
+                             tables['hp_lut'][idx + 1], frac)
+        return lp_coef, hp_coef
+
     def forward(self, cut_f):
         """ lp_coef, hp_coef = forward(self, cut_f)
         cut-off frequency cut_f (batchsize=1, length, dim = 1)
     
+        lp_coef: low-pass filter coefs  (batchsize, length, filter_order)
+        hp_coef: high-pass filter coefs (batchsize, length, filter_order)
+        """
+        if getattr(self, 'lut_size', None) is None:
+            return self.exact(cut_f)
+        return self.lookup(cut_f)
+
+    def forward_reference(self, cut_f):
+        """ lp_coef, hp_coef = forward_reference(self, cut_f)
+        Reference version of forward (filter order index repeated for
+        every time step)
+        cut-off frequency cut_f (batchsize=1, length, dim = 1)
+    
         lp_coef: low-pass filter coefs  (batchsize, length, filter_order)
         hp_coef: high-pass filter coefs (batchsize, length, filter_order)
         """
@@ -348,12 +526,25 @@ class UpSampleLayer(torch_nn.Module):
         return
     
     def forward(self, x):
+        # nearest up-sampling to (batchsize=1, dim, length), where both
+        # moving averages are computed, then a view as (batchsize=1, 
+        # length, dim)
+        up_sampled_data = torch.repeat_interleave(x.transpose(1, 2), 
+                                                  self.scale_factor, dim=2)
+        if isinstance(self.l_ave1, MovingAverage):
+            up_sampled_data = self.l_ave1.forward_cf(
+                self.l_ave2.forward_cf(up_sampled_data))
+        return up_sampled_data.transpose(1, 2)
+
+    def forward_reference(self, x):
         # permute to (batchsize=1, dim, length)
         up_sampled_data = self.l_upsamp(x.permute(0, 2, 1))
 
         # permute it backt to (batchsize=1, length, dim)
         # and do two moving average
-        return self.l_ave1(self.l_ave2(up_sampled_data.permute(0, 2, 1)))
+        l_ave1 = getattr(self.l_ave1, 'forward_reference', self.l_ave1)
+        l_ave2 = getattr(self.l_ave2, 'forward_reference', self.l_ave2)
+        return l_ave1(l_ave2(up_sampled_data.permute(0, 2, 1)))
     
 
 # Neural filter block (1 block)
@@ -416,6 +607,26 @@ class NeuralFilterBlock(torch_nn.Module):
         output_signal = tmp_hidden + signal
         
         return output_signal
+
+    def init_stream_state(self, batch, device):
+        """ caches of the dilated convs for forward_chunk
+        """
+        return [torch.zeros(batch, l_conv.pad_le, self.hidden_size, \
+                            device=device) for l_conv in self.l_convs]
+
+    def forward_chunk(self, signal, context, caches):
+        """ output = forward_chunk(signal, context, caches)
+        Streaming version of forward, caches are updated in place
+        """
+        tmp_hidden = self.l_ff_1_tanh(self.l_ff_1(signal))
+        for idx, l_conv in enumerate(self.l_convs):
+            tmp_conv, caches[idx] = l_conv.forward_chunk(tmp_hidden, 
+                                                         caches[idx])
+            tmp_hidden = tmp_hidden + tmp_conv + context
+        tmp_hidden = tmp_hidden * self.scale
+        tmp_hidden = self.l_ff_2_tanh(self.l_ff_2(tmp_hidden))
+        tmp_hidden = self.l_ff_3_tanh(self.l_ff_3(tmp_hidden))
+        return tmp_hidden + signal
     
 # 
 # Sine waveform generator
@@ -518,6 +729,57 @@ class SineGen(torch_nn.Module):
         return  sines
     
     
+    def _harmonic_f0(self, f0):
+        """ f0_buf = _harmonic_f0(f0)
+        F0 of the fundamental component and overtones (batchsize, length, dim)
+        """
+        f0_buf = torch.zeros(f0.shape[0], f0.shape[1], self.dim, \
+                             device=f0.device)
+        # fundamental component
+        f0_buf[:, :, 0] = f0[:, :, 0]
+        for idx in np.arange(self.harmonic_num):
+            # idx + 2: the (idx+1)-th overtone, (idx+2)-th harmonic
+            f0_buf[:, :, idx+1] = f0_buf[:, :, 0] * (idx+2)
+        return f0_buf
+
+    def _harmonic_sines(self, f0, f0_phase, offset):
+        """ sines, f0_phase = _harmonic_sines(f0, f0_phase, offset)
+        f0: (batchsize, length, 1)
+        f0_phase: (batchsize, 1), float64 phase of the fundamental before
+                  the first step (in [0, 1))
+        offset: (batchsize, dim), initial phase of each harmonic
+        sines: (batchsize, length, dim)
+        
+        A single phase accumulator (float64, wrapped) is kept for the 
+        fundamental, the phase of the (h)-th harmonic is h times the 
+        fundamental phase (instead of a cumsum per harmonic)
+        """
+        phase = torch.cumsum(f0.double() / self.sampling_rate, dim=1)
+        phase = torch.remainder(phase + f0_phase.unsqueeze(1), 1)
+        harmonics = torch.arange(1, self.dim + 1, device=f0.device, 
+                                 dtype=torch.float64)
+        sines = torch.addcmul(offset.double().unsqueeze(1), phase, harmonics)
+        sines = torch.remainder(sines, 1).float()
+        return torch.sin(sines.mul_(2 * np.pi)), phase[:, -1, :]
+
+    def _sines_to_source(self, sine_waves, f0):
+        """ sine_waves, uv, noise = _sines_to_source(sine_waves, f0)
+        unvoiced masking and additive noise
+        """
+        # generate uv signal
+        uv = self._f02uv(f0)
+        
+        # noise: for unvoiced should be similar to sine_amp
+        #        std = self.sine_amp/3 -> max value ~ self.sine_amp
+        #.       for voiced regions is self.noise_std
+        noise_amp = uv * self.noise_std + (1-uv) * self.sine_amp / 3
+        noise = noise_amp * torch.randn_like(sine_waves)
+        
+        # first: set the unvoiced part to 0 by uv
+        # then: additive noise
+        sine_waves = sine_waves * uv + noise
+        return sine_waves, uv, noise
+
     def forward(self, f0):
         """ sine_tensor, uv = forward(f0)
         input F0: tensor(batchsize=1, length, dim=1)
@@ -526,32 +788,39 @@ class SineGen(torch_nn.Module):
         output uv: tensor(batchsize=1, length, 1)
         """
         with torch.no_grad():
-            f0_buf = torch.zeros(f0.shape[0], f0.shape[1], self.dim, \
-                                    device=f0.device)
-            # fundamental component
-            f0_buf[:, :, 0] = f0[:, :, 0]
-            for idx in np.arange(self.harmonic_num):
-                # idx + 2: the (idx+1)-th overtone, (idx+2)-th harmonic
-                f0_buf[:, :, idx+1] = f0_buf[:, :, 0] * (idx+2)
-                
-            # generate sine waveforms
-            sine_waves = self._f02sine(f0_buf) * self.sine_amp
-            
-            # generate uv signal
-            #uv = torch.ones(f0.shape)
-            #uv = uv * (f0 > self.voiced_threshold)
-            uv = self._f02uv(f0)
-            
-            # noise: for unvoiced should be similar to sine_amp
-            #        std = self.sine_amp/3 -> max value ~ self.sine_amp
-            #.       for voiced regions is self.noise_std
-            noise_amp = uv * self.noise_std + (1-uv) * self.sine_amp / 3
-            noise = noise_amp * torch.randn_like(sine_waves)
-            
-            # first: set the unvoiced part to 0 by uv
-            # then: additive noise
-            sine_waves = sine_waves * uv + noise
-        return sine_waves, uv, noise
+            if self.flag_for_pulse:
+                # generate sine waveforms (one cumsum per harmonic)
+                sine_waves = self._f02sine(self._harmonic_f0(f0))
+            else:
+                state = self.init_stream_state(f0.shape[0], f0.device)
+                sine_waves, _ = self._harmonic_sines(f0, state['f0_phase'],
+                                                     state['offset'])
+            sine_waves = sine_waves * self.sine_amp
+            return self._sines_to_source(sine_waves, f0)
+
+    def init_stream_state(self, batch, device):
+        """ phase of the fundamental (float64) and initial phase of each
+        harmonic (random, except for the fundamental component)
+        """
+        offset = torch.rand(batch, self.dim, device = device)
+        offset[:, 0] = 0
+        return {'f0_phase': torch.zeros(batch, 1, device = device, 
+                                        dtype = torch.float64),
+                'offset': offset}
+
+    def forward_chunk(self, f0, phase):
+        """ sine_tensor, uv, noise, phase = forward_chunk(f0, phase)
+        Streaming version of forward (flag_for_pulse is not supported)
+        phase: phase state from init_stream_state (the updated state is
+               returned)
+        """
+        with torch.no_grad():
+            sine_waves, f0_phase = self._harmonic_sines(f0, phase['f0_phase'],
+                                                        phase['offset'])
+            sine_waves = sine_waves * self.sine_amp
+            sine_waves, uv, noise = self._sines_to_source(sine_waves, f0)
+        return sine_waves, uv, noise, {'f0_phase': f0_phase, 
+                                       'offset': phase['offset']}
 
 #####
 ## Model definition
@@ -668,6 +937,20 @@ class CondModuleHnSincNSF(torch_nn.Module):
         # return
         return context, f0_upsamp, cut_f_smoothed, hidden_cut_f
 
+    def stream_context(self):
+        """ n_frames = stream_context()
+        Number of frames on each side of a frame that affect its outputs.
+        Frames further than this from the boundaries of a window are
+        computed exactly as in a forward pass over the full sequence.
+        """
+        reach = lambda l: max(getattr(l, 'pad_le', 0), 
+                              getattr(l, 'pad_ri', 0))
+        frame_reach = sum([reach(l) for l in self.l_conv1ds])
+        sample_reach = reach(self.l_upsamp.l_ave1) \
+                       + reach(self.l_upsamp.l_ave2) \
+                       + reach(self.l_cut_f_smooth)
+        return frame_reach + int(np.ceil(sample_reach / self.up_sample))
+
 # For source module
 class SourceModuleHnNSF(torch_nn.Module):
     """ SourceModule for hn-nsf 
@@ -716,6 +999,14 @@ class SourceModuleHnNSF(torch_nn.Module):
         # source for noise branch, in the same shape as uv
         noise = torch.randn_like(uv) * self.sine_amp / 3
         return sine_merge, noise, uv
+
+    def forward_chunk(self, x, phase):
+        """ Streaming version of forward, also returns the sine phase
+        """
+        sine_wavs, uv, _, phase = self.l_sin_gen.forward_chunk(x, phase)
+        sine_merge = self.l_tanh(self.l_linear(sine_wavs))
+        noise = torch.randn_like(uv) * self.sine_amp / 3
+        return sine_merge, noise, uv, phase
         
         
 # For Filter module
@@ -764,8 +1055,47 @@ class FilterModuleHnSincNSF(torch_nn.Module):
         # sinc filter generators and time-variant filtering layer
         self.l_sinc_coef = SincFilter(self.sinc_order)
         self.l_tv_filtering = TimeVarFIRFilter()
+        # compute sinc coefs every coef_decimation samples (None: all)
+        self.coef_decimation = None
         # done
-        
+
+    def set_coef_decimation(self, step=None):
+        """ set_coef_decimation(step)
+        Compute the sinc filter coefficients every step samples only, and 
+        linearly interpolate them in between (None: every sample)
+        """
+        self.coef_decimation = step
+
+    def sinc_coef(self, cut_f):
+        """ lp_coef, hp_coef = sinc_coef(cut_f)
+        cut_f: (batchsize, length, 1)
+        The signal is cut into segments of step samples, coefficients are
+        computed at the segment boundaries [0, step, ..., length-1] only,
+        then linearly interpolated inside every segment (interpolated 
+        filters keep the 0 dB gain at 0/pi)
+        """
+        step = getattr(self, 'coef_decimation', None)
+        length = cut_f.shape[1]
+        if step is None or step <= 1 or length <= 2:
+            return self.l_sinc_coef(cut_f)
+        n_seg = (length + step - 1) // step
+        with torch.no_grad():
+            # boundaries of the segments (last one clipped to the end)
+            anchors = (torch.arange(n_seg + 1, device=cut_f.device) * step)
+            anchors = anchors.clamp(max=length - 1)
+            # position inside each segment, normalized by its length
+            seg_len = (anchors[1:] - anchors[:-1]).clamp(min=1)
+            frac = torch.arange(step, device=cut_f.device).view(1, -1, 1)
+            frac = (frac / seg_len.view(-1, 1, 1)).to(cut_f.dtype)
+        lp_anchor, hp_anchor = self.l_sinc_coef(cut_f[:, anchors])
+        coefs = []
+        for anchor in [lp_anchor, hp_anchor]:
+            # (batchsize, n_seg, step, filter_order)
+            coef = torch.addcmul(anchor[:, :-1].unsqueeze(2), frac,
+                                 (anchor[:, 1:] - anchor[:, :-1]).unsqueeze(2))
+            coefs.append(coef.reshape(cut_f.shape[0], -1, 
+                                      anchor.shape[-1])[:, :length])
+        return coefs[0], coefs[1]
 
     def forward(self, har_component, noi_component, cond_feat, cut_f):
         """
@@ -778,7 +1108,7 @@ class FilterModuleHnSincNSF(torch_nn.Module):
             noi_component = l_noi_block(noi_component, cond_feat)
         
         # get sinc filter coefficients
-        lp_coef, hp_coef = self.l_sinc_coef(cut_f)
+        lp_coef, hp_coef = self.sinc_coef(cut_f)
 
         # time-variant filtering
         har_signal = self.l_tv_filtering(har_component, lp_coef)
@@ -786,9 +1116,220 @@ class FilterModuleHnSincNSF(torch_nn.Module):
 
         # get output 
         return har_signal + noi_signal
+
+    def init_stream_state(self, batch, device):
+        """ conv caches of every block and tails of the sinc filtering
+        """
+        tail = torch.zeros(batch, self.l_sinc_coef.order - 1, 
+                           self.signal_size, device=device)
+        return {'har': [l.init_stream_state(batch, device) \
+                        for l in self.l_har_blocks],
+                'noi': [l.init_stream_state(batch, device) \
+                        for l in self.l_noi_blocks],
+                'har_tail': tail, 'noi_tail': tail.clone()}
+
+    def forward_chunk(self, har_component, noi_component, cond_feat, cut_f,
+                      state):
+        """ Streaming version of forward, state is updated in place
+        """
+        for l_har_block, caches in zip(self.l_har_blocks, state['har']):
+            har_component = l_har_block.forward_chunk(har_component, 
+                                                      cond_feat, caches)
+        for l_noi_block, caches in zip(self.l_noi_blocks, state['noi']):
+            noi_component = l_noi_block.forward_chunk(noi_component, 
+                                                      cond_feat, caches)
+        lp_coef, hp_coef = self.sinc_coef(cut_f)
+        har_signal, state['har_tail'] = self.l_tv_filtering.forward_chunk(
+            har_component, lp_coef, state['har_tail'])
+        noi_signal, state['noi_tail'] = self.l_tv_filtering.forward_chunk(
+            noi_component, hp_coef, state['noi_tail'])
+        return har_signal + noi_signal
         
         
 
+#
+# Inference-only version of the neural filters
+#
+class CausalConvInference(torch_nn.Module):
+    """ Inference version of a causal Conv1dKeepLength
+    Input tensor:  (batchsize=1, dim_in, length)
+    Output tensor: (batchsize=1, dim_out, length)
+    The causal left padding is folded into the convolution: the conv is
+    padded on both sides and the extra outputs on the right are dropped
+    """
+    def __init__(self, l_conv):
+        super(CausalConvInference, self).__init__()
+        self.register_buffer('weight', l_conv.weight.detach().clone())
+        if l_conv.bias is None:
+            bias = torch.zeros(l_conv.weight.shape[0], 
+                               device=l_conv.weight.device)
+        else:
+            bias = l_conv.bias.detach().clone()
+        self.register_buffer('bias', bias)
+        self.dilation = int(l_conv.dilation[0])
+        self.pad = int(l_conv.pad_le)
+        self.tanh = isinstance(l_conv.l_ac, torch_nn.Tanh)
+
+    def forward(self, data):
+        output = torch_nn_func.conv1d(data, self.weight, self.bias, 1,
+                                      self.pad, self.dilation)
+        output = output[:, :, :data.shape[2]]
+        if self.tanh:
+            output = torch.tanh(output)
+        return output
+
+    @torch.jit.export
+    def forward_chunk(self, data, cache):
+        """ output, cache = forward_chunk(data, cache)
+        cache: (batchsize=1, dim_in, self.pad)
+        """
+        x = torch.cat((cache, data), dim=2)
+        output = torch_nn_func.conv1d(x, self.weight, self.bias, 1, 0,
+                                      self.dilation)
+        if self.tanh:
+            output = torch.tanh(output)
+        return output, x[:, :, x.shape[2] - self.pad:]
+
+
+class NeuralFilterBlockInference(torch_nn.Module):
+    """ Inference version of a NeuralFilterBlock in (B, C, T) layout
+    Assume: signal (batchsize=1, signal_size, length)
+            context (batchsize=1, hidden_size, length)
+    Output: (batchsize=1, signal_size, length)
+    Linear layers are applied as 1x1 convolutions
+    """
+    def __init__(self, block):
+        super(NeuralFilterBlockInference, self).__init__()
+        self.register_buffer('w_ff_1', 
+                             block.l_ff_1.weight.detach().unsqueeze(-1))
+        self.register_buffer('w_ff_2', 
+                             block.l_ff_2.weight.detach().unsqueeze(-1))
+        self.register_buffer('w_ff_3', 
+                             block.l_ff_3.weight.detach().unsqueeze(-1))
+        self.l_convs = torch_nn.ModuleList(
+            [CausalConvInference(l_conv) for l_conv in block.l_convs])
+        self.scale = float(block.scale)
+
+    def forward(self, signal, context):
+        tmp_hidden = torch.tanh(torch_nn_func.conv1d(signal, self.w_ff_1))
+        for l_conv in self.l_convs:
+            tmp_hidden = tmp_hidden + l_conv(tmp_hidden) + context
+        tmp_hidden = tmp_hidden * self.scale
+        tmp_hidden = torch.tanh(torch_nn_func.conv1d(tmp_hidden, self.w_ff_2))
+        tmp_hidden = torch.tanh(torch_nn_func.conv1d(tmp_hidden, self.w_ff_3))
+        return tmp_hidden + signal
+
+    @torch.jit.export
+    def forward_chunk(self, signal, context, caches):
+        # type: (Tensor, Tensor, List[Tensor]) -> Tuple[Tensor, List[Tensor]]
+        """ output, caches = forward_chunk(signal, context, caches)
+        Streaming version of forward (lists are copied by TorchScript, 
+        the updated caches are returned)
+        """
+        tmp_hidden = torch.tanh(torch_nn_func.conv1d(signal, self.w_ff_1))
+        new_caches = []
+        for idx, l_conv in enumerate(self.l_convs):
+            tmp_conv, cache = l_conv.forward_chunk(tmp_hidden, caches[idx])
+            new_caches.append(cache)
+            tmp_hidden = tmp_hidden + tmp_conv + context
+        tmp_hidden = tmp_hidden * self.scale
+        tmp_hidden = torch.tanh(torch_nn_func.conv1d(tmp_hidden, self.w_ff_2))
+        tmp_hidden = torch.tanh(torch_nn_func.conv1d(tmp_hidden, self.w_ff_3))
+        return tmp_hidden + signal, new_caches
+
+
+class FilterModuleInference(torch_nn.Module):
+    """ Inference-only export of a FilterModuleHnSincNSF
+    Same interface as FilterModuleHnSincNSF (inputs and output in
+    (batchsize, length, dim) layout), but the neural filter blocks run 
+    end-to-end in (batchsize, dim, length) layout, so that the inputs are 
+    transposed once instead of around every convolution. The blocks are
+    compiled with TorchScript if script is True.
+    The weights are copied: the module must be exported again if the
+    filter module is modified.
+    compile: optional function compile(name, block) returning the compiled
+    block (e.g. loaded from a cache), used instead of torch.jit.script
+    """
+    def __init__(self, m_filter, script=True, compile=None):
+        super(FilterModuleInference, self).__init__()
+        self.signal_size = m_filter.signal_size
+        self.hidden_size = m_filter.hidden_size
+        har = [NeuralFilterBlockInference(l) for l in m_filter.l_har_blocks]
+        noi = [NeuralFilterBlockInference(l) for l in m_filter.l_noi_blocks]
+        if script:
+            if compile is None:
+                compile = lambda name, block: torch.jit.script(block)
+            har = [compile('har%d' % idx, l) for idx, l in enumerate(har)]
+            noi = [compile('noi%d' % idx, l) for idx, l in enumerate(noi)]
+        self.l_har_blocks = torch_nn.ModuleList(har)
+        self.l_noi_blocks = torch_nn.ModuleList(noi)
+        # sinc coefficients are still produced by the original module
+        # (kept out of the submodules, with its decimation / LUT settings)
+        self.__dict__['m_filter'] = m_filter
+
+    @staticmethod
+    def tv_filtering(signal, f_coef):
+        """ TimeVarFIRFilter in (batchsize, dim, length) layout
+        signal: (batchsize, dim, length + filter_order - 1), left context
+        f_coef: (batchsize, length, filter_order)
+        """
+        windows = signal.unfold(2, f_coef.shape[-1], 1)
+        return torch.einsum('bdlk,blk->bdl', windows, f_coef.flip(-1))
+
+    def forward(self, har_component, noi_component, cond_feat, cut_f):
+        context = cond_feat.transpose(1, 2).contiguous()
+        har = har_component.transpose(1, 2)
+        noi = noi_component.transpose(1, 2)
+        for l_har_block in self.l_har_blocks:
+            har = l_har_block(har, context)
+        for l_noi_block in self.l_noi_blocks:
+            noi = l_noi_block(noi, context)
+        lp_coef, hp_coef = self.m_filter.sinc_coef(cut_f)
+        order_k = lp_coef.shape[-1]
+        har = self.tv_filtering(torch_nn_func.pad(har, (order_k - 1, 0)), 
+                                lp_coef)
+        noi = self.tv_filtering(torch_nn_func.pad(noi, (order_k - 1, 0)), 
+                                hp_coef)
+        return (har + noi).transpose(1, 2)
+
+    def init_stream_state(self, batch, device):
+        """ conv caches of every block and tails of the sinc filtering
+        (in (batchsize, dim, length) layout)
+        """
+        # sizes from the training module (frozen blocks have no l_convs)
+        def caches(block):
+            return [torch.zeros(batch, self.hidden_size, l_conv.pad_le, 
+                                device=device) for l_conv in block.l_convs]
+        tail = torch.zeros(batch, self.signal_size, 
+                           self.m_filter.l_sinc_coef.order - 1, device=device)
+        return {'har': [caches(l) for l in self.m_filter.l_har_blocks],
+                'noi': [caches(l) for l in self.m_filter.l_noi_blocks],
+                'har_tail': tail, 'noi_tail': tail.clone()}
+
+    def forward_chunk(self, har_component, noi_component, cond_feat, cut_f,
+                      state):
+        """ Streaming version of forward, state is updated in place
+        """
+        context = cond_feat.transpose(1, 2).contiguous()
+        har = har_component.transpose(1, 2)
+        noi = noi_component.transpose(1, 2)
+        for idx, l_har_block in enumerate(self.l_har_blocks):
+            har, state['har'][idx] = l_har_block.forward_chunk(
+                har, context, state['har'][idx])
+        for idx, l_noi_block in enumerate(self.l_noi_blocks):
+            noi, state['noi'][idx] = l_noi_block.forward_chunk(
+                noi, context, state['noi'][idx])
+        lp_coef, hp_coef = self.m_filter.sinc_coef(cut_f)
+        har = torch.cat((state['har_tail'], har), dim=2)
+        noi = torch.cat((state['noi_tail'], noi), dim=2)
+        order_k = lp_coef.shape[-1]
+        state['har_tail'] = har[:, :, har.shape[2] - order_k + 1:]
+        state['noi_tail'] = noi[:, :, noi.shape[2] - order_k + 1:]
+        output = self.tv_filtering(har, lp_coef) + \
+                 self.tv_filtering(noi, hp_coef)
+        return output.transpose(1, 2)
+        
+
 ## FOR MODEL
 class Model(torch_nn.Module):
     """ Model definition
@@ -847,8 +1388,33 @@ class Model(torch_nn.Module):
                                               self.filter_block_num, \
                                               self.cnn_kernel_s, \
                                               self.cnn_num_in_block)
+        # inference-only filter module (see export_inference)
+        self.m_filter_infer = None
         # done
         return
+
+    def export_inference(self, enable=True, script=True, compile=None):
+        """ export_inference(enable=True, script=True, compile=None)
+        Use an inference-only copy of the filter module (channels-first 
+        layout, TorchScript) in eval mode. To be called once the model is 
+        loaded on its device (enable=False goes back to the training module)
+        compile: see FilterModuleInference
+        """
+        filter_infer = None
+        if enable:
+            filter_infer = FilterModuleInference(self.m_filter, script, 
+                                                 compile)
+        # kept out of the submodules so that the state_dict is unchanged
+        self.__dict__['m_filter_infer'] = filter_infer
+        return self
+
+    def filter_module(self):
+        """ filter module used by forward and forward_chunk
+        """
+        filter_infer = self.__dict__.get('m_filter_infer', None)
+        if filter_infer is None or self.training:
+            return self.m_filter
+        return filter_infer
     
     def prepare_mean_std(self, in_dim, out_dim, args, data_mean_std=None):
         """
@@ -914,7 +1480,8 @@ class Model(torch_nn.Module):
         
         # neural filter module (including sinc-based FIR filtering)
         # output
-        output = self.m_filter(har_source, noi_source, cond_feat, cut_f)
+        output = self.filter_module()(har_source, noi_source, cond_feat, 
+                                      cut_f)
         
         #if self.training:
             # just in case we need to penalize the hidden feauture for 
@@ -922,6 +1489,77 @@ class Model(torch_nn.Module):
         #    return [output.squeeze(-1), hid_cut_f]
         #else:
         return output.squeeze(-1)
+
+    def stream_context(self):
+        """ number of feature frames needed after a frame to render it
+        """
+        return self.m_cond.stream_context()
+
+    def init_stream_state(self, batch=1):
+        """ state = init_stream_state(batch=1)
+        Create the state for streaming inference with forward_chunk
+        """
+        device = self.input_mean.device
+        return {'frames': torch.zeros(batch, 0, self.input_dim, 
+                                      device=device),
+                # absolute index of the first buffered frame
+                'frame_offset': 0,
+                # number of frames already rendered
+                'n_done': 0,
+                'phase': self.m_source.l_sin_gen.init_stream_state(batch,
+                                                                   device),
+                'filter': self.filter_module().init_stream_state(batch, 
+                                                                 device)}
+
+    def forward_chunk(self, x, state, last=False):
+        """ output = forward_chunk(x, state, last=False)
+        Streaming (chunk by chunk) version of forward
+        x: new feature frames (batchsize=1, n_frames, dim), can be None
+        state: streaming state from init_stream_state, updated in place
+        last: True for the last chunk of the sequence (flush)
+        output: (batchsize=1, n_rendered * upsamp_rate)
+        
+        A frame is rendered once stream_context() frames following it
+        have been received (or when last is True). The condition module
+        is evaluated over the rendered frames plus their context, while
+        source and neural filters only process the new samples, carrying
+        their state (phase, conv caches, filter tails) across chunks.
+        Output samples are exactly those of forward over the sequence,
+        up to the random source components.
+        """
+        if x is not None:
+            state['frames'] = torch.cat((state['frames'], x), dim=1)
+        context_l = self.stream_context()
+        frames = state['frames']
+        n_total = state['frame_offset'] + frames.shape[1]
+        ready_end = n_total if last else n_total - context_l
+        if ready_end <= state['n_done']:
+            return torch.zeros(frames.shape[0], 0, device=frames.device)
+        
+        # condition module over the buffered window of frames
+        cond_feat, f0_upsamped, cut_f, _ = self.m_cond(
+            self.normalize_input(frames), frames[:, :, -1:])
+        start = (state['n_done'] - state['frame_offset']) * self.upsamp_rate
+        end = (ready_end - state['frame_offset']) * self.upsamp_rate
+        cond_feat = cond_feat[:, start:end]
+        cut_f = cut_f[:, start:end]
+
+        # source module, carrying the phase of the sines
+        har_source, noi_source, uv, state['phase'] = \
+            self.m_source.forward_chunk(f0_upsamped[:, start:end], 
+                                        state['phase'])
+        
+        # neural filter module, carrying the causal convs states
+        output = self.filter_module().forward_chunk(har_source, noi_source, 
+                                                    cond_feat, cut_f,
+                                                    state['filter'])
+        
+        # only keep the frames needed as left context
+        state['n_done'] = ready_end
+        keep = max(state['frame_offset'], ready_end - context_l)
+        state['frames'] = frames[:, keep - state['frame_offset']:]
+        state['frame_offset'] = keep
+        return output.squeeze(-1)
     
     
 class Loss():
@@ -997,4 +1635,159 @@ class Loss():
 if __name__ == "__main__":
     print("Definition of model")
 
+    # Check the vectorized time-variant filtering against the roll version
+    with torch.no_grad():
+        l_tv_filtering = TimeVarFIRFilter()
+        for batch, length, dim in [(1, 1, 1), (1, 5, 1), (2, 22050, 1), (2, 1000, 3)]:
+            signal = torch.randn(batch, length, dim)
+            f_coef = torch.randn(batch, length, 31)
+            err = torch.max(torch.abs(l_tv_filtering(signal, f_coef) - \
+                                      l_tv_filtering.forward_roll(signal, f_coef)))
+            print("TimeVarFIRFilter {}: max abs error {:.3e}".format(
+                (batch, length, dim), err.item()))
+            assert err < 1e-4
+
+    # Check the sinc coefficients (closed-form and LUT) against the reference
+    with torch.no_grad():
+        import time
+        l_sinc = SincFilter(31)
+        cut_f = 0.1 + 0.8 * torch.rand(1, 22050 * 4, 1)
+        signal = torch.randn(1, 22050 * 4, 1)
+        l_tv_filtering = TimeVarFIRFilter()
+        def timed(func):
+            start = time.perf_counter()
+            for _ in range(5):
+                out = func(cut_f)
+            return out, (time.perf_counter() - start) / 5
+        (lp_ref, hp_ref), t_ref = timed(l_sinc.forward_reference)
+        ref = l_tv_filtering(signal, lp_ref) + l_tv_filtering(signal, hp_ref)
+        for lut_size in [None, 256, 1024, 4096]:
+            l_sinc.set_lut(lut_size)
+            l_sinc(cut_f[:, :1])
+            (lp_coef, hp_coef), t_cur = timed(l_sinc)
+            err = max(torch.max(torch.abs(lp_coef - lp_ref)).item(),
+                      torch.max(torch.abs(hp_coef - hp_ref)).item())
+            out = l_tv_filtering(signal, lp_coef) + l_tv_filtering(signal, hp_coef)
+            snr = 10 * torch.log10(torch.sum(ref ** 2) / 
+                                   torch.sum((out - ref) ** 2)).item()
+            print("SincFilter LUT {}: max abs error {:.3e}, SNR {:.1f} dB, "
+                  "{:.1f} ms (reference {:.1f} ms)".format(
+                      lut_size, err, snr, t_cur * 1e3, t_ref * 1e3))
+            assert err < (1e-5 if lut_size is None else 1e-3)
+
+    # Check the prefix-sum moving averages and up-sampling against the
+    # convolution versions
+    with torch.no_grad():
+        import time
+        data = torch.rand(1, 22050 * 4, 1)
+        for window_len, causal, pad_mode in [(512, False, 'replicate'), 
+                                             (2048, False, 'replicate'),
+                                             (31, True, 'replicate'),
+                                             (4, False, 'constant')]:
+            l_ave = MovingAverage(1, window_len, causal, pad_mode)
+            err = torch.max(torch.abs(l_ave(data) - 
+                                      l_ave.forward_reference(data)))
+            print("MovingAverage ({}, {}, {}): max abs error {:.3e}".format(
+                window_len, causal, pad_mode, err.item()))
+            assert err < 1e-5
+        l_upsamp = UpSampleLayer(64, 512, True)
+        feature = torch.tanh(torch.randn(1, 172, 64))
+        def timed(func):
+            start = time.perf_counter()
+            out = func(feature)
+            return out, time.perf_counter() - start
+        ref, t_ref = timed(l_upsamp.forward_reference)
+        out, t_cur = timed(l_upsamp)
+        # the float32 convolutions are less accurate than the prefix sums:
+        # compare both to the convolutions in float64
+        exact = l_upsamp.double().forward_reference(feature.double())
+        err = torch.max(torch.abs(out - exact))
+        err_ref = torch.max(torch.abs(ref - exact))
+        print("UpSampleLayer: max abs error {:.3e}, {:.1f} ms "
+              "(conv {:.3e}, {:.1f} ms)".format(err.item(), t_cur * 1e3, 
+                                                err_ref.item(), t_ref * 1e3))
+        assert err < 1e-5
+
+    # Check the single-accumulator sine generator against the per-harmonic
+    # cumsum version (same random initial phases), and its continuity
+    with torch.no_grad():
+        import time
+        l_sin_gen = SineGen(22050, harmonic_num=16)
+        f0 = 100 + 400 * torch.nn.functional.interpolate(
+            torch.rand(1, 1, 200), size=22050 * 4, mode='linear')
+        f0 = f0.transpose(1, 2)
+        torch.manual_seed(1)
+        start = time.perf_counter()
+        ref = l_sin_gen._f02sine(l_sin_gen._harmonic_f0(f0))
+        t_ref = time.perf_counter() - start
+        torch.manual_seed(1)
+        start = time.perf_counter()
+        state = l_sin_gen.init_stream_state(1, f0.device)
+        sines, _ = l_sin_gen._harmonic_sines(f0, state['f0_phase'], 
+                                             state['offset'])
+        t_cur = time.perf_counter() - start
+        err = torch.max(torch.abs(sines - ref))
+        print("SineGen: max abs error {:.3e}, {:.1f} ms (cumsum {:.1f} ms)"
+              .format(err.item(), t_cur * 1e3, t_ref * 1e3))
+        assert err < 1e-2
+        chunks = []
+        for idx in range(0, f0.shape[1], 5000):
+            chunk, uv, noise, state = l_sin_gen.forward_chunk(
+                f0[:, idx:idx+5000], state)
+            chunks.append(chunk - noise)
+        # without the noise, chunks match the full generation
+        chunks = torch.cat(chunks, dim=1) 
+        err = torch.max(torch.abs(chunks - sines * l_sin_gen.sine_amp))
+        print("SineGen chunks: max abs error {:.3e}".format(err.item()))
+        assert err < 1e-5
+
+    # Check the inference-only filter module against the training module
+    with torch.no_grad():
+        import time
+        m_filter = FilterModuleHnSincNSF(1, 64).eval()
+        length = 22050 * 2
+        inputs = [torch.randn(1, length, 1), torch.randn(1, length, 1),
+                  torch.randn(1, length, 64), 
+                  0.1 + 0.8 * torch.rand(1, length, 1)]
+        for script in [False, True]:
+            m_infer = FilterModuleInference(m_filter, script)
+            m_infer(*inputs)
+            times = []
+            for module in [m_filter, m_infer]:
+                start = time.perf_counter()
+                for _ in range(3):
+                    output = module(*inputs)
+                times.append((time.perf_counter() - start) / 3)
+                if module is m_filter:
+                    ref = output
+            err = torch.max(torch.abs(output - ref))
+            print("FilterModuleInference (script {}): max abs error {:.3e}, "
+                  "{:.1f} ms (training module {:.1f} ms)".format(
+                      script, err.item(), times[1] * 1e3, times[0] * 1e3))
+            assert err < 1e-4
+
+    # Check the streaming inference against a forward pass
+    # (voiced F0 and no additive noise, so that outputs are deterministic)
+    with torch.no_grad():
+        class args:
+            sr = 22050
+        model = Model(7, 1, args).eval()
+        model.m_source.sine_amp = 0
+        model.m_source.l_sin_gen.noise_std = 0
+        feats = torch.rand(1, 40, 7)
+        feats[:, :, -1] = 100 + 200 * torch.rand(1, 40)
+        torch.manual_seed(2)
+        output = model(feats)
+        for export in [False, True]:
+            model.export_inference(export)
+            torch.manual_seed(2)
+            state = model.init_stream_state()
+            chunks = [model.forward_chunk(feats[:, i:i+3], state) \
+                      for i in range(0, 40, 3)]
+            chunks.append(model.forward_chunk(None, state, last=True))
+            err = torch.max(torch.abs(torch.cat(chunks, dim=1) - output))
+            print("Streaming inference (export {}): max abs error {:.3e}".format(
+                export, err.item()))
+            assert err < 1e-3
+
     
@@ -1,42 +1,33 @@
 import torch
-import librosa
 import numpy as np
 import time
 import os
-import random
-import tqdm
 # import torchaudio
-import soundfile as sf
 import threading
 from multiprocessing import Event, Process
-
-def spectral_features(y, sr):
-    features = [None] * 7
-    features[0] = librosa.feature.rms(y)
-    features[1] = librosa.feature.zero_crossing_rate(y)
-    # Spectral features
-    S, phase = librosa.magphase(librosa.stft(y=y))
-    # Compute all descriptors
-    features[2] = librosa.feature.spectral_rolloff(S=S)
-    features[3] = librosa.feature.spectral_flatness(S=S)
-    features[4] = librosa.feature.spectral_bandwidth(S=S)
-    features[5] = librosa.feature.spectral_centroid(S=S)
-    features[6] = librosa.yin(y, 50, 5000, sr=sr)[np.newaxis, :]
-    features = np.concatenate(features).transpose()
-    features[np.isnan(features)] = 1
-    features = features[:-1, :]
-    return features
+from models.features import FeatureCache
+from models.cache import ModelCache
+from models.interpolation import FeatureInterpolator
+from buffers import BlockStore
+from writers import WavWriter
 
 
 class NSF:
     m_path = "./models/model_nsf_sinc_ema_impacts_waveform_5.0.th"
     # m_path = "/home/hime/Work/Neurorack/Impact-Synth-Hardware/code/models/model_nsf_sinc_ema_impacts_waveform_5.0.th"
     trt_path = "./models/model_trt_5.0.th"
-    f_pass = 1
+    f_pass = 3
+    sr = 22050
+    block_size = 512
+    # Number of reference sounds used by the interpolations
+    n_sounds = 3
+    # Change of a (normalized) feature triggering the re-render of a frame
+    dirty_tol = 1e-3
 
-    def __init__(self):
+    def __init__(self, device="cuda"):
         # Testing NSF
         print('Creating empty NSF')
+        self._device = device
         self._model = None
         self._wav_file = 'reference_impact.wav'
         self._n_blocks = 15
@@ -45,47 +36,74 @@ class NSF:
         self._last_gen_block = 0
         self._last_request_block = -1
         self._block_lookahead = 1
-        self._last_val = None
+        self._stream_state = None
+        self._stream_fed = 0
+        # First block of the window the stream state is positioned at, and
+        # stream states saved at the start of every window, with their
+        # validity (invalid once an earlier window has new features)
+        self._state_block = -1
+        self._snapshots = {}
+        self._snap_valid = {}
+        # Incremented by every feature update marking dirty windows
+        self._epoch = 0
+        # Windows whose features changed since they were rendered
+        self._dirty = None
         self._current_chunk = None
         self._next_chunk = None
-        self._generated_queue = []
+        self._blocks = None
         self._generate_end = False
+        self._generate_stop = False
         self._generate_signal = Event()
         self._features = None
-        self._features_list = None
+        self._interp = None
+        # Serializes the publication of new features and their use by the
+        # generation thread (buffers in use are not overwritten by mixtures)
+        self._features_lock = threading.Lock()
+        self._features_cache = FeatureCache()
+        self._model_cache = ModelCache()
+        self._model_key = None
 
     def dummy_features(self, wav):
-        y, sr = librosa.load(wav)
-        features = spectral_features(y, sr)
-        return features
+        return np.array(self._features_cache.load(wav))
 
-    def preload(self):
+    def load_model(self):
         torch.backends.cudnn.benchmark = True
         #if (not os.path.exists(self.trt_path)):
-        self._model = torch.load(self.m_path, map_location="cuda")
-        self._model = self._model.cuda()
+        self._model = torch.load(self.m_path, map_location=self._device)
+        self._model = self._model.to(self._device)
         #else:
         #    self._model = TRTModule()
         #    self._model.load_state_dict(torch.load(self.trt_path))
         #    self._model = self._model.cuda()
         self._model.eval()
+        # Channels-first TorchScript copy of the neural filters for inference
+        # (frozen and optimized blocks are loaded from the compiled cache)
+        self._model_key = self._model_cache.key(self.m_path, self._device, methods=['forward_chunk'])
+        def compile_block(name, block):
+            return self._model_cache.load(self._model_key + '-' + name, lambda: torch.jit.script(block),
+                                          self._device, ['forward_chunk'])
+        self._model.export_inference(compile=compile_block)
         print("NSF model loaded")
+
+    def preload(self):
+        self.load_model()
         self.features_loading()
-        self._features = self._features_list[0]
+        self._features = self._interp.reference(0)
+        # Store of all the generated blocks of the sound (whole windows only)
+        n_frames = self._features.shape[1]
+        self._blocks = BlockStore(((n_frames - 1) // self._n_blocks) * self._n_blocks, self.block_size)
+        self._dirty = np.zeros(self._blocks.n_blocks // self._n_blocks, dtype=bool)
         tmp_features = []
         for b in range(self._n_batch):
             tmp_features.append(self._features[:, (b*self._n_blocks):((b+1)*self._n_blocks)+1, :])
         tmp_features = torch.cat(tmp_features)
         print(tmp_features.shape)
-        for p in range(self.f_pass):
-            print("Starting NSF pass")
-            cur_time = time.monotonic()
+        def warm_up_pass():
             with torch.no_grad():
-                cur_blocks = self._model(tmp_features).squeeze().cpu()#.numpy()
-            print('Time : ' + str(time.monotonic() - cur_time))
-        # for b in range(self._n_blocks):
-        #    self._generated_queue.append(cur_blocks[(b * 512):((b+1)*512)])
-        #    self._last_gen_block = self._n_blocks
+                self._model(tmp_features).squeeze().cpu()
+        # Profiling passes of the executor (run on every boot)
+        times = self._model_cache.warm_up(self._model_key, warm_up_pass, self.f_pass)
+        print('NSF warm-up passes : ' + ', '.join(['%.3f s' % t for t in times]))
         #if (not os.path.exists(self.trt_path)):
         #    print("Switching model to TRT")
         #    self._model = torch2trt(self._model, [tmp_features])
@@ -94,9 +112,21 @@ class NSF:
         # print(len(self._features))
         self.start_generation_thread_full()
 
-    def generate_random(self, length=200):
-        print('Generating random length ' + str(length))
-        features = [torch.randn(1, length, 1).cuda()] * 7
+    def unload(self):
+        ''' Stop the generation thread and release the model '''
+        self._generate_stop = True
+        self._generate_signal.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._model = None
+        self._stream_state = None
+        self._snapshots = {}
+        self._snap_valid = {}
+        self._blocks = None
+
+    def generate_random(self, length=200, batch=1):
+        features = torch.randn(batch, length, 7, device=self._device)
         with torch.no_grad():
             audio = self._model(features)
         return audio.squeeze().detach().cpu().numpy()
@@ -116,24 +146,73 @@ class NSF:
         # Signal the generation thread
         # self._generate_signal.set()
         
+    @staticmethod
+    def copy_state(state):
+        # Containers are copied, tensors are shared (never modified in place)
+        if isinstance(state, dict):
+            return {k: NSF.copy_state(v) for k, v in state.items()}
+        if isinstance(state, list):
+            return [NSF.copy_state(v) for v in state]
+        return state
+
+    def restore_stream_state(self, block_id, features):
+        '''
+            Position the stream state at the start of a window, from the
+            state saved when it was last reached. The buffered frames are
+            taken from the current features.
+        '''
+        snapshot = self._snapshots.get(block_id)
+        if block_id == 0 or snapshot is None:
+            state = self._model.init_stream_state()
+            fed = 0
+            if block_id > 0:
+                # Never reached : start from silence with the left context
+                fed = block_id
+                state['frame_offset'] = max(block_id - self._model.stream_context(), 0)
+                state['n_done'] = block_id
+        else:
+            state, fed = self.copy_state(snapshot[0]), snapshot[1]
+        state['frames'] = features[:, state['frame_offset']:fed, :]
+        self._stream_state, self._stream_fed = state, fed
+
     def generate_block(self, block_id):
-        cur_feats = self._features[:, block_id:(block_id + self._n_blocks + 1), :]
-        # print(cur_feats.shape)
+        # Features are held (not overwritten by new mixtures) during the render
+        with self._features_lock:
+            features = self._features
+            held = self._interp.acquire(features)
+            epoch = self._epoch
+        try:
+            cur_audio = self.render_window(block_id, features, epoch)
+        finally:
+            with self._features_lock:
+                self._interp.release(held)
+        return cur_audio
+
+    def render_window(self, block_id, features, epoch):
+        # Streaming inference continues from the previous window, or
+        # restarts from the state saved at the start of the window
+        if block_id != self._state_block or self._stream_state is None or \
+                not self._snap_valid.get(block_id, block_id == 0):
+            self.restore_stream_state(block_id, features)
+        # Feed frames up to the lookahead needed to render the requested blocks
+        n_frames = features.shape[1]
+        feed_end = min(block_id + self._n_blocks + self._model.stream_context(), n_frames)
+        cur_feats = features[:, self._stream_fed:feed_end, :]
+        self._stream_fed = feed_end
         with torch.no_grad():
-            cur_audio = self._model(cur_feats).squeeze().detach().cpu().numpy()
-        if self._last_val is not None:
-            cur_audio[:512] = (self._last_val * np.linspace(1, 0, 512)) + (cur_audio[:512] * np.linspace(0, 1, 512))
-        self._last_val = cur_audio[-512:]
-        cur_audio = cur_audio[:-512]
-        block_audio = []
-        # print('CV ' + str(cv_id) + ' going active')
-        for b in range(self._n_blocks):
-            block_audio.append(cur_audio[(b * 512):((b+1)*512)])
-        return block_audio
+            cur_audio = self._model.forward_chunk(cur_feats, self._stream_state, last=(feed_end == n_frames))
+        self._state_block = block_id + self._n_blocks
+        self._snapshots[self._state_block] = (self.copy_state(self._stream_state), self._stream_fed)
+        # Valid only if no window got new features during the render
+        with self._features_lock:
+            self._snap_valid[self._state_block] = (epoch == self._epoch) and \
+                self._snap_valid.get(block_id, block_id == 0)
+        # Flat audio of the blocks (sliced by the block store)
+        return cur_audio.reshape(-1).detach().cpu().numpy()
     
     def generate_thread_full(self, args):
         # First do a full generation
-        while True:
+        while not self._generate_stop:
             # We have generated the full queue
             if (self._last_gen_block + self._n_blocks + 1) > self._features.shape[1]:
                 self.generate_end = True
@@ -141,45 +220,93 @@ class NSF:
                 break
             # Generate a new block
             cur_audio = self.generate_block(self._last_gen_block)
-            # Append blocks to queue
-            for b in range(self._n_blocks):
-                self._generated_queue.append(cur_audio[b])
+            self._blocks.write(self._last_gen_block, cur_audio)
             self._last_gen_block += self._n_blocks
         # Then switch to block-wise mode
         self.generate_thread_block(args)
     
     def generate_thread_block(self, args):
         self._generate_signal.clear()
-        while True:
-            # We have generated the full queue
-            if (self._last_gen_block + self._n_blocks + 1) > self._features.shape[1]:
+        while not self._generate_stop:
+            window = self.next_dirty_window()
+            if window is None:
+                # Every window is up to date
                 self._generate_end = True
-                # print('Generate thread going to sleep')
                 self._generate_signal.wait()
-            # Waking up to generate
-            if self._generate_signal.is_set():
                 self._generate_signal.clear()
-                self._last_gen_block = 0
-            # Infer which block to generate
-            # gen_block = (self.last_request_block // self._n_blocks) * self.n_blocks
-            # gen_block += (self.block_lookahead * self._n_blocks)
-            gen_block = self._last_gen_block
-            if gen_block == 0:
-                self._last_val = None
-            else:
-                self._last_val = self._generated_queue[gen_block]
-            if gen_block + self._n_blocks > len(self._generated_queue):
                 continue
-            cur_audio = self.generate_block(self._last_gen_block)
-            # Change blocks to queue
-            for b in range(self._n_blocks):
-                self._generated_queue[gen_block+b] = cur_audio[b]
-            if gen_block + self._n_blocks < len(self._generated_queue):
-                n_block = self._generated_queue[gen_block + self._n_blocks]
-                self._generated_queue[gen_block + self._n_blocks] = (self._last_val * np.linspace(1, 0, 512)) + (n_block * np.linspace(0, 1, 512))
-            #print('Finished update from ' + str(gen_block) + ' to ' + str(gen_block + self._n_blocks))
-            self._last_gen_block += self._n_blocks
-                          
+            self._generate_end = False
+            # The state at the start of the window must come from the new
+            # features of the earlier windows : render from the closest
+            # window starting at a valid snapshot
+            start = window
+            while start > 0 and not self._snap_valid.get(start * self._n_blocks, False):
+                start -= 1
+            for w in range(start, window + 1):
+                # Cleared first, so that a change during the render marks it again
+                self._dirty[w] = False
+                gen_block = w * self._n_blocks
+                cur_audio = self.generate_block(gen_block)
+                # Rewrite the blocks in place (crossfaded with the previous sound)
+                self._blocks.write(gen_block, cur_audio)
+                self._last_gen_block = gen_block + self._n_blocks
+                if self._generate_stop or self._generate_signal.is_set():
+                    # New features : restart from the new dirty windows
+                    self._generate_signal.clear()
+                    break
+
+    def next_dirty_window(self):
+        '''
+            Next window to re-render, in playback order from the play head
+            (wrapping around to the windows already played), None if clean.
+            Windows ahead of the head are rendered from the start of the
+            earliest window whose snapshot is no longer valid (see
+            generate_thread_block), so they never use a stale state.
+        '''
+        dirty = np.flatnonzero(self._dirty)
+        if len(dirty) == 0:
+            return None
+        head = max(self._last_request_block, 0) // self._n_blocks
+        ahead = dirty[dirty >= head]
+        return int(ahead[0]) if len(ahead) > 0 else int(dirty[0])
+
+    def update_features(self):
+        '''
+            Replace the features of the sound by the mixture of the current
+            interpolation weights, and mark as dirty the windows whose
+            output depends on frames that changed beyond dirty_tol
+            (normalized by the feature deviations of the model), so that
+            only those are re-rendered.
+            Returns:
+                Number of windows marked for re-rendering
+        '''
+        with self._features_lock:
+            features = self._interp.mix()
+            with torch.no_grad():
+                diff = (features - self._features).abs() / self._model.input_std
+                changed = torch.nonzero(diff.amax(dim=(0, 2)) > self.dirty_tol).flatten().cpu().numpy()
+            self._features = features
+        if len(changed) == 0:
+            return 0
+        # A frame affects the windows within the context of the model
+        context = self._model.stream_context()
+        frames = (changed[:, np.newaxis] + np.arange(-context, context + 1)).ravel()
+        windows = np.unique(np.clip(frames, 0, None) // self._n_blocks)
+        # Windows not generated yet will use the new features anyway
+        windows = windows[windows < self._blocks.written // self._n_blocks]
+        if len(windows) == 0:
+            return 0
+        with self._features_lock:
+            # States saved after the first changed window are now stale
+            first = windows[0] * self._n_blocks
+            for block in self._snap_valid:
+                if block > first:
+                    self._snap_valid[block] = False
+            self._epoch += 1
+            self._dirty[windows] = True
+        self._generate_signal.set()
+        return len(windows)
+
     def request_block_direct(self, block_idx):
         print('Request block : ' + str(block_idx))
         print(len(self._features))
@@ -190,7 +317,8 @@ class NSF:
             print('Need next block')
             self._current_chunk = self.generate_block(block_idx)
             print('Block generated')
-        return self._current_chunk[block_idx % self._n_blocks]
+        b = block_idx % self._n_blocks
+        return self._current_chunk[(b * self.block_size):((b+1) * self.block_size)]
     
     def request_block_threaded(self, block_idx):
         # print('Request block : ' + str(block_idx))
@@ -198,54 +326,39 @@ class NSF:
         self._last_request_block = block_idx
         # Signal the generation thread
         # self._generate_signal.set()
-        # Check if we have ended
-        if len(self._generated_queue) <= block_idx:
+        # End of the sound (None), or view of the block (silent if the
+        # generation thread is late, counted in the store underruns)
+        if self._blocks is None:
             return None
-        return self._generated_queue[block_idx]
+        return self._blocks.read(block_idx)
 
     def features_loading(self):
         wav_list = ['dce_synth_one_shot_bumper_G#min.wav', 'SH_FFX_123BPM_IMPACT_01.wav',
                     'FF_ET_whoosh_hit_little.wav', 'Afro_FX_Oneshot_Impact_3.wav']
-        for wav in wav_list:
-            if not os.path.exists("models/features_interp" + str(wav) + ".th"):
-                y, sr = librosa.load("data/" + wav)
-                features = spectral_features(y, sr)
-                features = torch.tensor(features).unsqueeze(0).cuda().float()
-                torch.save(features, "models/features_interp" + str(wav) + ".th")
         feats = []
-        for wav in wav_list:
-            ft = torch.load("models/features_interp" + str(wav) + ".th")
-            feats.append(ft)
-        # Create sounds list
-        snd_list = [] * 4
-        # print('CV ' + str(cv_id) + ' going active')
-        min_size = np.inf
-        for i in range(3):
-            snd_list.append(feats[i])
-            if feats[i].shape[1] < min_size:
-                min_size = feats[i].shape[1]
-                # Crop to the min size
-        for i in range(len(snd_list)):
-            snd_list[i] = snd_list[i][:, :min_size, :]
-        self._features_list = snd_list
+        for wav in wav_list[:self.n_sounds]:
+            features = np.array(self._features_cache.load("data/" + wav))
+            feats.append(torch.from_numpy(features).unsqueeze(0).to(self._device))
+        # Reference sounds stacked (and cropped to the min size) on the device
+        self._interp = FeatureInterpolator(feats)
 
     def interp_duo(self, cv_list):
         # Simulate CVs
         # cv_list = [random.sample(range(-4, 4), 1)[0]] * 4
         cv_list = [(x + 4) / 8 for x in cv_list]
         print(cv_list)
-        snd_1 = self._features_list[0]
-        snd_2 = self._features_list[1]
-        # Run through CV values
+        # Run through CV values (other features are those of the first sound)
         # TODO: cv1 = rms [0], cv2 = flatness [3], cv3 = centroid [5], ccv4 = pitch [6]
         feats_list = [0, 3, 5, 6]
-        x_interp = snd_1.clone()
+        weights = self._interp.weights
+        weights[:] = 0
+        weights[0] = 1
         for i, alpha in zip(feats_list, cv_list):
-            x_interp[:, :, i] = (1 - alpha) * snd_2[:, :, i] + alpha * snd_1[:, :, i]
-        self._features = x_interp
+            weights[0, i] = alpha
+            weights[1, i] = 1 - alpha
+        n_dirty = self.update_features()
         print(torch.mean(self._features, dim=(0, 1)))
-        print('End of interpolate')
-        self._generate_signal.set()
+        print('End of interpolate (' + str(n_dirty) + ' windows to render)')
 
     def interp_trio(self, cv_list):
         # Simulate CVs
@@ -253,15 +366,15 @@ class NSF:
         cv_list = [(x + 4) / 8 for x in cv_list]
         cv_sum = sum(cv_list)
         if abs(2 - cv_sum) < 0.1:
-            cv_list = [1, 0, 0, 0]
+            cv_list = [1] + [0] * (len(cv_list) - 1)
         print(cv_list)
-        # Run through CV values
-        interp = torch.zeros_like(self._features_list[0])
-        for i, snd in enumerate(self._features_list):
-            interp += snd * cv_list[i] / cv_sum
-        self._features = interp
-        print('End of interpolate')
-        self._generate_signal.set()
+        # One CV per reference sound (extra CVs are ignored)
+        weights = self._interp.weights
+        weights[:] = 0
+        for i in range(min(len(cv_list), self._interp.n_sounds)):
+            weights[i] = cv_list[i] / cv_sum
+        n_dirty = self.update_features()
+        print('End of interpolate (' + str(n_dirty) + ' windows to render)')
         
     def interp_final(self, cv_control, cv3, cv4, cv5):
         print('Interpolating sounds')
@@ -270,29 +383,70 @@ class NSF:
         print(cv4)
         print(cv5)
         alpha = (cv_control + 4) / 8
-        # Run through CV values
-        interp = (1 - alpha) * self._features_list[0] + (alpha * self._features_list[1])
-        interp[:, :, 2] = interp[:, :, 2] * torch.tensor(cv3).unsqueeze(0).cuda()
-        interp[:, :, 3] = interp[:, :, 3] * torch.tensor(cv4).unsqueeze(0).cuda()
-        interp[:, :, 4] = interp[:, :, 4] * torch.tensor(cv5).unsqueeze(0).cuda()
-        self._features = interp
-        print('End of interpolate')
-        self._generate_signal.set()
-        
+        # Run through CV values (features 2 to 4 are scaled by cv3 to cv5)
+        weights = self._interp.weights
+        weights[:] = 0
+        weights[0] = 1 - alpha
+        weights[1] = alpha
+        weights[:, 2:5] *= [cv3, cv4, cv5]
+        n_dirty = self.update_features()
+        print('End of interpolate (' + str(n_dirty) + ' windows to render)')
+
+def check_dirty(device='cpu'):
+    '''
+        Change the f0 of two frames on both sides of a play head set in the
+        middle of the sound, then check that, once the dirty windows are
+        re-rendered, the state at the end of every window up to the last
+        dirty one (phase of the sines) is that of a sequential render of the
+        new features (later windows keep their audio, crossfaded).
+    '''
+    model = NSF(device=device)
+    model.preload()
+    while not model._generate_end:
+        time.sleep(0.1)
+    n, n_windows = model._n_blocks, len(model._dirty)
+    features = model._features.clone()
+    features[:, 3 * n + 5, 6] *= 1.2
+    features[:, (n_windows - 3) * n + 5, 6] *= 1.2
+    model._last_request_block = (n_windows // 2) * n
+    model._interp.mix = lambda: features
+    print('Dirty windows : %d' % model.update_features())
+    time.sleep(0.1)
+    while model._dirty.any() or not model._generate_end:
+        time.sleep(0.05)
+    last = ((n_windows - 3) * n + 5 + model._model.stream_context()) // n
+    phases = [model._snapshots[w * n][0]['phase']['f0_phase'] for w in range(1, last + 2)]
+    # Stop the generation thread, then render sequentially
+    model._generate_stop = True
+    model._generate_signal.set()
+    model._thread.join()
+    model._stream_state = None
+    for w in range(last + 1):
+        model.render_window(w * n, features, model._epoch)
+        reference = model._snapshots[(w + 1) * n][0]['phase']['f0_phase']
+        assert torch.allclose(phases[w], reference, atol=1e-9), 'stale state at window %d' % (w + 1)
+    print('States of windows 0 to %d match a sequential render' % last)
 
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='NSF impacts model')
+    parser.add_argument('--check_dirty', action='store_true', help='check the re-render of dirty windows')
+    args = parser.parse_args()
+    if args.check_dirty:
+        check_dirty()
+        exit(0)
     root_dir = "/home/Music"
     wav_adresses = [files_names for files_names in os.listdir(root_dir) if
                     (files_names.endswith('.wav') or files_names.endswith('.mp3'))]
     model = NSF()
     model.preload()
-    for wav in wav_adresses:
-        y, sr = librosa.load(root_dir + '/' + wav)
-        features = spectral_features(y, sr)
-        print(features.shape)
-        features = torch.tensor(features).unsqueeze(0).cuda().float()
-        audio = model.generate(features)
-        sf.write("generate" + str(wav) + ".wav", audio, sr)
+    with WavWriter() as writer:
+        for wav in wav_adresses:
+            features = model.dummy_features(root_dir + '/' + wav)
+            print(features.shape)
+            features = torch.tensor(features).unsqueeze(0).cuda().float()
+            audio = model.generate(features)
+            writer.write("generate" + str(wav) + ".wav", audio, model.sr)
 
 
@@ -7,22 +7,49 @@ so I import it inside a class variable
 """
 
 class RAVE():
-    def __init__(self):
+    sr = 22050
+
+    def __init__(self, device="cuda"):
         self.model = None
         self.torch = None
         self.m_path = "./models/vintage.ts"
         self.f_pass = 3
+        self.device = device
+        self.cache = None
+        self.key = None
+        # Latent track of a looping input (see encode_track)
+        self._track = None
+        self._track_audio = None
+        self._track_block = None
+        self._gains = None
+        # Number of latent dimensions (read from the encoder at load time)
+        self.n_latents = None
 
-    def preload(self):
+    def load_model(self):
         print('Loading torch')
         import torch
         self.torch = torch
         self.torch.backends.cudnn.benchmark = True
 
         print("Loading RAVE model")
-        self.model = self.torch.jit.load(self.m_path, map_location="cuda")
-        print("RAVE model loaded")
-        # self.burn_in()
+        # Frozen and optimized artifact from the compiled models cache
+        from models.cache import ModelCache
+        self.cache = ModelCache()
+        methods = ['encode', 'decode', 'prior']
+        self.key = self.cache.key(self.m_path, self.device, methods=methods)
+        self.model = self.cache.load_script(self.m_path, self.device, methods, self.key)
+        self.n_latents = self.latent_size()
+        print("RAVE model loaded (%d latents)" % self.n_latents)
+
+    def latent_size(self, block_len: int = 2048):
+        ''' Number of latent dimensions, from the output of the encoder '''
+        with self.torch.no_grad():
+            x = self.torch.zeros(1, 1, block_len, device=self.device)
+            return int(self.model.encode(x).shape[1])
+
+    def preload(self):
+        self.load_model()
+        self.burn_in()
 
     # def test(self, length=48):
     #     # length 1 = 2048, 24 ~= 1sec
@@ -43,35 +70,92 @@ class RAVE():
     #     # print(f"Model generation min: {self.torch.min(audio)} / max: {self.torch.max(audio)}")
     #     return audio.cpu()
 
-    def generate_random(self, length=48):
+    def generate_random(self, length=48, batch=1):
         # length 1 = 2048, 24 ~= 1sec
         with self.torch.no_grad():
             # 1 temperature value for each time step, outputs [n_latents, length]
-            lat = self.torch.randn(1, 8, length).cuda()
-            audio = self.model.decode(lat)
-            audio = audio.squeeze(0).squeeze(-1)[0]
+            lat = self.torch.randn(batch, 8, length, device=self.device)
+            audio = self.model.decode(lat)[:, 0]
+            audio = audio.squeeze(0)
         # print(f"Model generation min: {self.torch.min(audio)} / max: {self.torch.max(audio)}")
         return audio.cpu()
 
-    def generate_prior(self, length=48):
+    def generate_prior(self, length=48, batch=1):
         # length 1 = 2048, 24 ~= 1sec
         with self.torch.no_grad():
             # 1 temperature value for each time step, outputs [n_latents, length]
-            lat = self.model.prior(self.torch.randn(1, 1, length).cuda())
-            audio = self.model.decode(lat)
-            audio = audio.squeeze(0).squeeze(-1)[0]
+            lat = self.model.prior(self.torch.randn(batch, 1, length, device=self.device))
+            audio = self.model.decode(lat)[:, 0]
+            audio = audio.squeeze(0)
         # print(f"Model generation min: {self.torch.min(audio)} / max: {self.torch.max(audio)}")
         return audio.cpu()
 
     def forward(self, audio):
         with self.torch.no_grad():
-            audio = self.model(self.torch.tensor(audio).cuda().float())
+            audio = self.model(self.torch.tensor(audio).to(self.device).float())
             audio = audio.squeeze(0).squeeze(0)
         return audio.cpu()
 
     def encode(self, audio):
         with self.torch.no_grad():
-            lats = self.model.encode(self.torch.tensor(audio).cuda().float())
+            lats = self.model.encode(self.torch.tensor(audio).to(self.device).float())
+        return lats
+
+    def encode_track(self, audio, block_len, batch=16):
+        '''
+            Encode a looping input once, block by block (batched), so that
+            the real-time path only decodes. The latents of every block are
+            those that encode would give for this block alone.
+            Parameters:
+                audio:      [np.ndarray]
+                            Input audio (cropped to a multiple of block_len),
+                            kept as the key of the track (see has_track)
+                block_len:  [int]
+                            Number of samples per block
+                batch:      [int], optional
+                            Number of blocks encoded at once [default: 16]
+        '''
+        blocks = self.torch.tensor(audio[:(len(audio) // block_len) * block_len]).float()
+        blocks = blocks.reshape(-1, 1, block_len)
+        lats = []
+        with self.torch.no_grad():
+            for b in range(0, blocks.shape[0], batch):
+                lats.append(self.model.encode(blocks[b:b + batch].to(self.device)))
+        # Track (n_blocks, n_latents, n_frames) and buffer of a modulated block
+        self._track = self.torch.cat(lats)
+        self._track_block = self.torch.empty_like(self._track[:1])
+        self._track_audio = audio
+        print('RAVE latent track : ' + str(tuple(self._track.shape)))
+
+    def has_track(self, audio):
+        '''
+            Check if the latent track of an input is already encoded. The
+            input is identified by the array object given to encode_track
+            (pass the full sample, not a slice which is a new object).
+        '''
+        return self._track is not None and self._track_audio is audio
+
+    def latent_block(self, block_idx):
+        '''
+            Latents of a block of the track, copied into a preallocated
+            buffer (1, n_latents, n_frames) that can be modulated in place.
+        '''
+        self._track_block.copy_(self._track[block_idx:block_idx + 1])
+        return self._track_block
+
+    def modulate(self, lats, gains):
+        '''
+            Multiply the latents in place by per-frame gains (n_latents,
+            n_frames), copied into a preallocated device buffer. Gains may
+            only cover the first latents (see modulation.publish_latents).
+        '''
+        n = gains.shape[0]
+        if n > lats.shape[1]:
+            raise ValueError('%d latent gains for a model with %d latents' % (n, lats.shape[1]))
+        if self._gains is None or self._gains.shape[1:] != (n, lats.shape[2]):
+            self._gains = self.torch.empty(1, n, lats.shape[2], dtype=lats.dtype, device=lats.device)
+        self._gains[0].copy_(self.torch.from_numpy(gains[:n]))
+        lats[:, :n].mul_(self._gains)
         return lats
 
     def decode(self, lats):
@@ -80,16 +164,41 @@ class RAVE():
         return audio.cpu().squeeze(0)
 
     def burn_in(self):
-        for p in range(self.f_pass):
-            print("Starting RAVE preload pass", p, self.f_pass)
-            cur_time = time.monotonic()
+        def burn_in_pass():
             with self.torch.no_grad():
-                x = self.torch.randn(1, 1, 1).cuda()
+                x = self.torch.randn(1, 1, 1, device=self.device)
                 audio = self.model(x)
-            print('Time : ' + str(time.monotonic() - cur_time))
+        # Profiling passes of the executor (run on every boot)
+        times = self.cache.warm_up(self.key, burn_in_pass, self.f_pass)
+        print('RAVE burn-in passes : ' + ', '.join(['%.3f s' % t for t in times]))
 
 
 if __name__ == '__main__':
-    rave = RAVE()
-    rave.preload()
-    print(rave.generate_prior_random())
+    import argparse
+    parser = argparse.ArgumentParser(description='RAVE model')
+    parser.add_argument('--check_track', action='store_true', help='check that a loop is encoded once')
+    args = parser.parse_args()
+    if args.check_track:
+        # Render loop of the audio process with a counting stand-in encoder
+        import torch
+        import numpy as np
+        class Encoder():
+            n_calls = 0
+            def encode(self, x):
+                Encoder.n_calls += 1
+                return torch.nn.functional.avg_pool1d(x, 512).repeat(1, 8, 1)
+        rave = RAVE(device='cpu')
+        rave.torch, rave.model = torch, Encoder()
+        assert rave.latent_size() == 8 and Encoder.n_calls == 1
+        Encoder.n_calls = 0
+        sample = np.random.randn(2048 * 20 + 100).astype(np.float32)
+        for block in range(5):
+            if not rave.has_track(sample):
+                rave.encode_track(sample, 2048)
+            lats = rave.latent_block(block)
+        assert Encoder.n_calls == 2 and rave._track.shape[0] == 20, Encoder.n_calls
+        print('Loop encoded once (%d batches) over 5 blocks' % Encoder.n_calls)
+    else:
+        rave = RAVE()
+        rave.preload()
+        print(rave.generate_prior())
@@ -0,0 +1,297 @@
+"""
+
+ ~ Neurorack project ~
+ Registry : Named access to the deep model wrappers
+
+ This file maps model names to the RAVE / NSF / DDSP wrappers. Models
+ are only imported and loaded when first requested, a configurable
+ number of them are kept warm in memory (least-recently used models
+ are evicted), and the active model can be swapped between two audio
+ blocks while another one is loading in the background. Evicted models
+ are released (threads joined, memory collected) by a background thread,
+ never by the audio thread.
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import gc
+import sys
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+
+def create_rave(device):
+    from models.rave import RAVE
+    return RAVE(device=device)
+
+
+def create_nsf(device):
+    from models.nsf_impacts import NSF
+    return NSF(device=device)
+
+
+def create_ddsp(device):
+    from models.ddsp import DDSP
+    return DDSP(device=device)
+
+
+# Wrapper constructors (imports are deferred until a model is created)
+factories = {
+    'rave': create_rave,
+    'nsf': create_nsf,
+    'ddsp': create_ddsp
+}
+
+
+def create_model(name: str, device: str = 'cpu'):
+    '''
+        Create a model wrapper from its name (imports are deferred so that
+        only the requested models are loaded).
+    '''
+    if name not in factories:
+        raise NotImplementedError
+    return factories[name](device)
+
+
+class ModelRegistry():
+    '''
+        The ModelRegistry class loads models lazily, keeps the n_warm most
+        recently used ones in memory and hands the active model over to the
+        audio thread at block boundaries (see swap).
+    '''
+
+    def __init__(self,
+                 device: str = 'cuda',
+                 n_warm: int = 2):
+        '''
+            Constructor - Creates a new instance of the ModelRegistry class.
+            Parameters:
+                device:     [str], optional
+                            Device on which models are loaded [default: cuda]
+                n_warm:     [int], optional
+                            Number of models kept in memory [default: 2]
+        '''
+        self.device = device
+        self._n_warm = max(n_warm, 1)
+        # Loaded models, from least to most recently used
+        self._warm = OrderedDict()
+        self._active = None
+        self._active_name = None
+        # Model ready to become active at the next block boundary
+        self._pending = None
+        self._loader = None
+        self._lock = threading.Lock()
+        # Loads are serialized (a single model is loaded at once)
+        self._load_lock = threading.Lock()
+        # Loading time of every model (seconds)
+        self.load_times = {}
+        # Evicted models waiting to be released
+        self._releases = queue.Queue()
+        self._releaser = None
+
+    @property
+    def names(self):
+        ''' Names of the available models '''
+        return list(factories.keys())
+
+    @property
+    def active(self):
+        ''' Currently active model wrapper '''
+        return self._active
+
+    @property
+    def active_name(self):
+        ''' Name of the currently active model '''
+        return self._active_name
+
+    def is_warm(self, name: str):
+        ''' Check if a model is loaded in memory '''
+        with self._lock:
+            return name in self._warm
+
+    def get(self, name: str):
+        '''
+            Return a loaded model, loading it if needed (blocking).
+            Parameters:
+                name:       [str]
+                            Name of the model (rave, nsf, ddsp)
+        '''
+        if name not in factories:
+            raise NotImplementedError('Unknown model ' + name)
+        with self._load_lock:
+            with self._lock:
+                if name in self._warm:
+                    self._warm.move_to_end(name)
+                    return self._warm[name]
+            print('[Registry] Loading ' + name)
+            cur_time = time.monotonic()
+            model = create_model(name, self.device)
+            model.preload()
+            self.load_times[name] = time.monotonic() - cur_time
+            print('[Registry] Loaded %s in %.2f s' % (name, self.load_times[name]))
+            with self._lock:
+                self._warm[name] = model
+                evicted = self._evict()
+        for model_name, model_evicted in evicted:
+            self.release(model_name, model_evicted)
+        return model
+
+    def _evict(self):
+        ''' Pop least-recently used models over the budget (lock held) '''
+        evicted = []
+        protected = [self._active_name, self._pending and self._pending[0]]
+        for name in list(self._warm.keys()):
+            if len(self._warm) <= self._n_warm:
+                break
+            if name not in protected:
+                evicted.append((name, self._warm.pop(name)))
+        return evicted
+
+    def release(self, name: str, model):
+        '''
+            Hand an evicted model over to the releaser thread (unloading can
+            join threads and collect memory, which must not stall audio).
+        '''
+        if self._releaser is None:
+            self._releaser = threading.Thread(target=self.release_loop, daemon=True)
+            self._releaser.start()
+        self._releases.put((name, model))
+
+    def release_loop(self):
+        ''' Releaser thread : frees the memory held by evicted models '''
+        while True:
+            name, model = self._releases.get()
+            print('[Registry] Evicting ' + name)
+            if hasattr(model, 'unload'):
+                model.unload()
+            del model
+            gc.collect()
+            if 'torch' in sys.modules and sys.modules['torch'].cuda.is_available():
+                sys.modules['torch'].cuda.empty_cache()
+            self._releases.task_done()
+
+    def wait_releases(self):
+        ''' Wait until all evicted models have been released '''
+        self._releases.join()
+
+    def activate(self, name: str):
+        '''
+            Load a model (blocking) and make it active immediately.
+            Only used when no stream is running (e.g. at startup).
+        '''
+        model = self.get(name)
+        with self._lock:
+            self._active, self._active_name = model, name
+            self._pending = None
+        return model
+
+    def request(self, name: str, force: bool = False):
+        '''
+            Request a model switch without blocking: the model is loaded in
+            a background thread if needed, then becomes pending until the
+            audio thread calls swap.
+            Parameters:
+                name:       [str]
+                            Name of the model (rave, nsf, ddsp)
+                force:      [bool], optional
+                            Switch even if the model is already active
+        '''
+        if name not in factories:
+            print('[Registry] Unknown model ' + name)
+            return
+        if name == self._active_name and self._pending is None and not force:
+            return
+        def load():
+            try:
+                model = self.get(name)
+            except Exception as e:
+                print('[Registry] Failed loading %s : %s' % (name, str(e)))
+                return
+            with self._lock:
+                self._pending = (name, model)
+        self._loader = threading.Thread(target=load, daemon=True)
+        self._loader.start()
+
+    def wait(self):
+        ''' Wait for the end of the current background load '''
+        if self._loader is not None:
+            self._loader.join()
+
+    def reload(self, name: str = None):
+        '''
+            Drop a model from memory and load it again from disk, then
+            switch to it at the next block boundary.
+            Parameters:
+                name:       [str], optional
+                            Name of the model [default: active model]
+        '''
+        name = name or self._active_name
+        with self._lock:
+            model = self._warm.pop(name, None)
+        if model is not None and model is not self._active:
+            self.release(name, model)
+        self.request(name, force=True)
+
+    def swap(self):
+        '''
+            Install the pending model as the active one. Called by the audio
+            thread between two blocks, so that the stream never stops (only
+            the references are switched, evicted models are released by the
+            releaser thread).
+            Returns:
+                True if the active model changed
+        '''
+        if self._pending is None:
+            return False
+        with self._lock:
+            (name, model), self._pending = self._pending, None
+            previous = self._active
+            self._active, self._active_name = model, name
+            evicted = self._evict()
+            # A reloaded model is no longer in the pool once replaced
+            if previous is not None and previous is not model and \
+                    not any(previous is m for m in self._warm.values()) and \
+                    not any(previous is m for _, m in evicted):
+                evicted.append((name, previous))
+        for model_name, model_evicted in evicted:
+            self.release(model_name, model_evicted)
+        print('[Registry] Active model : ' + name)
+        return True
+
+
+if __name__ == '__main__':
+    # Exercise the warm pool and the hot swap with dummy wrappers
+    class Dummy():
+        def __init__(self, device):
+            self.device = device
+        def preload(self):
+            time.sleep(0.1)
+        def unload(self):
+            # Slow unload (e.g. joining a generation thread)
+            time.sleep(0.5)
+    for n in ['a', 'b', 'c']:
+        factories[n] = Dummy
+    registry = ModelRegistry(device='cpu', n_warm=2)
+    registry.activate('a')
+    for n in ['b', 'c', 'a', 'b']:
+        registry.request(n)
+        while True:
+            cur_time = time.monotonic()
+            swapped = registry.swap()
+            assert time.monotonic() - cur_time < 0.1, 'swap blocked by a release'
+            if swapped:
+                break
+            time.sleep(0.01)
+        print(registry.active_name, list(registry._warm.keys()))
+        assert registry.active_name == n and len(registry._warm) <= 2
+    registry.reload()
+    while not registry.swap():
+        time.sleep(0.01)
+    registry.wait_releases()
+    print(registry.active_name, list(registry._warm.keys()), registry.load_times)
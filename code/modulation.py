@@ -0,0 +1,214 @@
+"""
+
+ ~ Neurorack project ~
+ Modulation : CV to latent modulation matrix
+
+ This file defines the routing of the CVs to the latent dimensions of
+ the models. The routing (n_cvs x max_latents) lives in the shared state,
+ every route having a scale, an offset and a curve, and is edited by
+ the assignment menu (see assign_route). The number of latents of the
+ active model is read from its encoder and published by the audio process
+ (see publish_latents). The audio process evaluates the gain of every
+ latent from a CV snapshot in one vectorized operation per block,
+ smoothed by a one-pole filter per latent (evaluated at the latent frame
+ rate) to avoid zipper artifacts.
+ A routed CV multiplies its latent by offset + scale * curve(cv), only
+ while the CV is active (several routes to a latent are multiplied).
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import numpy as np
+
+
+def assign_route(state,
+                 cv: int,
+                 latent: int,
+                 scale: float = 1.0,
+                 offset: float = 0.0,
+                 curve: float = 1.0):
+    '''
+        Route a CV to a latent dimension (writer side, single process).
+        Parameters:
+            cv:         [int]
+                        Index of the CV
+            latent:     [int]
+                        Index of the latent dimension
+            scale:      [float], optional
+                        Scale of the curved CV [default: 1.0]
+            offset:     [float], optional
+                        Offset added to the scaled CV [default: 0.0]
+            curve:      [float], optional
+                        Exponent applied to the CV magnitude [default: 1.0]
+    '''
+    mod = state['modulation']
+    state['modulation_seq'].write_begin()
+    mod['routed'][cv, latent] = 1
+    mod['scale'][cv, latent] = scale
+    mod['offset'][cv, latent] = offset
+    mod['curve'][cv, latent] = curve
+    state['modulation_seq'].write_end()
+
+
+def clear_route(state, cv: int, latent: int = None):
+    '''
+        Remove the route of a CV to a latent (all routes of the CV if None).
+    '''
+    state['modulation_seq'].write_begin()
+    state['modulation']['routed'][cv, slice(None) if latent is None else latent] = 0
+    state['modulation_seq'].write_end()
+
+
+def publish_latents(state, n_latents: int):
+    '''
+        Publish the number of latents of the active model (read from its
+        encoder at load time), and bound the latent of the route editor.
+        Models with more latents than the shared routing only get their
+        first latents modulated (with a warning).
+        Returns:
+            Number of latents that can be routed
+    '''
+    capacity = state['modulation']['routed'].shape[1]
+    if n_latents > capacity:
+        print('[Modulation] Model has %d latents, only the first %d can be routed '
+              '(see config.audio.max_latents)' % (n_latents, capacity))
+        n_latents = capacity
+    state['audio']['n_latents'].value = n_latents
+    state['audio']['route_latent_range'][1] = max(n_latents - 1, 1)
+    return n_latents
+
+
+def read_routing(state):
+    '''
+        Consistent snapshot of the routing.
+        Returns:
+            Tuple of (routed, scale, offset, curve) numpy arrays (n_cvs, n_latents)
+    '''
+    mod = state['modulation']
+    return state['modulation_seq'].read(lambda: (mod['routed'].astype(bool), mod['scale'].copy(),
+                                                 mod['offset'].copy(), mod['curve'].copy()))
+
+
+def format_routing(state):
+    ''' Text lines describing the active routes '''
+    routed, scale, offset, curve = read_routing(state)
+    return ['cv%d > lat%d x%.2f %+.2f ^%.2f' % (c, l, scale[c, l], offset[c, l], curve[c, l])
+            for c, l in zip(*np.nonzero(routed))]
+
+
+class ModulationMatrix():
+    '''
+        The ModulationMatrix class evaluates the latent gains of the routing
+        in the shared state (reader side, keeps the smoothing state).
+    '''
+
+    def __init__(self,
+                 state,
+                 block_time: float,
+                 smoothing: float = 0.05,
+                 n_latents: int = None):
+        '''
+            Constructor - Creates a new instance of the ModulationMatrix class.
+            Parameters:
+                state:      [dict]
+                            Shared state of the rack
+                block_time: [float]
+                            Duration of an audio block (in seconds)
+                smoothing:  [float], optional
+                            Time constant of the gain smoothing (in seconds)
+                n_latents:  [int], optional
+                            Number of latents of the model (see publish_latents)
+                            [default: all the latents of the routing]
+        '''
+        self._state = state
+        self._block_time = block_time
+        self._smoothing = smoothing
+        self._version = -1
+        self._routing = None
+        if n_latents is None:
+            n_latents = state['modulation']['routed'].shape[1]
+        self.n_latents = n_latents
+        self._gains = np.ones(n_latents)
+        self._diff = np.zeros(n_latents)
+        self._ramp = None
+        self._out = None
+
+    def targets(self, cv: np.ndarray, active: np.ndarray):
+        '''
+            Target gain of every latent for a CV snapshot.
+            Parameters:
+                cv:         [np.ndarray]
+                            Values of the CVs
+                active:     [np.ndarray]
+                            Activity flags of the CVs
+        '''
+        # The routing is only copied again when it has been edited
+        version = self._state['modulation_seq'].version
+        if version != self._version or self._routing is None:
+            self._routing = tuple([r[:, :self.n_latents] for r in read_routing(self._state)])
+            self._version = version
+        routed, scale, offset, curve = self._routing
+        x = cv[:, np.newaxis]
+        values = offset + scale * np.sign(x) * np.abs(x) ** curve
+        mask = routed & (active[:, np.newaxis] != 0)
+        return np.where(mask, values, 1.0).prod(axis=0)
+
+    def process(self, cv: np.ndarray, active: np.ndarray, n_frames: int):
+        '''
+            Smoothed gains of every latent over the frames of a block.
+            Parameters:
+                cv:         [np.ndarray]
+                            Values of the CVs
+                active:     [np.ndarray]
+                            Activity flags of the CVs
+                n_frames:   [int]
+                            Number of latent frames in the block
+            Returns:
+                Gains (n_latents, n_frames), reused by the next call
+        '''
+        target = self.targets(cv, active)
+        if self._ramp is None or self._ramp.shape[0] != n_frames:
+            # Step response of the one-pole filter at the latent frame rate
+            coef = 0.0
+            if self._smoothing > 0:
+                coef = np.exp(-self._block_time / (n_frames * self._smoothing))
+            self._ramp = coef ** np.arange(1, n_frames + 1)
+            self._out = np.zeros((target.shape[0], n_frames))
+        # Closed form of the filter for a constant target over the block
+        np.subtract(self._gains, target, out=self._diff)
+        np.multiply.outer(self._diff, self._ramp, out=self._out)
+        self._out += target[:, np.newaxis]
+        self._gains[:] = self._out[:, -1]
+        return self._out
+
+
+if __name__ == '__main__':
+    import time
+    from shared_state import create_state
+    # Default routing, then a CV step (smoothed towards its target)
+    state = create_state()
+    print('\n'.join(format_routing(state)))
+    matrix = ModulationMatrix(state, 2048 / 22050, smoothing=0.05)
+    cv, active = np.ones(6), np.zeros(6, dtype=int)
+    assert np.allclose(matrix.process(cv, active, 4), 1)
+    cv[3], active[3] = 0.5, 1
+    gains = matrix.process(cv, active, 4)
+    print(gains[1])
+    assert 0.5 < gains[1, -1] < gains[1, 0] < 1 and np.allclose(gains[0], 1)
+    for _ in range(20):
+        gains = matrix.process(cv, active, 4)
+    assert abs(gains[1, -1] - 0.5) < 1e-3
+    clear_route(state, 3)
+    assign_route(state, 3, 0, scale=2.0, offset=1.0, curve=2.0)
+    assert np.isclose(matrix.targets(cv, active)[0], 1.5) and matrix.targets(cv, active)[1] == 1
+    # Gains of the latents of the model only
+    assert publish_latents(state, 4) == 4 and state['audio']['route_latent_range'][1] == 3
+    assert ModulationMatrix(state, 2048 / 22050, n_latents=4).process(cv, active, 4).shape == (4, 4)
+    cur_time = time.perf_counter()
+    for _ in range(1000):
+        matrix.process(cv, active, 4)
+    print('Block evaluation : %.1f us' % ((time.perf_counter() - cur_time) * 1e3))
@@ -0,0 +1,112 @@
+"""
+
+ ~ Neurorack project ~
+ NSF quality : Quality checks of the NSF inference approximations
+
+ This file renders the features of the bundled sounds with the exact NSF
+ model and with its approximated inference modes (decimated sinc
+ coefficients, cut-off LUT), and reports the SNR of every approximation
+ against the exact rendering, along with the rendering times.
+ The noise sources are seeded identically so that only the approximation
+ differs between two renderings.
+
+ Usage:
+     python nsf_quality.py --decimation 32 128 512 --lut 1024
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append('models/nsf')
+from models.features import FeatureCache
+
+
+def snr(ref, out):
+    ''' Signal-to-noise ratio (in dB) of an approximation against a reference '''
+    return 10 * np.log10(np.sum(ref ** 2) / max(np.sum((out - ref) ** 2), 1e-20))
+
+
+def render(model, features, seed=0):
+    ''' Render features with a fixed seed, returns audio and time '''
+    torch.manual_seed(seed)
+    cur_time = time.perf_counter()
+    with torch.no_grad():
+        audio = model(features)
+    return audio.squeeze().cpu().numpy(), time.perf_counter() - cur_time
+
+
+def time_coef(model, length, n_runs=5):
+    ''' Time of the sinc coefficients generation alone (smooth random cut-off) '''
+    cut_f = torch.rand(1, length // 512 + 1, 1)
+    cut_f = torch.nn.functional.interpolate(cut_f.transpose(1, 2), size=length, mode='linear')
+    cut_f = (0.1 + 0.8 * cut_f.transpose(1, 2)).to(next(model.parameters()).device)
+    with torch.no_grad():
+        model.m_filter.sinc_coef(cut_f)
+        cur_time = time.perf_counter()
+        for _ in range(n_runs):
+            model.m_filter.sinc_coef(cut_f)
+    return (time.perf_counter() - cur_time) / n_runs
+
+
+def set_mode(model, decimation=None, lut=None):
+    ''' Select the approximations of the sinc filtering '''
+    model.m_filter.set_coef_decimation(decimation)
+    model.m_filter.l_sinc_coef.set_lut(lut)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Quality checks of the NSF approximations')
+    parser.add_argument('--model',          type=str, default='models/model_nsf_sinc_impacts_waveform_5.0.th', help='NSF checkpoint')
+    parser.add_argument('--data',           type=str, default='data/',      help='folder of audio files')
+    parser.add_argument('--device',         type=str, default='cpu',        help='device cuda or cpu')
+    parser.add_argument('--frames',         type=int, default=100,          help='maximum number of frames per sound')
+    parser.add_argument('--decimation',     type=int, nargs='*', default=[32, 128, 512], help='sinc coefficients decimations')
+    parser.add_argument('--lut',            type=int, nargs='*', default=[1024], help='cut-off LUT sizes')
+    args = parser.parse_args()
+    model = torch.load(args.model, map_location=args.device)
+    model.eval()
+    modes = [('decimation %d' % d, {'decimation': d}) for d in args.decimation]
+    modes += [('lut %d' % l, {'lut': l}) for l in args.lut]
+    modes += [('decimation %d + lut %d' % (d, l), {'decimation': d, 'lut': l})
+              for d in args.decimation for l in args.lut]
+    cache = FeatureCache()
+    wavs = sorted([f for f in os.listdir(args.data) if f.endswith('.wav')])
+    results = {name: [] for name, _ in modes}
+    times = {name: [] for name, _ in modes}
+    times['exact'] = []
+    for wav in wavs:
+        features = np.array(cache.load(os.path.join(args.data, wav)))[:args.frames]
+        features = torch.tensor(features).unsqueeze(0).float().to(args.device)
+        set_mode(model)
+        ref, t_ref = render(model, features)
+        times['exact'].append(t_ref)
+        line = '%-40s' % wav[:40]
+        for name, mode in modes:
+            set_mode(model, **mode)
+            out, t_cur = render(model, features)
+            results[name].append(snr(ref, out))
+            times[name].append(t_cur)
+            line += ' %6.1f dB' % results[name][-1]
+        print(line)
+    # Coefficients generation alone (10 seconds of audio)
+    set_mode(model)
+    print('%-30s %10s %10s %11s %11s' % ('mode', 'mean SNR', 'min SNR', 'render', 'coefs 10s'))
+    print('%-30s %10s %10s %8.1f ms %8.1f ms' % (
+        'exact', '-', '-', 1e3 * np.mean(times['exact']), 1e3 * time_coef(model, 220500)))
+    for name, mode in modes:
+        set_mode(model, **mode)
+        print('%-30s %7.1f dB %7.1f dB %8.1f ms %8.1f ms' % (
+            name, np.mean(results[name]), np.min(results[name]),
+            1e3 * np.mean(times[name]), 1e3 * time_coef(model, 220500)))
+    set_mode(model)
@@ -20,6 +20,7 @@ import digitalio
 from PIL import Image, ImageDraw, ImageFont
 
 import board
+from boot import format_summary
 from config import config
 from graphics.graphics import GraphicScene, DynamicTextGraphic
 from graphics.menu import Menu
@@ -130,13 +131,19 @@ class Screen(ProcessInput):
         self._font = ImageFont.truetype(config.text.font_main, config.text.size_main)
         self._font_big = ImageFont.truetype(config.text.font_main, config.text.size_big)
         self._font_large = ImageFont.truetype(config.text.font_main, config.text.size_large)
+        self._font_small = ImageFont.truetype(config.text.font_main, config.text.size_small)
 
     def init_graphic_scenes(self, state):
+        # Startup summary in small text, capped to the lines fitting the screen
+        line_height = self._font_small.getsize('Ag')[1]
+        self._n_report = min(len(state['boot_report']), max(1, self._height // line_height))
         self._main_scene = GraphicScene(
             x=config.screen.main_x,
             y=config.screen.padding,
             absolute=True,
-            elements=[  # DynamicTextGraphic(state['stats']['ip'], color=config.colors.white),
+            elements=[DynamicTextGraphic(line, font=self._font_small, color=config.colors.white)
+                      for line in state['boot_report'][:self._n_report]] + [
+                # DynamicTextGraphic(state['stats']['ip'], color=config.colors.white),
                 # DynamicTextGraphic(state['stats']['cpu'], color=config.colors.white),
                 # DynamicTextGraphic(state['stats']['memory'], color=config.colors.white),
                 # DynamicTextGraphic(state['stats']['disk'], color=config.colors.white),
@@ -173,11 +180,15 @@ class Screen(ProcessInput):
 
     def perform_update(self, state):
         self._cur_stats = self._stats.retrieve_stats()
-        state['stats']['ip'].value = self._cur_stats[0]
-        state['stats']['cpu'].value = self._cur_stats[1]
-        state['stats']['memory'].value = self._cur_stats[2]
-        state['stats']['disk'].value = self._cur_stats[3]
-        state['stats']['temperature'].value = self._cur_stats[4]
+        state['stats']['ip'].value = self._cur_stats[0].encode('utf-8')
+        state['stats']['cpu'].value = self._cur_stats[1].encode('utf-8')
+        state['stats']['memory'].value = self._cur_stats[2].encode('utf-8')
+        state['stats']['disk'].value = self._cur_stats[3].encode('utf-8')
+        state['stats']['temperature'].value = self._cur_stats[4].encode('utf-8')
+        # Startup summary (filled as the boot phases of all processes end)
+        lines = format_summary(state, self._n_report)
+        for i, line in enumerate(state['boot_report'][:self._n_report]):
+            line.value = (lines[i] if i < len(lines) else '').encode('utf-8')
 
     def handle_signal_event(self, state):
         mode = state["screen"]["mode"].value
@@ -0,0 +1,173 @@
+"""
+
+ ~ Neurorack project ~
+ Shared state : Typed shared memory for the rack state
+
+ This file defines the state shared by all processes of the rack.
+ Every field is a raw ctypes object allocated in shared memory before
+ the processes are forked, so that reads and writes are plain memory
+ accesses instead of round-trips to a multiprocessing Manager.
+ Multi-value reads of the CVs are made consistent through a seqlock.
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import threading
+from ctypes import c_char, c_double, c_int, c_long, c_ulong
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+import numpy as np
+
+from buffers import TriggerQueue
+from config import config
+
+
+class SeqLock():
+    '''
+        The SeqLock class implements a sequence lock over shared memory.
+        Writers increment the sequence before and after writing (so that it is
+        odd during a write) and readers retry until they observe the same even
+        sequence before and after reading. Readers never block writers.
+        All writers must live in the same process (they are serialized by a
+        local lock).
+    '''
+
+    def __init__(self):
+        self._seq = RawValue(c_ulong, 0)
+        self._write_lock = threading.Lock()
+
+    def write_begin(self):
+        ''' Mark the beginning of a write '''
+        self._write_lock.acquire()
+        self._seq.value += 1
+
+    def write_end(self):
+        ''' Mark the end of a write '''
+        self._seq.value += 1
+        self._write_lock.release()
+
+    def read(self, func: callable):
+        '''
+            Perform a consistent read.
+            Parameters:
+                func:       [callable]
+                            Function copying the protected values
+            Returns:
+                Result of func from a read that did not overlap a write
+        '''
+        while True:
+            seq = self._seq.value
+            if seq & 1:
+                continue
+            result = func()
+            if self._seq.value == seq:
+                return result
+
+    @property
+    def version(self):
+        ''' Current sequence number (even when no write is ongoing) '''
+        return self._seq.value
+
+
+def text_value(size: int = 128):
+    ''' Shared fixed-size text value (read and written as bytes) '''
+    return RawArray(c_char, size)
+
+
+def shared_array(ctype, shape, value=0):
+    ''' Shared numeric array, exposed as a NumPy view over shared memory '''
+    array = np.ctypeslib.as_array(RawArray(ctype, int(np.prod(shape)))).reshape(shape)
+    array[:] = value
+    return array
+
+
+def create_state(n_cvs: int = 6, buffer_size: int = 301):
+    '''
+        Create the shared memory state for the full rack.
+        The returned dictionary keeps the same logical fields as the
+        previous Manager-based state : scalars expose a .value attribute,
+        and CV banks are NumPy arrays viewing shared memory.
+        Parameters:
+            n_cvs:          [int], optional
+                            Number of CV channels
+            buffer_size:    [int], optional
+                            Length of the CV history buffers
+    '''
+    state = {}
+    state['global'] = {}
+    state['cv'] = shared_array(c_double, n_cvs, 0.0)
+    state['cv_active'] = shared_array(c_int, n_cvs, 0)
+    state['cv_seq'] = SeqLock()
+    state['buffer'] = shared_array(c_double, (n_cvs, buffer_size), 1.0)
+    # Achieved acquisition rate and jitter (seconds) of each CV
+    state['cv_rate'] = shared_array(c_double, n_cvs, 0.0)
+    state['cv_jitter'] = shared_array(c_double, n_cvs, 0.0)
+    state['rotary'] = RawValue(c_int, 0)
+    state['rotary_delta'] = RawValue(c_int, 0)
+    state['button'] = RawValue(c_int, 0)
+    # Screen-related parameters (dict)
+    state['screen'] = {}
+    state['screen']['mode'] = RawValue(c_int, 0)
+    state['screen']['event'] = RawValue(c_int, 0)
+    # Audio-related parameters (dict)
+    state['audio'] = {}
+    state['audio']['mode'] = RawValue(c_int, 0)
+    state['audio']['event'] = RawValue(c_int, -1)
+    state['audio']['model'] = text_value(32)
+    state['audio']['volume'] = RawValue(c_double, 1.0)
+    state['audio']['volume_range'] = [0.0, 1.0]
+    state['audio']['stereo'] = RawValue(c_double, 0)
+    state['audio']['stereo_range'] = [-1.0, 1.0]
+    state['audio']['range'] = RawValue(c_double, 0)
+    state['audio']['range_range'] = [0.0, 1.0]
+    state['audio']['underruns'] = RawValue(c_long, 0)
+    state['audio']['overruns'] = RawValue(c_long, 0)
+    # Gate triggers (CV process to audio callback) and gate-to-sound latency
+    # histogram (1 ms bins, the last bin counts all larger latencies)
+    state['triggers'] = TriggerQueue(64)
+    state['audio']['latency_hist'] = shared_array(c_long, config.audio.latency_bins, 0)
+    state['audio']['latency_late'] = RawValue(c_long, 0)
+    # CV to latent routing (see modulation), edited by the assignment menu.
+    # The number of latents of the active model is set by the audio process
+    shape = (n_cvs, config.audio.max_latents)
+    state['audio']['n_latents'] = RawValue(c_int, 0)
+    state['modulation'] = {'routed': shared_array(c_int, shape, 0),
+                           'scale': shared_array(c_double, shape, 1.0),
+                           'offset': shared_array(c_double, shape, 0.0),
+                           'curve': shared_array(c_double, shape, 1.0)}
+    for cv, latent in config.audio.mod_routes:
+        state['modulation']['routed'][cv, latent] = 1
+    state['modulation_seq'] = SeqLock()
+    # Route editor of the assignment menu (sliders, applied by assign_cv)
+    state['audio']['route_cv'] = RawValue(c_double, config.audio.mod_routes[0][0])
+    state['audio']['route_cv_range'] = [0.0, n_cvs - 1.0]
+    state['audio']['route_latent'] = RawValue(c_double, config.audio.mod_routes[0][1])
+    state['audio']['route_latent_range'] = shared_array(c_double, 2, 0.0)
+    state['audio']['route_latent_range'][1] = config.audio.max_latents - 1
+    state['audio']['route_scale'] = RawValue(c_double, 1.0)
+    state['audio']['route_scale_range'] = config.audio.mod_scale_range
+    state['audio']['route_curve'] = RawValue(c_double, 1.0)
+    state['audio']['route_curve_range'] = config.audio.mod_curve_range
+    # Boot phases durations (seconds, -1 until run) and startup report lines
+    state['boot'] = shared_array(c_double, len(config.boot.phases), -1.0)
+    state['boot_start'] = RawValue(c_double, 0)
+    state['boot_report'] = [text_value(32) for _ in range(config.boot.report_lines)]
+    # Stats (cpu, memory) computing
+    state['stats'] = {}
+    for stat in ['ip', 'cpu', 'memory', 'disk', 'temperature']:
+        state['stats'][stat] = text_value()
+        state['stats'][stat].value = stat.encode('utf-8')
+    return state
+
+
+def read_cvs(state):
+    '''
+        Consistent snapshot of the CV values and activity flags.
+        Returns:
+            Tuple of (values, active) numpy arrays
+    '''
+    return state['cv_seq'].read(lambda: (state['cv'].copy(), state['cv_active'].copy()))
@@ -1,30 +1,12 @@
-import sklearn
 import torch
-import librosa
 import numpy as np
 import time
 import os
-import tqdm
-import soundfile as sf
-import matplotlib.pyplot as plt
-
-
-def spectral_features(y, sr):
-    features = [None] * 7
-    features[0] = librosa.feature.rms(y)
-    features[1] = librosa.feature.zero_crossing_rate(y)
-    # Spectral features
-    S, phase = librosa.magphase(librosa.stft(y=y))
-    # Compute all descriptors
-    features[2] = librosa.feature.spectral_rolloff(S=S)
-    features[3] = librosa.feature.spectral_flatness(S=S)
-    features[4] = librosa.feature.spectral_bandwidth(S=S)
-    features[5] = librosa.feature.spectral_centroid(S=S)
-    features[6] = librosa.yin(y, 50, 5000, sr=sr)[np.newaxis, :]
-    features = np.concatenate(features).transpose()
-    features[np.isnan(features)] = 1
-    features = features[:-1, :]
-    return features
+from lazy import lazy_import
+from models.features import FeatureCache
+from writers import WavWriter
+
+tqdm = lazy_import('tqdm')
 
 
 class NSF:
@@ -39,9 +21,7 @@ class NSF:
         self._wav_file = 'data/reference_impact.wav'
 
     def dummy_features(self, wav):
-        y, sr = librosa.load(wav)
-        features = spectral_features(y, sr)
-        return features
+        return np.array(FeatureCache().load(wav))
 
     def preload(self):
         self._model = torch.load(self.m_path, map_location="cuda")
@@ -87,9 +67,93 @@ class NSF:
         return interp
 
 
+class BatchRenderer:
+    '''
+        The BatchRenderer class accumulates feature tensors of the same
+        length and renders them as a single batch through the model.
+        The batch size is bounded by max_batch and by a memory budget, and
+        the resulting files are handed to a background WavWriter.
+    '''
+
+    def __init__(self, model, writer, sr=22050, max_batch=16, memory_budget=2 ** 30):
+        '''
+            Parameters:
+                model:          [NSF]
+                                Model wrapper (generate on (batch, length, 7) features)
+                writer:         [WavWriter]
+                                Background writer of the generated files
+                max_batch:      [int], optional
+                                Maximum number of sounds per forward pass
+                memory_budget:  [int], optional
+                                Memory (in bytes) allowed for one forward pass
+        '''
+        self._model = model
+        self._writer = writer
+        self._sr = sr
+        self._max_batch = max_batch
+        self._memory_budget = memory_budget
+        self._bytes_per_frame = None
+        self._pending = {}
+
+    def item_memory(self, features):
+        ''' Estimated memory (in bytes) to render one sound '''
+        if self._bytes_per_frame is None:
+            net = self._model._model
+            if features.is_cuda:
+                # Calibrate on a single sound
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+                base = torch.cuda.memory_allocated()
+                self._model.generate(features[:1])
+                self._bytes_per_frame = (torch.cuda.max_memory_allocated() - base) / features.shape[1]
+            else:
+                # Hidden activations of the filter module alive at the same time
+                self._bytes_per_frame = net.upsamp_rate * net.hidden_dim * 4 * 8
+        return self._bytes_per_frame * features.shape[1]
+
+    def batch_size(self, features):
+        n_budget = int(self._memory_budget // max(self.item_memory(features), 1))
+        return max(1, min(self._max_batch, n_budget))
+
+    def add(self, features, path):
+        '''
+            Queue a sound for rendering (rendered once a batch is full).
+            Parameters:
+                features:   [torch.Tensor]
+                            Features of shape (1, length, 7)
+                path:       [str]
+                            Output file
+        '''
+        pending = self._pending.setdefault(features.shape[1], [])
+        pending.append((features, path))
+        if len(pending) >= self.batch_size(features):
+            self.render(pending)
+            pending.clear()
+
+    def render(self, items):
+        features = torch.cat([f for f, _ in items], dim=0)
+        audio = np.atleast_2d(self._model.generate(features))
+        for (_, path), a in zip(items, audio):
+            self._writer.write(path, a, self._sr)
+
+    def flush(self):
+        ''' Render all remaining sounds '''
+        for pending in self._pending.values():
+            if len(pending) > 0:
+                self.render(pending)
+        self._pending = {}
+
+
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Interpolation sweeps of the NSF model')
+    parser.add_argument('--max_batch',      type=int, default=16,           help='maximum sounds per forward pass')
+    parser.add_argument('--memory',         type=float, default=1.0,        help='memory budget per forward pass (GB)')
+    parser.add_argument('--writers',        type=int, default=2,            help='number of writing threads')
+    args = parser.parse_args()
     model = NSF()
     model.preload()
+    writer = WavWriter(args.writers)
     # for wav in wav_adresses:
     wav_list = ['160_Bpm_Cinematic_Impact_6.wav',
                 'ACEAURA_FX_impact_star_03_stripped.wav',
@@ -100,14 +164,13 @@ if __name__ == '__main__':
                 'SH_FFX_123BPM_IMPACT_01.wav']
     feats = []
     cur_imp = 0
+    sr = 22050
     for wav in wav_list:
-        y, sr = librosa.load('data/' + wav)
-        features = spectral_features(y, sr)
+        features = model.dummy_features('data/' + wav)
         features = torch.tensor(features).unsqueeze(0).float().cuda()  # .cuda().float()
-        torch.save(features, "models/features_interp" + str(wav) + ".th")
         print('Generate ' + wav)
         audio = model.generate(features)
-        sf.write("generation_testing/" + str(cur_imp) + ".wav", audio, sr)
+        writer.write("generation_testing/" + str(cur_imp) + ".wav", audio, sr)
         feats.append(features)
         cur_imp += 1
     t_len = [t.shape[1] for t in feats]
@@ -142,17 +205,19 @@ if __name__ == '__main__':
                 rep_feat = feats[f].clone()
                 rep_feat[:, :, k] = (((func + torch.min(func)) / torch.std(func)) * 0.5) + 0.25
                 audio = model.generate(rep_feat)
-                sf.write(fin_path + '.wav', audio, sr)
+                writer.write(fin_path + '.wav', audio, sr)
                 rep_feat = feats[f].clone()
                 rep_feat[:, :, k] *= func
                 audio = model.generate(rep_feat)
-                sf.write(fin_path + '_modulate.wav', audio, sr)
+                writer.write(fin_path + '_modulate.wav', audio, sr)
                 rep_feat = feats[f].clone()
                 rep_feat[:, :, k] *= (((func + torch.min(func)) / torch.std(func)) * 0.5) + 0.25
                 audio = model.generate(rep_feat)
-                sf.write(fin_path + '_modulate_normed.wav', audio, sr)
+                writer.write(fin_path + '_modulate_normed.wav', audio, sr)
     """
     # %% Now interpolate
+    renderer = BatchRenderer(model, writer, sr, args.max_batch, int(args.memory * 2 ** 30))
+    cur_time = time.time()
     for s in possible_sets:
         s_path = "generation_testing/"
         f_feats = []
@@ -168,6 +233,8 @@ if __name__ == '__main__':
                 cur_path += str(v) + '_'
             cur_path = cur_path[:-1] + '.wav'
             feats_interp = model.interp_trio(c, f_feats)
-            audio = model.generate(feats_interp)
             print(cur_path)
-            sf.write(cur_path, audio, sr)
+            renderer.add(feats_interp, cur_path)
+    renderer.flush()
+    writer.close()
+    print('Sweep rendered in %.2f s' % (time.time() - cur_time))
@@ -0,0 +1,116 @@
+"""
+
+ ~ Neurorack project ~
+ Writers : Background audio file writers
+
+ This file defines a pool of threads writing audio files in the
+ background, so that offline generation loops never wait on the disk.
+ Float signals can optionally be converted to 16-bit PCM by the
+ writing threads (as waveFloatToPCMFile of the NSF toolkit).
+
+ Author               :  Ninon Devis, Philippe Esling, Martin Vert
+                        <{devis, esling}@ircam.fr>
+
+ All authors contributed equally to the project and are listed aphabetically.
+
+"""
+
+import os
+import queue
+import threading
+
+import numpy as np
+import soundfile as sf
+
+
+def float_to_pcm16(audio):
+    ''' Convert a float signal in [-1, 1] to 16-bit PCM (clipping outside) '''
+    audio = np.asarray(audio, dtype=np.float64) * 2 ** 15
+    return np.clip(audio, -2 ** 15, 2 ** 15 - 1).astype(np.int16)
+
+
+class WavWriter():
+    '''
+        The WavWriter class writes audio files from a bounded queue with a
+        pool of worker threads. Submitting blocks when the queue is full,
+        which bounds the memory held by pending files.
+    '''
+
+    def __init__(self,
+                 n_threads: int = 2,
+                 max_queue: int = 32,
+                 pcm16: bool = False):
+        '''
+            Constructor - Creates a new instance of the WavWriter class.
+            Parameters:
+                n_threads:  [int], optional
+                            Number of writing threads [default: 2]
+                max_queue:  [int], optional
+                            Maximum number of pending files [default: 32]
+                pcm16:      [bool], optional
+                            Convert float signals to 16-bit PCM [default: False]
+        '''
+        self._pcm16 = pcm16
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(n_threads)]
+        for thread in self._threads:
+            thread.start()
+        self._closed = False
+        # Paths of the files that could not be written
+        self.errors = []
+
+    def write(self, path: str, audio, sr: int, pcm16: bool = None):
+        '''
+            Queue an audio file for writing.
+            The audio array must not be modified by the caller afterwards.
+            Parameters:
+                path:       [str]
+                            Output path
+                audio:      [np.ndarray]
+                            Audio samples (samples, [channels])
+                sr:         [int]
+                            Sampling rate
+                pcm16:      [bool], optional
+                            Override the PCM16 conversion of the writer
+        '''
+        if self._closed:
+            raise RuntimeError('WavWriter is closed')
+        self._queue.put((path, audio, sr, self._pcm16 if pcm16 is None else pcm16))
+
+    def worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            path, audio, sr, pcm16 = item
+            try:
+                if pcm16:
+                    audio = float_to_pcm16(audio)
+                if os.path.dirname(path) != '':
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                sf.write(path, audio, sr)
+            except Exception as e:
+                print('[WavWriter] Failed writing ' + path + ' : ' + str(e))
+                self.errors.append(path)
+            self._queue.task_done()
+
+    def flush(self):
+        ''' Wait until all queued files have been written '''
+        self._queue.join()
+
+    def close(self):
+        ''' Write all pending files and stop the threads '''
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()